@@ -0,0 +1,39 @@
+"""Общие данные тестов сверки с перечнем: клиенты и перечни DD.MM.YYYY.xml в tmp_path."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+
+def write_perechen(path, excluded, actual):
+    """excluded — [ФИО]; actual — [(ФИО, ДР, [ДатаВключения / ДатаИзменения])]."""
+    subj = []
+    for fio, dob, dates in actual:
+        hist = "".join(f"<{tag}>{d}</{tag}>" for tag, d in dates)
+        subj.append(f"<Субъект><ФЛ><ФИО>{fio}</ФИО><ДатаРождения>{dob}</ДатаРождения></ФЛ>"
+                    f"<История>{hist}</История></Субъект>")
+    path.write_text(
+        '<?xml version="1.0" encoding="utf-8"?>\n<Перечень><ПоследниеИсключенные>'
+        + "".join(f"<Субъект><ФЛ><ФИО>{f}</ФИО></ФЛ></Субъект>" for f in excluded)
+        + "</ПоследниеИсключенные><АктуальныйПеречень>" + "".join(subj)
+        + "</АктуальныйПеречень></Перечень>", encoding="utf-8")
+    return str(path)
+
+
+CLIENTS = pd.DataFrame({
+    "ФИО": ["Иванов Иван Иванович", "ПЕТРОВ  пётр", "Сидоров Сидор", "Кузнецов Кузьма",
+            "Смирнов Семён", "Попов Павел", "Иванов Иван Иванович"],
+    "ДатаРождения": [datetime(1980, 1, 2), "1975-05-06", "1990-07-08", "1966-06-06",
+                     datetime(2001, 2, 3), None, datetime(1981, 1, 2)],
+})
+
+
+@pytest.fixture
+def perechen(tmp_path):
+    return write_perechen(tmp_path / "18.10.2026.xml", ["Смирнов Семен"], [
+        ("Иванов Иван Иванович", "1980-01-02", [("ДатаВключения", "2020-03-04")]),
+        # последняя из дат включения / изменения
+        ("Петров Пётр", "1975-05-06", [("ДатаВключения", "2019-01-01"), ("ДатаИзменения", "2026-10-18")]),
+        ("Кузнецов Кузьма", "1966-06-07", [("ДатаВключения", "2021-01-01")]),
+        ("Без Истории", "1970-01-01", []),
+    ])
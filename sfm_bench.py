@@ -0,0 +1,531 @@
+"""СФМ — бенчмарк проверок на синтетических данных, без окна и без cbr.ru.
+
+    python sfm_bench.py run                                   # 1k, 100k и 1M строк
+    python sfm_bench.py run --sizes 1000,100000 --only xml,banks --repeat 5
+    python sfm_bench.py compare bench_старый.json bench_новый.json --threshold 1.2
+
+run генерирует данные нужного размера (перечень XML, реестры ЦБ банков и МФО
+в формате cbr.ru, списки клиентов, отчёт по сделкам), поднимает локальный
+HTTP-сервер вместо cbr.ru и замеряет этапы каждой проверки: разбор, сверку,
+проверку целиком (холодную — без кэшей, и тёплую), экспорт результата и
+поиск по нему. Итог — таблица в stdout и отчёт JSON (--output), который
+сравнивается с прошлым командой compare.
+
+Данные кэшируются в --data-dir и генерируются заново только при смене
+размера или --seed. Кэши и метрики проверок пишутся во временный каталог
+прогона, а не в рабочий LOCALAPPDATA.
+
+Коды выхода compare: 0 — без регрессий, 1 — есть этапы медленнее порога.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PIPELINES     = ("xml", "banks", "mfo", "compare", "loans")
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+# Доли строк, которые должны совпасть — чтобы сверка шла по всем веткам
+PERECHEN_HIT_SHARE = 0.01     # клиентов из актуального перечня
+EXCLUDED_SHARE     = 0.02     # размер ПоследниеИсключенные от N, но не больше EXCLUDED_MAX
+EXCLUDED_MAX       = 1000
+UNKNOWN_SHARE      = 0.10     # банков / МФО на обслуживании, которых нет в реестре
+LIST_CHANGE_SHARE  = 0.01     # добавлено / удалено / изменено между списками
+LOAN_SHARE         = 0.05     # строк отчёта с ID клиентов из списка
+
+XML_DATE = date(2026, 10, 18)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ГЕНЕРАТОРЫ ДАННЫХ
+# ════════════════════════════════════════════════════════════════════════════
+
+# Фамилия = приставка + корень + окончание: ~2000 фамилий, ~1 млн разных ФИО —
+# совпадения по ФИО в списках на 1M строк остаются редкими, как в жизни
+SURNAME_PREFIXES = ("", "Бело", "Черно", "Ново", "Старо", "Красно", "Добро", "Остро", "Светло",
+                    "Велико", "Мало", "Громо")
+SURNAME_ROOTS    = ("Иван", "Петр", "Смирн", "Кузнец", "Поп", "Васил", "Сокол", "Михайл", "Новик",
+                    "Фёдор", "Мороз", "Волк", "Лебед", "Семён", "Егор", "Павл", "Козл", "Степан",
+                    "Никол", "Орл", "Андре", "Макар", "Никит", "Зайц", "Белк", "Тарас", "Гус",
+                    "Карп", "Медвед", "Ерш", "Щук", "Ёлк", "Соболь", "Журавл")
+SURNAME_ENDINGS  = ("ов", "ев", "ин", "ский", "енко")
+NAMES     = ("Александр", "Сергей", "Дмитрий", "Андрей", "Алексей", "Максим", "Евгений", "Иван",
+             "Михаил", "Артём", "Никита", "Роман", "Олег", "Павел", "Юрий", "Виктор", "Григорий",
+             "Владимир", "Николай", "Пётр", "Константин", "Денис", "Кирилл", "Тимур", "Илья")
+PATRONYMS = ("Александрович", "Сергеевич", "Дмитриевич", "Андреевич", "Алексеевич", "Иванович",
+             "Михайлович", "Петрович", "Юрьевич", "Викторович", "Олегович", "Павлович",
+             "Николаевич", "Владимирович", "Григорьевич", "Романович", "Денисович", "Ильич")
+BANK_STATUSES = (("Действующая", 70), ("Отозванная", 15), ("Аннулированная", 5),
+                 ("В стадии ликвидации", 5), ("Действующая, ограничения", 5))
+
+
+def _person(rng):
+    """(ФИО, дата рождения YYYY-MM-DD)."""
+    dob = date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 65))
+    surname = rng.choice(SURNAME_PREFIXES) + rng.choice(SURNAME_ROOTS) + rng.choice(SURNAME_ENDINGS)
+    return f"{surname.capitalize()} {rng.choice(NAMES)} {rng.choice(PATRONYMS)}", dob.isoformat()
+
+
+def _write_xlsx(path, sheets):
+    """sheets — {имя листа: итератор строк}; openpyxl write_only, как отдаёт cbr.ru."""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows: ws.append(row)
+    tmp = path + ".tmp.xlsx"
+    wb.save(tmp)
+    os.replace(tmp, path)
+
+
+class BenchData:
+    """Файлы одного размера n; генерируются один раз и лежат в каталоге n_seed."""
+
+    def __init__(self, root, n, seed):
+        self.n, self.seed = n, seed
+        self.dir = os.path.join(root, f"{n}_{seed}")
+        os.makedirs(self.dir, exist_ok=True)
+
+    def _file(self, name, make):
+        path = os.path.join(self.dir, name)
+        if not os.path.exists(path):
+            t0 = time.perf_counter()
+            make(path, random.Random(f"{self.seed}:{name}"))
+            print(f"  сгенерирован {name} ({self.n} строк, {time.perf_counter() - t0:.1f} с)", file=sys.stderr)
+        return path
+
+    # ── перечень и клиенты ──────────────────────────────────────────────────
+
+    def subjects(self):
+        rng = random.Random(f"{self.seed}:subjects")
+        return [_person(rng) for _ in range(self.n)]
+
+    def perechen_xml(self):
+        def make(path, rng):
+            subjects = self.subjects()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write('<?xml version="1.0" encoding="utf-8"?>\n<Перечень>\n<ПоследниеИсключенные>\n')
+                for _ in range(max(1, min(int(self.n * EXCLUDED_SHARE), EXCLUDED_MAX))):
+                    f.write(f"<Субъект><ФЛ><ФИО>{_person(rng)[0]}</ФИО></ФЛ></Субъект>\n")
+                f.write("</ПоследниеИсключенные>\n<АктуальныйПеречень>\n")
+                for fio, dob in subjects:
+                    # каждый сотый включён в день перечня — ветка «ДА» у сверки
+                    included = XML_DATE if rng.random() < 0.01 else \
+                        XML_DATE - timedelta(days=rng.randrange(1, 3000))
+                    f.write(f"<Субъект><ФЛ><ФИО>{fio}</ФИО><ДатаРождения>{dob}</ДатаРождения></ФЛ>"
+                            f"<История><ДатаВключения>{included.isoformat()}</ДатаВключения></История>"
+                            f"</Субъект>\n")
+                f.write("</АктуальныйПеречень>\n</Перечень>\n")
+        return self._file(f"{XML_DATE:%d.%m.%Y}.xml", make)
+
+    def clients_xlsx(self):
+        """Файл клиентов проверки по перечню: C — ФИО, D — дата рождения."""
+        def make(path, rng):
+            subjects = self.subjects()
+            def rows():
+                yield ["№", "ID", "ФИО", "Дата рождения"]
+                for i in range(self.n):
+                    fio, dob = rng.choice(subjects) if rng.random() < PERECHEN_HIT_SHARE else _person(rng)
+                    yield [i + 1, f"C{i:07d}", fio, dob]
+            _write_xlsx(path, {"Клиенты": rows()})
+        return self._file("clients.xlsx", make)
+
+    # ── реестры ЦБ и списки на обслуживании ─────────────────────────────────
+
+    @staticmethod
+    def ogrn(i): return str(1_027_700_000_000 + i)
+
+    @staticmethod
+    def inn(i): return str(7_700_000_000 + i)
+
+    def bank_registry_xlsx(self):
+        """Как выгрузка FullCoList: строки-заголовки, D — ОГРН, E — наименование, H — статус."""
+        def make(path, rng):
+            statuses = [s for s, w in BANK_STATUSES for _ in range(w)]
+            def rows():
+                yield ["Справочник по кредитным организациям"]
+                yield [f"на {XML_DATE:%d.%m.%Y}"]
+                yield ["№", "Рег. номер", "Вид", "ОГРН", "Наименование", "Адрес", "Дата рег.", "Статус лицензии"]
+                for i in range(self.n):
+                    yield [i + 1, str(1000 + i), "Банк", self.ogrn(i), f"АО «Банк {i}»", "г. Москва",
+                           "01.01.2000", rng.choice(statuses)]
+            _write_xlsx(path, {"Лист1": rows()})
+        return self._file("cbr_banks.xlsx", make)
+
+    def mfo_registry_xlsx(self):
+        """Как list_MFO.xlsx: три листа действующих (F — ИНН, H — имя) и Исключенные (G, I)."""
+        def make(path, rng):
+            excluded = self.n // 10
+            active   = self.n - excluded
+            def active_rows(lo, hi):
+                yield ["№", "Рег. номер", "Дата", "Вид", "ОГРН", "ИНН", "Форма", "Наименование"]
+                for i in range(lo, hi):
+                    yield [i + 1, f"{i:013d}", "01.01.2015", "МКК", self.ogrn(i), self.inn(i), "ООО",
+                           f"ООО МКК «Займ {i}»"]
+            def excluded_rows():
+                yield ["№", "Рег. номер", "Дата", "Дата искл.", "Вид", "ОГРН", "ИНН", "Форма", "Наименование"]
+                for i in range(active, self.n):
+                    yield [i + 1, f"{i:013d}", "01.01.2015", "01.01.2024", "МФК", self.ogrn(i), self.inn(i),
+                           "ООО", f"ООО МФК «Бывший {i}»"]
+            third = active // 3
+            _write_xlsx(path, {"Действующие": active_rows(0, third),
+                               "Действующие МФК": active_rows(third, 2 * third),
+                               "Действующие МКК": active_rows(2 * third, active),
+                               "Исключенные": excluded_rows()})
+        return self._file("list_MFO.xlsx", make)
+
+    def serviced_xlsx(self):
+        """Список на обслуживании: первый лист — ИНН МФО (A), лист «Банки» — ОГРН (A, без заголовка)."""
+        def make(path, rng):
+            def pick(key):
+                return key(self.n + rng.randrange(self.n)) if rng.random() < UNKNOWN_SHARE else \
+                    key(rng.randrange(self.n))
+            def mfo():
+                yield ["ИНН"]
+                for _ in range(self.n): yield [pick(self.inn)]
+            _write_xlsx(path, {"МФО": mfo(), "Банки": ([pick(self.ogrn)] for _ in range(self.n))})
+        return self._file("serviced.xlsx", make)
+
+    # ── сравнение списков и кредиты ─────────────────────────────────────────
+
+    def _list_people(self):
+        rng = random.Random(f"{self.seed}:list")
+        return [(f"{900_000 + i}", *_person(rng)) for i in range(self.n)]
+
+    def compare_xlsx(self):
+        """(новый, старый): B — ФИО, C — дата рождения; в новом часть строк добавлена / удалена / изменена."""
+        header = [("ID", "ФИО", "Дата рождения")]
+        def make_old(path, rng):
+            _write_xlsx(path, {"Список": (list(r) for r in header + self._list_people())})
+        def make_new(path, rng):
+            people, k = self._list_people(), max(1, int(self.n * LIST_CHANGE_SHARE))
+            people = people[k:]                                           # удалены
+            for j in range(k):                                            # изменена дата
+                i, fio, dob = people[j]
+                people[j] = (i, fio, (date.fromisoformat(dob) + timedelta(days=1)).isoformat())
+            people += [(f"{800_000 + j}", *_person(rng)) for j in range(k)]   # добавлены
+            _write_xlsx(path, {"Список": (list(r) for r in header + people)})
+        return self._file("list_new.xlsx", make_new), self._file("list_old.xlsx", make_old)
+
+    def loans_xlsx(self):
+        """(новый список: A — ID MPL, данные с 3-й строки; отчёт по сделкам: A — ID, H — дата, с 4-й)."""
+        def make_report(path, rng):
+            ids = [i for i, _, _ in self._list_people()]
+            def rows():
+                yield ["Отчет по финансовым сделкам"]
+                yield [f"за период по {XML_DATE:%d.%m.%Y}"]
+                yield ["ID MPL", "Договор", "Сумма", "Валюта", "Срок", "Ставка", "Канал", "Дата сделки"]
+                for j in range(self.n):
+                    client = rng.choice(ids) if rng.random() < LOAN_SHARE else f"{5_000_000 + j}"
+                    deal   = datetime(2026, 1, 1) + timedelta(minutes=rng.randrange(400_000))
+                    yield [int(client), f"D-{j}", 10_000 + j % 90_000, "RUB", 30, 0.8, "web", deal]
+            _write_xlsx(path, {"Сделки": rows()})
+        new_path, _ = self.compare_xlsx()
+        return new_path, self._file("loans_report.xlsx", make_report)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЛОКАЛЬНЫЙ «cbr.ru»
+# ════════════════════════════════════════════════════════════════════════════
+
+class StandServer:
+    """HTTP-сервер на 127.0.0.1 вместо cbr.ru: отдаёт файлы реестров с ETag / 304.
+
+    files — {префикс пути: файл}; подменяется между размерами. sent — байт отдано.
+    """
+
+    ROUTES = {"banks": "/Queries/UniDbQuery/DownloadExcel/98547",
+              "mfo":   "/vfs/finmarkets/files/supervision/list_MFO.xlsx"}
+
+    def __init__(self):
+        self.files, self.sent, self.requests = {}, 0, 0
+        stand = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand.requests += 1
+                path = next((f for prefix, f in stand.files.items() if self.path.startswith(prefix)), None)
+                if path is None:
+                    self.send_error(404); return
+                st   = os.stat(path)
+                etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304); self.end_headers(); return
+                self.send_response(200)
+                self.send_header("Content-Length", str(st.st_size))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                with open(path, "rb") as f: shutil.copyfileobj(f, self.wfile)
+                stand.sent += st.st_size
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url   = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, name="sfm-bench-http", daemon=True).start()
+
+    def serve(self, banks, mfo):
+        self.files = {self.ROUTES["banks"]: banks, self.ROUTES["mfo"]: mfo}
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЗАМЕРЫ
+# ════════════════════════════════════════════════════════════════════════════
+
+class Bench:
+    """Замеры этапов: медиана и минимум по repeat прогонам, строки и байты результата."""
+
+    def __init__(self, core, stand, repeat):
+        self.core, self.stand, self.repeat, self.results = core, stand, repeat, []
+
+    def cold(self):
+        """Без кэшей: снимков Excel, разобранных перечней, состояния сверки и реестров ЦБ."""
+        shutil.rmtree(self.core.CACHE_DIR, ignore_errors=True)
+        self.core.registry_refresher.invalidate()
+
+    def measure(self, pipeline, stage, n, fn, setup=None, rows=None, nbytes=None, repeat=None):
+        times, out = [], None
+        for _ in range(repeat or self.repeat):
+            if setup: setup()
+            t0  = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - t0)
+        times.sort()
+        rec = {"pipeline": pipeline, "stage": stage, "n": n, "sec": round(times[len(times) // 2], 4),
+               "min_sec": round(times[0], 4), "runs": len(times)}
+        if rows is not None:   rec["rows"]  = rows(out)
+        if nbytes is not None: rec["bytes"] = nbytes(out)
+        self.results.append(rec)
+        print(f"  {pipeline:<8} {stage:<30} {rec['sec']:9.3f} с", file=sys.stderr)
+        return out
+
+    # ── проверки ────────────────────────────────────────────────────────────
+
+    def xml(self, data, n):
+        core = self.core
+        xml_path, clients = data.perechen_xml(), data.clients_xlsx()
+        excluded, actual = self.measure("xml", "Разбор XML", n, lambda: core.parse_perechen_xml(xml_path),
+                                        rows=lambda r: len(r[1]), nbytes=lambda _: os.path.getsize(xml_path))
+        df = self.measure("xml", "Чтение клиентов (xlsx)", n,
+                          lambda: core.read_excel_columns(clients, [2, 3], names=["ФИО", "ДатаРождения"]),
+                          rows=len, nbytes=lambda _: os.path.getsize(clients))
+        self.measure("xml", "Сверка", n,
+                     lambda: core.reconcile_xml(df["ФИО"], df["ДатаРождения"], excluded, actual, XML_DATE),
+                     rows=lambda r: len(r[0]))
+        run = lambda **kw: core.run_xml_check(xml_path, base_path=clients, **kw)
+        self.measure("xml", "Проверка целиком (холодная)", n, lambda: run(delta=False), setup=self.cold,
+                     rows=lambda r: len(r.rows))
+        result = self.measure("xml", "Проверка целиком (тёплая)", n, run, rows=lambda r: len(r.rows))
+        return result
+
+    def banks(self, data, n):
+        core, registry, serviced = self.core, data.bank_registry_xlsx(), data.serviced_xlsx()
+        index = self.measure("banks", "Разбор реестра", n, lambda: core.parse_bank_registry(registry),
+                             rows=len, nbytes=lambda _: os.path.getsize(registry))
+        local = core.read_excel_columns(serviced, [0], sheet_name="Банки", header=None, dtype=str)
+        self.measure("banks", "Сверка", n, lambda: core.reconcile_banks(index, local.iloc[:, 0]),
+                     rows=lambda r: len(r[0]))
+        return self._whole("banks", n, lambda: core.run_banks_check(serviced))
+
+    def mfo(self, data, n):
+        core, registry, serviced = self.core, data.mfo_registry_xlsx(), data.serviced_xlsx()
+        active, excl = self.measure("mfo", "Разбор реестра", n, lambda: core.parse_mfo_registry(registry),
+                                    rows=lambda r: len(r[0]) + len(r[1]),
+                                    nbytes=lambda _: os.path.getsize(registry))
+        local = core.read_excel_columns(serviced, [0], dtype=str)
+        self.measure("mfo", "Сверка", n, lambda: core.reconcile_mfo(active, excl, local.iloc[:, 0]),
+                     rows=lambda r: len(r[0]))
+        return self._whole("mfo", n, lambda: core.run_mfo_check(serviced))
+
+    def _whole(self, pipeline, n, run):
+        """Холодная проверка качает реестр с локального сервера, тёплая берёт индекс из памяти."""
+        stand_sent = self.stand.sent
+        self.measure(pipeline, "Проверка целиком (холодная)", n, run, setup=self.cold,
+                     rows=lambda r: len(r.rows), nbytes=lambda _: (self.stand.sent - stand_sent) // self.repeat)
+        return self.measure(pipeline, "Проверка целиком (тёплая)", n, run, rows=lambda r: len(r.rows))
+
+    def compare(self, data, n):
+        core = self.core
+        new_path, old_path = data.compare_xlsx()
+        new = core.read_excel_columns(new_path, [1, 2]).dropna()
+        old = core.read_excel_columns(old_path, [1, 2]).dropna()
+        self.measure("compare", "Сравнение", n,
+                     lambda: core.diff_lists(new.iloc[:, 0], new.iloc[:, 1], old.iloc[:, 0], old.iloc[:, 1]),
+                     rows=lambda r: len(r[0]))
+        self.measure("compare", "Проверка целиком (холодная)", n,
+                     lambda: core.run_compare_lists(new_path, old_path), setup=self.cold,
+                     rows=lambda r: len(r.rows))
+        return self.measure("compare", "Проверка целиком (тёплая)", n,
+                            lambda: core.run_compare_lists(new_path, old_path), rows=lambda r: len(r.rows))
+
+    def loans(self, data, n):
+        new_path, report = data.loans_xlsx()
+        return self.measure("loans", "Проверка целиком", n, lambda: self.core.run_loans_check(new_path, report),
+                            setup=self.cold, rows=lambda r: len(r.rows),
+                            nbytes=lambda _: os.path.getsize(report))
+
+    # ── экспорт и поиск по результату ───────────────────────────────────────
+
+    def export(self, pipeline, n, result, tmp_dir):
+        import sfm_cli
+        for fmt, write in sfm_cli.WRITERS.items():
+            path = os.path.join(tmp_dir, f"export_{pipeline}.{fmt}")
+            self.measure(pipeline, f"Экспорт .{fmt}", n, lambda: write(result, path),
+                         rows=lambda _: len(result.rows), nbytes=lambda _: os.path.getsize(path))
+            os.remove(path)
+
+    def search(self, pipeline, n, result):
+        """Как «Расширенный поиск» в окне: индекс, набор запроса по буквам, фильтр по статусу."""
+        core    = self.core
+        values  = [r[0] for r in result.rows]
+        status  = [str(r[2]) if len(r) >= 3 else None for r in result.rows]
+        def build():
+            index = core.SearchIndex(values, status); index.build_grams(); return index
+        index = self.measure(pipeline, "Поиск: индекс", n, build, rows=lambda ix: len(ix.grams))
+        query = core.normalize(values[len(values) // 2]) if values else ""
+        def typing():
+            for k in range(1, len(query) + 1): hits = index.filter(query[:k])
+            return hits
+        self.measure(pipeline, "Поиск: ввод запроса", n, typing, rows=len)
+        top = Counter(st for st in status if st is not None).most_common(1)
+        if top:
+            top = top[0][0]
+            self.measure(pipeline, "Поиск: фильтр статуса", n, lambda: index.filter("", top), rows=len)
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ОТЧЁТ
+# ════════════════════════════════════════════════════════════════════════════
+
+def environment(core):
+    import numpy, pandas
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count(),
+            "pandas": pandas.__version__, "numpy": numpy.__version__,
+            "openpyxl": core.HAS_OPENPYXL, "calamine": core.HAS_CALAMINE, "rapidfuzz": core.HAS_RAPIDFUZZ}
+
+
+def print_table(results):
+    sizes = sorted({r["n"] for r in results})
+    keys  = list(dict.fromkeys((r["pipeline"], r["stage"]) for r in results))
+    sec   = {(r["pipeline"], r["stage"], r["n"]): r["sec"] for r in results}
+    print(f"{'Проверка':<9}{'Этап':<31}" + "".join(f"{n:>12,}".replace(",", " ") for n in sizes))
+    for pipeline, stage in keys:
+        cells = [sec.get((pipeline, stage, n)) for n in sizes]
+        print(f"{pipeline:<9}{stage:<31}" + "".join(f"{'—' if c is None else f'{c:.3f} с':>12}" for c in cells))
+
+
+def compare_reports(old_path, new_path, threshold, min_sec):
+    """Этапы, есть в обоих отчётах: отношение медиан новое / старое. Вернуть код выхода.
+
+    Этапы быстрее min_sec в обоих отчётах регрессией не считаются — это шум таймера.
+    """
+    with open(old_path, encoding="utf-8") as f: old = json.load(f)
+    with open(new_path, encoding="utf-8") as f: new = json.load(f)
+    before = {(r["pipeline"], r["stage"], r["n"]): r["sec"] for r in old["results"]}
+    slower = 0
+    print(f"{old_path} ({old['created']}) → {new_path} ({new['created']})")
+    for r in new["results"]:
+        was = before.get((r["pipeline"], r["stage"], r["n"]))
+        if not was: continue
+        ratio = r["sec"] / was
+        mark  = "  ← медленнее" if ratio > threshold and r["sec"] >= min_sec else ""
+        slower += bool(mark)
+        print(f"  {r['pipeline']:<8} {r['stage']:<30} {r['n']:>9}  {was:9.3f} → {r['sec']:9.3f} с  "
+              f"×{ratio:.2f}{mark}")
+    print(f"Медленнее порога ×{threshold}: {slower}")
+    return 1 if slower else 0
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЗАПУСК
+# ════════════════════════════════════════════════════════════════════════════
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="sfm_bench", description="СФМ — бенчмарк проверок на синтетических данных.")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("run", help="сгенерировать данные и замерить этапы")
+    sp.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                    help="размеры через запятую (строк в каждом файле)")
+    sp.add_argument("--only", default=",".join(PIPELINES), help=f"проверки через запятую: {', '.join(PIPELINES)}")
+    sp.add_argument("--repeat", type=int, default=3, help="прогонов на этап (берётся медиана)")
+    sp.add_argument("--seed", type=int, default=1)
+    sp.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "sfm_bench"),
+                    help="где хранить сгенерированные файлы")
+    sp.add_argument("-o", "--output", help="отчёт JSON (по умолчанию sfm_bench_<дата>.json)")
+
+    sp = sub.add_parser("compare", help="сравнить два отчёта run")
+    sp.add_argument("old"); sp.add_argument("new")
+    sp.add_argument("--threshold", type=float, default=1.2, help="во сколько раз медленнее — регрессия")
+    sp.add_argument("--min-sec", type=float, default=0.05, help="этапы быстрее этого не сравнивать")
+    return p
+
+
+def run(args, parser):
+    try:
+        sizes = [int(s) for s in args.sizes.split(",") if s]
+    except ValueError:
+        parser.error("--sizes: целые числа через запятую")
+    only = [s for s in args.only.split(",") if s]
+    if set(only) - set(PIPELINES):
+        parser.error(f"--only: допустимо {', '.join(PIPELINES)}")
+
+    # Окружение ядра задаётся до импорта sfm_core: свой LOCALAPPDATA (кэши и
+    # метрики прогона), cbr.ru → локальный сервер, без фонового обновления реестров
+    stand   = StandServer()
+    run_dir = tempfile.mkdtemp(prefix="sfm_bench_run_")
+    os.environ.update({"LOCALAPPDATA": run_dir, "SFM_CBR_BASE_URL": stand.url,
+                       "SFM_REGISTRY_REFRESH_MIN": "0"})
+    import sfm_core as core
+    for name in core.PRELOAD_MODULES: importlib.import_module(name)   # импорт — не часть замеров
+
+    bench = Bench(core, stand, args.repeat)
+    try:
+        for n in sizes:
+            print(f"— {n} строк", file=sys.stderr)
+            data = BenchData(args.data_dir, n, args.seed)
+            if "banks" in only or "mfo" in only:
+                stand.serve(data.bank_registry_xlsx(), data.mfo_registry_xlsx())
+            for pipeline in only:
+                result = getattr(bench, pipeline)(data, n)
+                if pipeline in ("xml", "compare"):   # результаты на всю таблицу — экспорт и поиск по ним
+                    bench.export(pipeline, n, result, run_dir)
+                    bench.search(pipeline, n, result)
+    finally:
+        stand.close()
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+    output = args.output or f"sfm_bench_{datetime.now():%Y%m%d_%H%M}.json"
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "sizes": sizes, "repeat": args.repeat,
+              "seed": args.seed, "environment": environment(core), "results": bench.results}
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print_table(bench.results)
+    print(f"Отчёт: {output}")
+    return 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args   = parser.parse_args(argv)
+    if args.command == "compare": return compare_reports(args.old, args.new, args.threshold, args.min_sec)
+    return run(args, parser)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""СФМ — пакетный режим: проверки без окна, для планировщика и сервера.
+
+    python sfm_cli.py xml 18.10.2026.xml -o перечень.xlsx
+    python sfm_cli.py xml 18.10.2026.xml --fuzzy --base клиенты.xlsx -o hits.json
+    python sfm_cli.py compare новый.xlsx старый.xlsx -o изменения.csv
+    python sfm_cli.py loans новый.xlsx "Отчет по финансовым сделкам.xlsx" -o кредиты.xlsx
+    python sfm_cli.py banks -o банки.csv
+    python sfm_cli.py mfo --local "МФО на обслуживании.xlsx" -o мфо.xlsx
+    python sfm_cli.py startup --last 20
+    python sfm_cli.py history --ogrn 1027700132195
+    python sfm_cli.py history --status "В перечне"
+    python sfm_cli.py --profile cpu,mem banks
+    python sfm_cli.py diag --check xml --last 20
+
+Формат результата — по расширению (.xlsx / .csv / .json) или --format.
+Итоги пишутся в stdout, ход выполнения (-v) и ошибки — в stderr.
+Прогоны xml / banks / mfo сохраняются в журнал проверок (history.sqlite3), если не указан --no-history.
+Замеры этапов каждой проверки дописываются в metrics/checks.jsonl (см. diag).
+
+Коды выхода:
+    0 — проверка прошла, совпадений / проблемных записей нет;
+    1 — есть совпадения с перечнем, записи, требующие внимания, изменения списка (compare)
+        или выданные кредиты (loans);
+    2 — неверные аргументы;
+    3 — проверка не выполнена (нет файла, ЦБ недоступен без кэша и т.п.).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+EXIT_OK, EXIT_HITS, EXIT_USAGE, EXIT_ERROR = 0, 1, 2, 3
+
+FORMATS = ("xlsx", "csv", "json")
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЗАПИСЬ РЕЗУЛЬТАТА
+# ════════════════════════════════════════════════════════════════════════════
+
+def write_csv(result, path):
+    # utf-8-sig — чтобы Excel открыл кириллицу без мастера импорта
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f, delimiter=";")
+        w.writerow(result.columns)
+        w.writerows(result.rows)
+
+
+def write_json(result, path):
+    data = {
+        "check":   result.check,
+        "hits":    result.hits,
+        "counts":  result.counts,
+        "source":  result.source,
+        "cached":  result.cached,
+        "timings": {k: round(v, 3) for k, v in result.timings.items()},
+        "columns": list(result.columns),
+        "rows":    [dict(zip(result.columns, r), tag=t) for r, t in zip(result.rows, result.tags)],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1, default=str)   # даты из Excel — строкой
+
+
+def write_xlsx(result, path):
+    from sfm_core import HAS_OPENPYXL
+    if not HAS_OPENPYXL:
+        raise RuntimeError("для .xlsx нужен openpyxl (pip install openpyxl)")
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Результаты")
+    ws.append(list(result.columns))
+    for r in result.rows: ws.append([str(v) for v in r])
+    wb.save(path)
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv, "json": write_json}
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЗАПУСК
+# ════════════════════════════════════════════════════════════════════════════
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="sfm_cli", description="СФМ — проверки без окна.")
+    p.add_argument("-v", "--verbose", action="store_true", help="печатать ход выполнения в stderr")
+    p.add_argument("--no-history", action="store_true", help="не записывать прогон в журнал проверок")
+    p.add_argument("--profile", metavar="cpu,mem",
+                   help="снять cProfile (cpu) и/или tracemalloc (mem) — в metrics/checks.jsonl")
+    sub = p.add_subparsers(dest="check", required=True)
+
+    def add_output(sp):
+        sp.add_argument("-o", "--output", help="файл результата (.xlsx / .csv / .json)")
+        sp.add_argument("--format", choices=FORMATS, help="формат, если не ясен из расширения")
+
+    sp = sub.add_parser("xml", help="клиенты против перечня (XML Росфинмониторинга)")
+    sp.add_argument("xml_path", help="файл перечня DD.MM.YYYY.xml")
+    sp.add_argument("--base", help="Excel с клиентами (по умолчанию — файл на K:)")
+    sp.add_argument("--fuzzy", action="store_true", help="нечёткий поиск по ФИО")
+    sp.add_argument("--full", action="store_true",
+                    help="сверить весь список, а не только изменения с прошлой проверки")
+    add_output(sp)
+
+    sp = sub.add_parser("compare", help="новый список проверки против старого (ФИО + дата рождения)")
+    sp.add_argument("new_path", help="новый список (.xlsx)")
+    sp.add_argument("old_path", help="старый список (.xlsx)")
+    add_output(sp)
+
+    sp = sub.add_parser("loans", help="выданные кредиты клиентам из списка (по ID MPL)")
+    sp.add_argument("new_path", help="список проверки (.xlsx)")
+    sp.add_argument("report_path", help="отчёт по финансовым сделкам (.xlsx)")
+    add_output(sp)
+
+    for name, text in (("banks", "банки на обслуживании против реестра ЦБ"),
+                       ("mfo",   "МФО на обслуживании против реестра ЦБ")):
+        sp = sub.add_parser(name, help=text)
+        sp.add_argument("--local", help="Excel со списком на обслуживании (по умолчанию — файл на K:)")
+        add_output(sp)
+
+    sp = sub.add_parser("startup", help="время холодного старта окна по записанным метрикам")
+    sp.add_argument("--last", type=int, default=30, help="сколько последних запусков учитывать")
+
+    sp = sub.add_parser("history", help="журнал проверок: история статусов и прошлые прогоны")
+    key = sp.add_mutually_exclusive_group()
+    key.add_argument("--ogrn", help="история статусов банка по ОГРН")
+    key.add_argument("--inn", help="история статусов МФО по ИНН")
+    key.add_argument("--fio", help="история статусов клиента по ФИО / наименованию")
+    key.add_argument("--status", help="все, кто хоть раз получал статус (например «В перечне»)")
+    sp.add_argument("--check", dest="only_check", choices=("xml", "banks", "mfo"), help="только прогоны этой проверки")
+    sp.add_argument("--last", type=int, default=20, help="сколько прогонов показать без ключа поиска")
+
+    sp = sub.add_parser("diag", help="замеры этапов проверок: медианы и последний прогон")
+    sp.add_argument("--check", dest="only_check",
+                    choices=("xml", "compare", "loans", "banks", "mfo", "export"), help="только эта проверка")
+    sp.add_argument("--last", type=int, default=30, help="сколько последних записей учитывать")
+    return p
+
+
+def startup_report(core, last):
+    """Сводка метрики startup.jsonl: медиана и худший запуск, этапы последнего."""
+    runs = [r for r in core.read_metrics("startup") if r.get("event") == "first_window"][-last:]
+    if not runs:
+        print("Метрик старта пока нет — запустите окно хотя бы раз."); return EXIT_OK
+    totals = sorted(r["total_ms"] for r in runs)
+    print(f"Старт окна, последние {len(runs)} запусков: медиана {totals[len(totals) // 2]:.0f} мс, "
+          f"худший {totals[-1]:.0f} мс")
+    print(f"Последний ({runs[-1]['ts']}):")
+    for stage, ms in runs[-1]["stages_ms"].items(): print(f"  {stage:<26} {ms:8.1f} мс")
+    preload = [r for r in core.read_metrics("startup", limit=2 * last) if r.get("event") == "preload"]
+    if preload:
+        print("Фоновая догрузка (последняя):")
+        for name, ms in preload[-1]["modules_ms"].items(): print(f"  {name:<26} {ms:8.1f} мс")
+    return EXIT_OK
+
+
+def diag_report(core, args):
+    """Сводка checks.jsonl: по каждой проверке — медианы этапов и последний прогон."""
+    records = core.read_check_traces(args.last, check=args.only_check)
+    if not records:
+        print("Замеров проверок пока нет."); return EXIT_OK
+    medians = core.stage_medians(records)
+    for check in dict.fromkeys(r["check"] for r in records):
+        runs = [r for r in records if r["check"] == check]
+        last = runs[-1]
+        print(f"{check}: прогонов {len(runs)}, последний {last['ts'].replace('T', ' ')} — "
+              f"{last['state']}, {last['wall_ms']:.0f} мс")
+        for st in last["stages"]:
+            med = medians.get(check, {}).get(st["stage"])
+            print(f"  {st['stage']:<22} {st['ms']:9.0f} мс  медиана {'—' if med is None else f'{med:.0f}':>7}"
+                  f"  строк {st.get('rows', '—')!s:>8}  байт {st.get('bytes', '—')!s:>10}"
+                  f"  сеть {st.get('net', '—')!s:>10}")
+    return EXIT_OK
+
+
+def history_report(core, args):
+    """Ответ по журналу проверок; без ключа поиска — список последних прогонов."""
+    store = core.history_store
+    if args.status:
+        found = store.ever_with_status(args.status, check=args.only_check)
+        print(f"Статус «{args.status}» хоть раз: {len(found)}")
+        for r in found:
+            print(f"  {r['name']:<40} {r['dob'] or '':<10}  {r['first_seen'][:10]} … {r['last_seen'][:10]}"
+                  f"  (прогонов: {r['times']})")
+    elif args.ogrn or args.inn or args.fio:
+        found = store.status_history(ogrn=args.ogrn, inn=args.inn, name=args.fio)
+        if args.only_check: found = [r for r in found if r["check_id"] == args.only_check]
+        if not found:
+            print("В журнале нет записей."); return EXIT_OK
+        print(found[-1]["name"] or "")
+        for r in found:
+            print(f"  {r['run_at'].replace('T', ' ')}  {r['check_id']:<5}  {r['status']}")
+    else:
+        for r in store.runs(check=args.only_check, limit=args.last):
+            print(f"{r['run_at'].replace('T', ' ')}  {r['check_id']:<5}  {r['total']:>6} записей, "
+                  f"требуют внимания: {r['hits']}")
+    return EXIT_OK
+
+
+def _output_format(parser, args):
+    if not args.output: return None
+    fmt = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        parser.error(f"не удалось определить формат для {args.output!r} — укажите --format")
+    return fmt
+
+
+def main(argv=None):
+    parser = build_parser()
+    args   = parser.parse_args(argv)
+    fmt    = _output_format(parser, args) if args.check not in ("startup", "history", "diag") else None
+    profile = set(filter(None, (args.profile or "").split(",")))
+    if profile - {"cpu", "mem"}: parser.error("--profile: допустимо cpu, mem или cpu,mem")
+
+    # sfm_core грузит pandas/numpy только на самой проверке — --help и ошибки
+    # аргументов мгновенные
+    import sfm_core as core
+    if args.check == "startup": return startup_report(core, args.last)
+    if args.check == "history": return history_report(core, args)
+    if args.check == "diag":    return diag_report(core, args)
+
+    def progress(value, status, sub=""):
+        if args.verbose: print(f"[{value:4.0%}] {status} {sub}".rstrip(), file=sys.stderr)
+
+    try:
+        with core.CheckTrace(args.check, profile=profile or None) as trace:
+            if args.check == "xml":
+                result = core.run_xml_check(args.xml_path, base_path=args.base or core.BASE_EXCEL_PATH,
+                                            fuzzy=args.fuzzy, progress=progress, delta=not args.full)
+            elif args.check == "compare":
+                result = core.run_compare_lists(args.new_path, args.old_path, progress=progress)
+            elif args.check == "loans":
+                result = core.run_loans_check(args.new_path, args.report_path, progress=progress)
+            elif args.check == "banks":
+                result = core.run_banks_check(local_path=args.local or core.MFO_LOCAL_PATH, progress=progress)
+            else:
+                result = core.run_mfo_check(local_path=args.local or core.MFO_LOCAL_PATH, progress=progress)
+            trace.add_result(result)
+            if fmt:
+                t0 = time.perf_counter()
+                WRITERS[fmt](result, args.output)
+                trace.stage(f"Запись .{fmt}", time.perf_counter() - t0, rows=len(result.rows),
+                            bytes=os.path.getsize(args.output))
+    except core.CheckError as e:
+        print(f"Ошибка: {e}", file=sys.stderr); return EXIT_ERROR
+    except Exception as e:
+        print(f"Ошибка: {type(e).__name__}: {e}", file=sys.stderr); return EXIT_ERROR
+
+    if not args.no_history and result.check in core.HISTORY_FIELDS:
+        try: core.history_store.record(result)
+        except Exception as e: print(f"Журнал проверок не записан: {e}", file=sys.stderr)
+
+    print(f"{result.check}: {len(result.rows)} записей, требуют внимания: {result.hits}")
+    for status, n in result.counts.items(): print(f"  {status}: {n}")
+    if result.source: print(f"  реестр ЦБ: {core.RegistryCache.SOURCE_TEXT[result.source]}")
+    if result.rescreened is not None: print(f"  по изменениям перечня пересчитано: {result.rescreened}")
+    print(f"  время: {core.format_timings(result.timings)}")
+    if fmt: print(f"  результат: {args.output}")
+    return EXIT_HITS if result.hits else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
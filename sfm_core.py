@@ -0,0 +1,2308 @@
+"""СФМ — логика проверок без GUI.
+
+Чтение файлов, кэши реестров ЦБ и перечня, сверка и нечёткий поиск.
+Модуль не импортирует tkinter: его используют и окно (sfm_v1.7.py),
+и пакетный режим (sfm_cli.py).
+"""
+import os
+import hashlib
+import importlib
+import importlib.util
+import json
+import pickle
+import re
+import sqlite3
+import tempfile
+import time
+import zlib
+from array import array
+from datetime import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к его атрибуту.
+
+    pandas, numpy, requests и openpyxl вместе грузятся больше полсекунды —
+    главное меню не должно их ждать. Атрибуты после первого обращения
+    запоминаются, так что в горячих циклах прокси ничего не стоит.
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return f"<LazyModule {self._name}>"
+
+
+np       = LazyModule("numpy")
+pd       = LazyModule("pandas")
+ET       = LazyModule("xml.etree.ElementTree")
+requests = LazyModule("requests")
+openpyxl = LazyModule("openpyxl")
+_rf_levenshtein = LazyModule("rapidfuzz.distance.Levenshtein")
+
+
+def _has_module(name):
+    try: return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError): return False
+
+
+# Необязательные зависимости проверяем без импорта
+HAS_OPENPYXL  = _has_module("openpyxl")
+HAS_RAPIDFUZZ = _has_module("rapidfuzz")     # быстрый Левенштейн для нечёткого поиска
+HAS_CALAMINE  = _has_module("python_calamine")   # быстрый движок чтения xlsx (Rust)
+
+# Что догружать в фоне после показа окна (preload_modules)
+PRELOAD_MODULES = ("numpy", "pandas", "requests", "openpyxl", "xml.etree.ElementTree")
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ПУТИ И URL
+# ════════════════════════════════════════════════════════════════════════════
+
+BASE_EXCEL_PATH = r"K:\COMPLIANCE\AML\Террористы в Сравни!.xlsx"
+MFO_LOCAL_PATH  = r"K:\COMPLIANCE\AML\Мониторинг\Проверки МФО\МФО на обслуживании.xlsx"
+# Адрес ЦБ подменяется переменной окружения — для стенда (sfm_bench.py поднимает локальный сервер)
+CBR_BASE_URL    = os.getenv("SFM_CBR_BASE_URL", "https://www.cbr.ru").rstrip("/")
+MFO_CBR_URL     = f"{CBR_BASE_URL}/vfs/finmarkets/files/supervision/list_MFO.xlsx"
+
+# Нечёткий поиск по перечню: допустимое число правок в ФИО и допуск по дате
+# рождения в днях (None — дата не учитывается, только ФИО)
+FUZZY_MAX_DISTANCE       = 2
+FUZZY_DOB_TOLERANCE_DAYS = 0
+
+# Локальные кэши (разобранные перечни и т.п.) и метрики — на машине пользователя, не на K:
+DATA_DIR    = os.path.join(os.getenv("LOCALAPPDATA") or tempfile.gettempdir(), "SFM")
+CACHE_DIR   = os.path.join(DATA_DIR, "cache")
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+
+# Сколько секунд скачанный реестр ЦБ считается свежим без обращения к cbr.ru
+REGISTRY_TTL = 30 * 60
+
+# Динамическая ссылка банков — дата подставляется при запросе
+def get_banks_cbr_url():
+    today = datetime.now().strftime("%m/%d/%Y")  # MM/DD/YYYY
+    date_enc = today.replace("/", "%2F")
+    return (
+        f"{CBR_BASE_URL}/Queries/UniDbQuery/DownloadExcel/98547"
+        f"?FromDate={date_enc}&ToDate={date_enc}"
+        f"&posted=False&backUrl=%2Fbanking_sector%2Fcredit%2FFullCoList%2F"
+    )
+
+# ════════════════════════════════════════════════════════════════════════════
+#  УТИЛИТЫ
+# ════════════════════════════════════════════════════════════════════════════
+
+def normalize(text):
+    return " ".join(str(text).upper().replace("Ё", "Е").split())
+
+def format_date(value):
+    try: return pd.to_datetime(value).strftime("%Y-%m-%d")
+    except: return ""
+
+def format_date_ru(value):
+    try: return pd.to_datetime(value).strftime("%d.%m.%Y")
+    except: return ""
+
+def parse_xml_date(date_str):
+    try: return datetime.strptime(date_str, "%Y-%m-%d").date()
+    except: return None
+
+class CheckError(Exception):
+    """Ошибка этапа проверки; текст показывается пользователю как есть."""
+
+
+class CheckCancelled(BaseException):
+    """Проверку отменили. BaseException — как asyncio.CancelledError: не должна
+    попадать в `except Exception`, которые превращают сбои этапов в CheckError."""
+
+
+class CancelToken:
+    """Флаг отмены задания; check() — точка отмены внутри проверки."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set(): raise CheckCancelled()
+
+    def wait(self, timeout=None):
+        """Ждать отмены не дольше timeout с; True — отменено."""
+        return self._event.wait(timeout)
+
+
+def run_stages(stages, max_workers=2, cancel=None):
+    """Выполнить независимые этапы {имя: функция} параллельно на небольшом пуле.
+
+    Возвращает ({имя: результат}, {имя: секунды}). Первая ошибка любого этапа
+    пробрасывается сразу, не дожидаясь остальных; так же — отмена по cancel.
+    """
+    timings = {}
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        try: return fn()
+        finally: timings[name] = time.perf_counter() - t0
+
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sfm-stage")
+    try:
+        futures = {name: pool.submit(timed, name, fn) for name, fn in stages.items()}
+        pending = set(futures.values())
+        while pending:
+            done, pending = wait(pending, timeout=0.2 if cancel else None, return_when=FIRST_EXCEPTION)
+            for f in done:
+                if f.exception() is not None: raise f.exception()
+            if cancel: cancel.check()
+        return ({name: f.result() for name, f in futures.items()},
+                {name: timings[name] for name in stages})
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def format_timings(timings):
+    return " · ".join(f"{name} {sec:.1f} с" for name, sec in timings.items())
+
+
+def append_metric(name, record):
+    """Дописать запись в METRICS_DIR/<name>.jsonl (одна строка JSON на событие).
+
+    Метрики — вспомогательные: ошибка записи не должна мешать работе.
+    """
+    record = {"ts": datetime.now().isoformat(timespec="seconds"), **record}
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(os.path.join(METRICS_DIR, f"{name}.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+
+def read_metrics(name, limit=None):
+    """Записи METRICS_DIR/<name>.jsonl — последние limit штук (битые строки пропускаются)."""
+    try:
+        with open(os.path.join(METRICS_DIR, f"{name}.jsonl"), encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    out = []
+    for line in lines[-limit:] if limit else lines:
+        try: out.append(json.loads(line))
+        except ValueError: pass
+    return out
+
+
+class StartupTimer:
+    """Замеры холодного старта окна: mark(этап) — время с предыдущей отметки.
+
+    t0 — perf_counter() в самом начале программы, до тяжёлых импортов.
+    """
+
+    def __init__(self, t0=None):
+        self.t0     = t0 if t0 is not None else time.perf_counter()
+        self._last  = self.t0
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = now - self._last
+        self._last = now
+
+    def total(self):
+        return self._last - self.t0
+
+    def report(self):
+        width = max(map(len, self.stages), default=0)
+        lines = [f"  {name:<{width}}  {sec * 1000:8.1f} мс" for name, sec in self.stages.items()]
+        return "\n".join(["Старт:"] + lines + [f"  {'итого':<{width}}  {self.total() * 1000:8.1f} мс"])
+
+    def record(self, **extra):
+        append_metric("startup", {"event": "first_window", "total_ms": round(self.total() * 1000, 1),
+                                  "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+                                  **extra})
+
+
+def preload_modules(modules=PRELOAD_MODULES, on_done=None):
+    """Импортировать тяжёлые модули в фоновом потоке — к первой проверке они уже готовы.
+
+    on_done({модуль: секунды}) вызывается из фонового потока; недоступные
+    модули пропускаются.
+    """
+    def run():
+        timings = {}
+        for name in modules:
+            t0 = time.perf_counter()
+            try: importlib.import_module(name)
+            except ImportError: continue
+            timings[name] = time.perf_counter() - t0
+        if on_done is not None: on_done(timings)
+
+    t = threading.Thread(target=run, daemon=True, name="sfm-preload")
+    t.start()
+    return t
+
+def clean_ogrn(value):
+    """ОГРН может начинаться с нуля — сохраняем как строку."""
+    if pd.isna(value):
+        return ""
+    s = str(value).strip()
+    # Убираем .0 если число было прочитано как float
+    if s.endswith(".0"):
+        s = s[:-2]
+    # Убираем пробелы
+    s = s.replace(" ", "")
+    return s
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ФОНОВЫЕ ЗАДАНИЯ
+# ════════════════════════════════════════════════════════════════════════════
+
+JOB_WORKERS     = 2     # одновременно выполняемых проверок
+JOB_HISTORY_MAX = 50    # сколько завершённых заданий помнить для jobs()
+
+
+class Job:
+    """Задание планировщика. state: queued → running → done / failed / cancelled."""
+
+    def __init__(self, key, label):
+        self.key      = key
+        self.label    = label
+        self.state    = "queued"
+        self.cancel   = CancelToken()
+        self.result   = None
+        self.error    = None
+        self.created  = time.time()
+        self.started  = self.finished = None
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def info(self):
+        end = self.finished or time.time()
+        return {"key": self.key, "label": self.label, "state": self.state,
+                "cancel_requested": self.cancel.cancelled,
+                "seconds": round(end - self.started, 2) if self.started else None,
+                "error": str(self.error) if self.error else None}
+
+
+class JobScheduler:
+    """Очередь проверок на ограниченном пуле потоков.
+
+    submit(key, fn) — fn(cancel) выполняется в пуле; пока задание с тем же
+    ключом не завершено, повторный submit возвращает его же, а не запускает
+    второе. cancel(key) / cancel() — кооперативная отмена: fn останавливается
+    на ближайшей точке отмены (CheckCancelled), ещё не начатое — не начнётся.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, history=JOB_HISTORY_MAX):
+        self.max_workers = max_workers
+        self._pool     = None
+        self._lock     = threading.Lock()
+        self._active   = {}     # key → Job
+        self._finished = []     # последние завершённые, новые в конце
+        self._history  = history
+
+    def submit(self, key, fn, label=None, on_done=None):
+        """on_done(job) вызывается в потоке пула после любого исхода."""
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None and not job.cancel.cancelled:
+                return job
+            job = self._active[key] = Job(key, label or str(key))
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="sfm-job")
+        self._pool.submit(self._run, job, fn, on_done)
+        return job
+
+    def _run(self, job, fn, on_done):
+        job.started = time.time()
+        try:
+            job.cancel.check()
+            job.state  = "running"
+            job.result = fn(job.cancel)
+            job.state  = "cancelled" if job.cancel.cancelled else "done"
+        except CheckCancelled:
+            job.state = "cancelled"
+        except Exception as e:
+            job.error, job.state = e, "failed"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._active.get(job.key) is job: del self._active[job.key]
+                self._finished = (self._finished + [job])[-self._history:]
+        if on_done: on_done(job)
+
+    def cancel(self, key=None):
+        """Отменить задание по ключу или (без аргумента) все активные. Вернуть число отменённых."""
+        with self._lock:
+            jobs = [j for k, j in self._active.items() if key is None or k == key]
+        for job in jobs: job.cancel.cancel()
+        return len(jobs)
+
+    def get(self, key):
+        """Активное задание с этим ключом или None."""
+        with self._lock:
+            return self._active.get(key)
+
+    def jobs(self):
+        """Состояния: активные и последние завершённые (info() каждого)."""
+        with self._lock:
+            jobs = list(self._active.values()) + self._finished[::-1]
+        return [j.info() for j in jobs]
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  РЕЕСТРЫ ЦБ — КЭШ ЗАГРУЗОК
+# ════════════════════════════════════════════════════════════════════════════
+
+def _is_xlsx(body):
+    """xlsx — это zip; вместо файла ЦБ иногда отдаёт HTML-страницу с ошибкой."""
+    return body[:2] == b"PK"
+
+
+class RegistryCache:
+    """Кэш скачанных реестров ЦБ с условными запросами (ETag / Last-Modified).
+
+    fetch() возвращает (путь к файлу, источник):
+      "cache"        — копия моложе ttl, сеть не трогали;
+      "not-modified" — сервер ответил 304, используем сохранённую копию;
+      "download"     — скачали новую версию;
+      "stale"        — cbr.ru недоступен, отдаём последнюю удачную копию.
+    Сессию и каталог можно подменить — например, на локальный тестовый HTTP-сервер.
+    """
+
+    SOURCE_TEXT = {
+        "cache":        "сохранённая копия",
+        "not-modified": "не изменился на сервере",
+        "download":     "скачан",
+        "stale":        "ЦБ недоступен — последняя сохранённая копия",
+    }
+
+    def __init__(self, directory, ttl=REGISTRY_TTL, session=None):
+        self.directory = directory
+        self.ttl       = ttl
+        self._session  = session
+        self._lock     = threading.Lock()
+        self._name_locks = {}   # имя файла → Lock: разные реестры качаются параллельно
+
+    @property
+    def session(self):
+        # requests импортируется при первой загрузке, а не при старте программы
+        if self._session is None: self._session = requests.Session()
+        return self._session
+
+    def _paths(self, name):
+        body = os.path.join(self.directory, name)
+        return body, body + ".json"
+
+    def _load_meta(self, name):
+        body, meta_path = self._paths(name)
+        if not os.path.exists(body): return None
+        try:
+            with open(meta_path, encoding="utf-8") as f: return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, name, meta):
+        _, meta_path = self._paths(name)
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def fetch(self, name, url, headers=None, timeout=40, validate=_is_xlsx, cancel=None):
+        """cancel (CancelToken) проверяется между кусками скачивания и в ожидании,
+        пока тот же реестр качает другой поток (например, фоновое обновление)."""
+        with self._lock:
+            lock = self._name_locks.setdefault(name, threading.Lock())
+        while not lock.acquire(timeout=0.2):
+            if cancel is not None: cancel.check()
+        try:
+            return self._fetch(name, url, dict(headers or {}), timeout, validate, cancel)
+        finally:
+            lock.release()
+
+    @staticmethod
+    def _read_body(resp, cancel):
+        chunks = []
+        for chunk in resp.iter_content(1 << 16):
+            if cancel is not None and cancel.cancelled:
+                resp.close(); raise CheckCancelled()
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _fetch(self, name, url, headers, timeout, validate, cancel):
+        os.makedirs(self.directory, exist_ok=True)
+        body, _ = self._paths(name)
+        meta = self._load_meta(name)
+        now  = time.time()
+        same_url = meta is not None and meta.get("url") == url
+
+        if same_url and now - meta.get("validated_at", 0) < self.ttl:
+            return body, "cache"
+        if same_url:
+            if meta.get("etag"):          headers["If-None-Match"]     = meta["etag"]
+            if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            resp = self.session.get(url, headers=headers, timeout=timeout, stream=True)
+            if resp.status_code == 304 and same_url:
+                meta["validated_at"] = now
+                self._save_meta(name, meta)
+                return body, "not-modified"
+            resp.raise_for_status()
+            content = self._read_body(resp, cancel)
+            if validate and not validate(content):
+                raise ValueError("сервер вернул не файл реестра")
+        except Exception:
+            if meta is not None: return body, "stale"
+            raise
+
+        tmp = body + ".tmp"
+        with open(tmp, "wb") as f: f.write(content)
+        os.replace(tmp, body)
+        self._save_meta(name, {"url": url, "etag": resp.headers.get("ETag"),
+                               "last_modified": resp.headers.get("Last-Modified"),
+                               "fetched_at": now, "validated_at": now})
+        return body, "download"
+
+
+registry_cache = RegistryCache(os.path.join(CACHE_DIR, "registry"))
+
+# ════════════════════════════════════════════════════════════════════════════
+#  СТАТУСЫ ЛИЦЕНЗИЙ БАНКОВ
+# ════════════════════════════════════════════════════════════════════════════
+
+def _get_bank_tag(status: str) -> str:
+    """Определяем тег по тексту статуса лицензии."""
+    s = status.upper()
+    if "ДЕЙСТВУЕТ" in s or "ДЕЙСТВУЮЩ" in s:
+        return "active"
+    if "ОТОЗВАНА" in s or "ОТОЗВАН" in s:
+        return "revoked"
+    if "АННУЛИРОВАН" in s:
+        return "cancelled"
+    if "ЛИКВИДАЦ" in s or "ЛИКВИДИР" in s:
+        return "liquidated"
+    if "ЗАПРЕЩ" in s or "ОГРАНИЧЕН" in s or "ПРИНУДИТЕЛЬН" in s:
+        return "restricted"
+    return "notfound"
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЧТЕНИЕ EXCEL — ТОЛЬКО НУЖНЫЕ СТОЛБЦЫ
+# ════════════════════════════════════════════════════════════════════════════
+#  pd.read_excel разбирает и конвертирует весь лист, хотя проверкам нужны
+#  один-три столбца. Здесь лист читается потоково (openpyxl read_only,
+#  iter_rows до последнего нужного столбца) или через calamine, если он
+#  установлен. Значения приводятся так же, как это делает pandas.
+
+# Строки, которые pandas по умолчанию считает пустыми (na_values)
+_NA_STRINGS = frozenset(["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+                         "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+                         "n/a", "nan", "null"])
+
+
+_NAN = float("nan")
+
+def _cell_value(v, na):
+    if v is None: return _NAN
+    if isinstance(v, str):
+        if v in na: return _NAN
+        return v
+    if isinstance(v, float) and v.is_integer(): return int(v)
+    return v
+
+
+def _frame(data, names, dtype):
+    df = pd.DataFrame(data, columns=names, dtype=object)
+    if dtype is not str:
+        df = df.infer_objects()
+        # Как pd.read_excel: столбец, где и текстовые ячейки читаются как числа ("007"), — числовой
+        for i in np.flatnonzero((df.dtypes == object).to_numpy()):
+            try: df.isetitem(i, pd.to_numeric(df.iloc[:, i]))
+            except (ValueError, TypeError): pass
+        return df
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        df.iloc[:, i] = col.map(str).where(col.notna(), np.nan)
+    return df
+
+
+def _dedupe_names(head):
+    """Имена столбцов по строке заголовка — как у pd.read_excel: пустые — "Unnamed: i",
+    повторы — "X.1", "X.2" (имя, которое уже есть в строке, пропускается; безымянные
+    нумеруются последними)."""
+    names   = [f"Unnamed: {i}" if v is None else v for i, v in enumerate(head)]
+    unnamed = [i for i, v in enumerate(head) if v is None]
+    counts  = {}
+    for i in [i for i, v in enumerate(head) if v is not None] + unnamed:
+        col = old = names[i]
+        cur = counts.get(col, 0)
+        while cur > 0:
+            counts[old] = cur + 1
+            col = f"{old}.{cur}"
+            cur = cur + 1 if col in names else counts.get(col, 0)
+        names[i], counts[col] = col, cur + 1
+    return names
+
+
+def _read_ws_columns(ws, usecols, header, dtype, names):
+    if hasattr(ws, "reset_dimensions"):
+        ws.reset_dimensions()
+    width = max(usecols) + 1
+    na = _NA_STRINGS.union(importlib.import_module("openpyxl.cell.cell").ERROR_CODES)
+    data = []
+    for i, row in enumerate(ws.iter_rows(max_col=width, values_only=True)):
+        if header is not None and i <= header:
+            continue
+        data.append([_cell_value(row[c], na) if c < len(row) else _NAN for c in usecols])
+    if names is None and header is not None:
+        # Имена — по всей строке заголовка: от неё зависит нумерация повторов
+        row  = next(ws.iter_rows(min_row=header + 1, max_row=header + 1, values_only=True), ())
+        head = [_cell_value(v, na) for v in row]
+        head = _dedupe_names([str(v) if pd.notna(v) else None for v in head] +
+                             [None] * (width - len(head)))
+        names = [head[c] for c in usecols]
+    elif names is None:
+        names = list(usecols)
+    return _trim_tail(_frame(data, names, dtype))
+
+
+def _read_calamine(source, usecols, sheet_name, header, dtype, names):
+    df = pd.read_excel(source, engine="calamine", sheet_name=sheet_name, header=header,
+                       usecols=list(usecols), dtype=dtype)
+    # usecols отдаёт столбцы в порядке листа — возвращаем порядок запроса
+    order = sorted(range(len(usecols)), key=lambda k: usecols[k])
+    df = df.iloc[:, [order.index(k) for k in range(len(usecols))]]
+    if names is not None: df.columns = names
+    return _trim_tail(df)
+
+
+def _trim_tail(df):
+    """Убрать хвост строк, пустых во всех прочитанных столбцах."""
+    filled = np.flatnonzero(df.notna().any(axis=1).to_numpy())
+    return df.iloc[:filled[-1] + 1 if len(filled) else 0]
+
+
+def read_excel_columns(path, usecols, sheet_name=0, header=0, dtype=None, names=None):
+    """Прочитать с листа только столбцы usecols (позиции с нуля) — в этом порядке.
+
+    header — номер строки заголовка или None; dtype=str — как pd.read_excel(dtype=str);
+    names — свои имена столбцов вместо заголовка.
+    """
+    return read_excel_sheets(path, {sheet_name: usecols}, header, dtype,
+                             {sheet_name: names})[sheet_name]
+
+
+_calamine_engine = None
+
+
+def _has_calamine_engine():
+    """python_calamine есть и pandas знает engine="calamine" (pandas 2.2+).
+
+    Проверяется один раз, при первом чтении: pandas при старте не импортируется.
+    """
+    global _calamine_engine
+    if _calamine_engine is None:
+        version = re.match(r"(\d+)\.(\d+)", pd.__version__)
+        _calamine_engine = HAS_CALAMINE and tuple(map(int, version.groups())) >= (2, 2)
+    return _calamine_engine
+
+
+def read_excel_sheets(path, sheets, header=0, dtype=None, names=None):
+    """То же для нескольких листов одной книги: {лист: usecols} → {лист: DataFrame}."""
+    names = names or {}
+    if _has_calamine_engine():
+        with pd.ExcelFile(path, engine="calamine") as xf:
+            return {sh: _read_calamine(xf, cols, sh, header, dtype, names.get(sh))
+                    for sh, cols in sheets.items()}
+    if not HAS_OPENPYXL:
+        out = {}
+        for sh, cols in sheets.items():
+            df = pd.read_excel(path, sheet_name=sh, header=header, dtype=dtype)
+            df = df.iloc[:, list(cols)]
+            if names.get(sh) is not None: df.columns = names[sh]
+            out[sh] = df
+        return out
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        return {sh: _read_ws_columns(wb[sh] if isinstance(sh, str) else wb.worksheets[sh],
+                                     cols, header, dtype, names.get(sh))
+                for sh, cols in sheets.items()}
+    finally:
+        wb.close()
+
+# Снимков много (по файлу на каждый прочитанный список) — храним последние
+SNAPSHOT_CACHE_MAX    = 40
+SNAPSHOT_CACHE_MAX_MB = 512
+
+
+class SnapshotCache:
+    """Локальные снимки уже прочитанных столбцов Excel-файлов с сетевого диска.
+
+    Ключ — путь, лист и набор столбцов; снимок действителен, пока у исходного
+    файла те же размер и mtime (os.stat по сети дешёвый, в отличие от чтения
+    xlsx). Снимок — pickle DataFrame: блоки столбцов хранятся массивами NumPy,
+    типы и NaN восстанавливаются без изменений. Сверх max_entries снимков или
+    max_mb на диске вытесняются давно не читанные.
+    """
+
+    def __init__(self, directory, max_entries=SNAPSHOT_CACHE_MAX, max_mb=SNAPSHOT_CACHE_MAX_MB):
+        self.directory   = directory
+        self.max_entries = max_entries
+        self.max_bytes   = max_mb * 2**20
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, path, usecols, sheet_name, header, dtype, names):
+        raw = repr((os.path.abspath(path).lower(), sheet_name, list(usecols), header,
+                    getattr(dtype, "__name__", dtype), names))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def read(self, path, usecols, sheet_name=0, header=0, dtype=None, names=None):
+        """Как read_excel_columns, но без разбора xlsx, если файл не менялся."""
+        st    = os.stat(path)
+        sig   = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        key   = self._key(path, usecols, sheet_name, header, dtype, names)
+        entry = os.path.join(self.directory, key + ".pkl")
+        try:
+            with open(entry + ".json", encoding="utf-8") as f:
+                if json.load(f) == sig:
+                    df = pd.read_pickle(entry)
+                    os.utime(entry)   # свежие снимки вытесняются последними
+                    with self._lock: self.hits += 1
+                    return df
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self._remove(entry)   # битый или недописанный снимок — считаем промахом
+
+        df = read_excel_columns(path, usecols, sheet_name, header, dtype, names)
+        with self._lock: self.misses += 1
+        try:
+            self._store(entry, df, sig)
+        except OSError:
+            pass   # без снимка просто прочитаем файл в следующий раз
+        return df
+
+    def _store(self, entry, df, sig):
+        # Свой временный файл у каждого писателя: один и тот же файл могут
+        # читать сразу два этапа (например, оба списка в run_compare_lists)
+        os.makedirs(self.directory, exist_ok=True)
+        for target, write in ((entry, lambda f: df.to_pickle(f, compression=None)),
+                              (entry + ".json", lambda f: f.write(json.dumps(sig).encode("utf-8")))):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f: write(f)
+                os.replace(tmp, target)
+            except BaseException:
+                self._remove_file(tmp)
+                raise
+        self._evict()
+
+    def _entries(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".pkl")]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _evict(self):
+        entries = []
+        for entry in self._entries():
+            try: st = os.stat(entry)
+            except OSError: continue
+            entries.append((st.st_mtime, st.st_size, entry))
+        entries.sort(reverse=True)     # новые первыми
+        total = 0
+        for n, (_, size, entry) in enumerate(entries):
+            total += size
+            if n >= self.max_entries or total > self.max_bytes:
+                self._remove(entry)
+
+    def _remove(self, entry):
+        self._remove_file(entry)
+        self._remove_file(entry + ".json")
+
+    @staticmethod
+    def _remove_file(path):
+        try: os.remove(path)
+        except OSError: pass
+
+    def invalidate(self):
+        try: names = os.listdir(self.directory)
+        except FileNotFoundError: return
+        for n in names: self._remove_file(os.path.join(self.directory, n))
+
+
+snapshot_cache = SnapshotCache(os.path.join(CACHE_DIR, "snapshots"))
+
+# ════════════════════════════════════════════════════════════════════════════
+#  СВЕРКА — ВЕКТОРНЫЕ ОПЕРАЦИИ
+# ════════════════════════════════════════════════════════════════════════════
+#  Те же правила, что normalize / clean_ogrn / format_date, но над целыми
+#  столбцами: очистка ключей, join через map/isin, статусы через np.select.
+#  Результат — списки rows/tags в прежнем формате.
+
+def _as_str(s):
+    return s.map(str)
+
+def normalize_series(s):
+    # Построчный normalize быстрее цепочки .str с regex \s+ и даёт ровно тот же ключ
+    return pd.Series([normalize(v) for v in s.tolist()], index=s.index, dtype=object)
+
+def clean_ogrn_series(s):
+    out = _as_str(s).str.strip()
+    out = out.where(~out.str.endswith(".0"), out.str[:-2])
+    return out.str.replace(" ", "", regex=False).where(s.notna(), "")
+
+def clean_inn_series(s):
+    """Как clean() в check_mfo: убираются ВСЕ вхождения '.0' и пробелы."""
+    out = _as_str(s).str.strip().str.replace(".0", "", regex=False).str.replace(" ", "", regex=False)
+    return out.where(s.notna(), "")
+
+def format_date_series(s, fmt="%Y-%m-%d"):
+    """format_date для столбца: каждое уникальное значение разбирается один раз."""
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s.dt.strftime(fmt).fillna("")
+    uniq = pd.Series(s.dropna().unique(), dtype=object)
+    try:
+        parsed  = pd.to_datetime(uniq, errors="coerce", format="mixed")
+        mapping = dict(zip(uniq, parsed.dt.strftime(fmt).fillna("")))
+    except (TypeError, ValueError, OverflowError, AttributeError):
+        # Смесь типов / часовых поясов — разбираем поштучно, но всё равно по уникальным
+        one = format_date if fmt == "%Y-%m-%d" else format_date_ru
+        mapping = {v: one(v) for v in uniq}
+    return s.map(mapping).fillna("").astype(object)
+
+
+def find_header_row(col):
+    """Позиция строки-заголовка реестра банков (в столбце есть «огрн» или «рег»), иначе 0."""
+    low  = _as_str(col).str.lower()
+    hits = np.flatnonzero((low.str.contains("огрн", regex=False) |
+                           low.str.contains("рег",  regex=False)).to_numpy())
+    return int(hits[0]) if len(hits) else 0
+
+
+def build_bank_registry(ogrn, name, status):
+    """ОГРН → (Наименование, Статус). При повторе ОГРН побеждает последняя строка."""
+    reg = pd.DataFrame({"ogrn": clean_ogrn_series(ogrn).to_numpy(),
+                        "name": _as_str(name).str.strip().to_numpy(),
+                        "status": _as_str(status).str.strip().to_numpy()})
+    reg = reg[~reg["ogrn"].isin(["", "nan", "None"])]
+    return reg.drop_duplicates("ogrn", keep="last").set_index("ogrn")
+
+
+def reconcile_banks(registry, local_ogrn):
+    ogrn = clean_ogrn_series(local_ogrn)
+    ogrn = ogrn[~ogrn.isin(["", "nan", "None"])]
+    found  = ogrn.isin(registry.index)
+    name   = ogrn.map(registry["name"]).where(found, "— не найден в реестре ЦБ —")
+    status = ogrn.map(registry["status"]).where(found, "Не найден")
+    tag_of = {st: _get_bank_tag(st) for st in registry["status"].unique()}
+    tags   = status.map(tag_of).where(found, "notfound")
+    rows   = list(zip(ogrn.tolist(), name.tolist(), status.tolist()))
+    return rows, tags.tolist()
+
+
+def build_inn_map(pairs):
+    """[(ИНН, Наименование), ...] по листам реестра МФО → Series ИНН → Наименование.
+
+    Пустые ИНН пропускаются, при повторе побеждает последний лист/строка.
+    """
+    inn  = pd.concat([clean_inn_series(i) for i, _ in pairs], ignore_index=True)
+    name = pd.concat([_as_str(n).str.strip() for _, n in pairs], ignore_index=True)
+    m = pd.Series(name.to_numpy(), index=inn.to_numpy())
+    m = m[m.index != ""]
+    return m[~m.index.duplicated(keep="last")]
+
+
+def reconcile_mfo(active, excluded, local_inn):
+    inn     = clean_inn_series(local_inn)
+    is_excl = inn.isin(excluded.index)
+    is_act  = ~is_excl & inn.isin(active.index)
+    name = np.select([is_excl, is_act],
+                     [inn.map(excluded).to_numpy(), inn.map(active).to_numpy()], "")
+    status = np.select([is_excl, is_act], ["Исключён", "Действующий"], "Не найден")
+    tags   = np.select([is_excl, is_act], ["excluded", "active"], "")
+    return list(zip(name.tolist(), inn.tolist(), status.tolist())), tags.tolist()
+
+
+def reconcile_xml(fio, dob, excluded, actual, xml_date):
+    """Сверка клиентов с перечнем. Возвращает rows, tags и счётчики по статусам."""
+    norm  = normalize_series(fio)
+    birth = format_date_series(dob)
+    flat  = {f"{n}\x1f{b}": d for (n, b), d in actual.items()}
+    last  = (norm + "\x1f" + birth).map(flat)
+
+    xml_str  = xml_date.strftime("%Y-%m-%d")
+    is_excl  = norm.isin(list(excluded))
+    is_in    = ~is_excl & last.notna()
+    last_str = last.where(is_in).map({d: d.strftime("%Y-%m-%d") for d in set(flat.values())})
+    last_str = last_str.fillna("").astype(object)
+    current  = is_in & (last_str == xml_str)
+
+    status = np.select([is_excl, is_in], ["Исключен", "В перечне"], "Нет в перечне")
+    ld     = np.where(is_excl, xml_str, last_str.to_numpy())
+    change = np.select([is_excl | current, is_in], ["ДА", "НЕТ"], "")
+    tags   = np.where(is_excl | current, "red", "")
+
+    rows = list(zip(fio.tolist(), birth.tolist(), status.tolist(), ld.tolist(), change.tolist()))
+    cnt  = {"В перечне": int(is_in.sum()), "Нет в перечне": int((~is_excl & ~is_in).sum()),
+            "Исключен": int(is_excl.sum())}
+    return rows, tags.tolist(), cnt
+
+
+def _list_frame(fio, dob):
+    """Список для diff_lists: ключ (normalize(ФИО), ДР) — 64-битный хэш, дубли ключа убраны.
+
+    raw — дата рождения как в файле: её и показываем в строках результата.
+    """
+    df = pd.DataFrame({"name": normalize_series(fio).to_numpy(), "raw": dob.to_numpy(dtype=object),
+                       "dob": format_date_series(dob).to_numpy()})
+    # categorize=False: ФИО почти все уникальны, factorize перед хэшем только мешает
+    df["key"] = pd.util.hash_pandas_object(df[["name", "dob"]], index=False, categorize=False).to_numpy()
+    return df.drop_duplicates("key")
+
+
+def diff_lists(new_fio, new_dob, old_fio, old_dob):
+    """Сравнение двух списков по ключу ФИО + дата рождения.
+
+    Добавлен / Удален — ключа нет в другом списке; если же ФИО есть в обоих,
+    а дата рождения другая — одна строка «Изменен» с прежней датой.
+    В строках — normalize(ФИО) и дата рождения из файла, как и до сверки по ключу.
+    Возвращает rows, tags и счётчики по статусам.
+    """
+    new, old = _list_frame(new_fio, new_dob), _list_frame(old_fio, old_dob)
+    added    = new[~new["key"].isin(old["key"])]
+    removed  = old[~old["key"].isin(new["key"])]
+    changed  = added["name"].isin(removed["name"])
+    gone     = removed["name"].isin(added["name"])
+    was      = removed[gone].groupby("name", sort=False)["dob"].agg(lambda d: ", ".join(x or "—" for x in d))
+
+    rows = []
+    for status, part, prev in (("Добавлен", added[~changed], None), ("Удален", removed[~gone], None),
+                               ("Изменен", added[changed], was)):
+        last = ["было: " + d for d in part["name"].map(prev)] if prev is not None else [""] * len(part)
+        rows.extend(zip(part["name"].tolist(), part["raw"].tolist(), [status] * len(part), last,
+                        ["ДА"] * len(part)))
+    cnt = {"Добавлен": int((~changed).sum()), "Удален": int((~gone).sum()), "Изменен": int(changed.sum())}
+    return rows, ["red"] * len(rows), cnt
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ПОИСК ПО РЕЗУЛЬТАТАМ
+# ════════════════════════════════════════════════════════════════════════════
+
+class SearchIndex:
+    """Подстрочный поиск по первому столбцу результатов (ФИО / наименование).
+
+    keys — normalize(значения) по строкам, statuses — статус строки (для
+    фильтра) или None. Триграммный индекс строит build_grams() — в окне в
+    фоновом потоке; пока его нет, hits() перебирает все ключи. Запрос,
+    продолжающий предыдущий, сужает прошлые совпадения, а не весь список.
+    """
+
+    def __init__(self, values, statuses=None):
+        self.keys     = normalize_series(pd.Series(list(values), dtype=object)).tolist()
+        self.statuses = statuses
+        self.grams    = None    # триграмма → array номеров строк
+        self._last_query, self._last_hits = "", None
+
+    def build_grams(self):
+        grams = {}
+        for i, k in enumerate(self.keys):
+            for g in {k[j:j + 3] for j in range(len(k) - 2)}:
+                posting = grams.get(g)
+                if posting is None: grams[g] = posting = array("I")
+                posting.append(i)
+        self.grams = grams
+        return grams
+
+    def hits(self, query):
+        """Номера строк, чей ключ содержит query (уже normalize), по возрастанию."""
+        keys = self.keys
+        if self._last_hits is not None and self._last_query and self._last_query in query:
+            cand = self._last_hits                          # уточнение прошлого запроса
+        elif self.grams is not None and len(query) >= 3:
+            postings = sorted((self.grams.get(query[j:j + 3], ()) for j in range(len(query) - 2)),
+                              key=len)
+            cand = set(postings[0])
+            for p in postings[1:2]: cand.intersection_update(p)
+            cand = sorted(cand)
+        else:
+            cand = range(len(keys))
+        hits = [i for i in cand if query in keys[i]]
+        self._last_query, self._last_hits = query, hits
+        return hits
+
+    def filter(self, query, status=None):
+        """Строки по запросу и (если задан) статусу; пустой запрос — все."""
+        if query: hits = self.hits(query)
+        else:
+            self._last_query, self._last_hits = "", None
+            hits = range(len(self.keys))
+        if status is not None:
+            hits = [i for i in hits if self.statuses[i] == status]
+        return hits
+
+# ════════════════════════════════════════════════════════════════════════════
+#  НЕЧЁТКИЙ ПОИСК ПО ПЕРЕЧНЮ
+# ════════════════════════════════════════════════════════════════════════════
+#  Точная сверка ловит только normalize(ФИО) + дату рождения. Здесь ФИО
+#  приводится к ключу без транслита и порядка слов, кандидаты берутся из
+#  индекса (по дате рождения ± допуск или по редким триграммам ФИО) и
+#  проверяются расстоянием Левенштейна с порогом.
+
+_TRANSLIT = [("SHCH", "Щ"), ("SCH", "Щ"), ("ZH", "Ж"), ("KH", "Х"), ("TS", "Ц"), ("CH", "Ч"),
+             ("SH", "Ш"), ("YU", "Ю"), ("IU", "Ю"), ("YA", "Я"), ("IA", "Я"), ("YO", "Е"),
+             ("YE", "Е"), ("A", "А"), ("B", "Б"), ("V", "В"), ("G", "Г"), ("D", "Д"), ("E", "Е"),
+             ("Z", "З"), ("I", "И"), ("Y", "Ы"), ("J", "Й"), ("K", "К"), ("L", "Л"), ("M", "М"),
+             ("N", "Н"), ("O", "О"), ("P", "П"), ("R", "Р"), ("S", "С"), ("T", "Т"), ("U", "У"),
+             ("F", "Ф"), ("H", "Х"), ("C", "К"), ("W", "В"), ("X", "КС"), ("Q", "К")]
+_NON_LETTER = re.compile(r"[^A-ZА-Я ]+")
+
+
+def fuzzy_keys(name):
+    """ФИО → (ключ в исходном порядке слов, ключ со словами по алфавиту):
+    кириллица, без Ь/Ъ, Й→И. Второй ловит перестановку Ф/И/О, первый — опечатку,
+    меняющую порядок сортировки."""
+    s = normalize(name)
+    if re.search(r"[A-Z]", s):
+        for lat, cyr in _TRANSLIT: s = s.replace(lat, cyr)
+    words = _NON_LETTER.sub(" ", s.replace("Ь", "").replace("Ъ", "").replace("Й", "И")).split()
+    return " ".join(words), " ".join(sorted(words))
+
+
+def _levenshtein(a, b, limit):
+    """Расстояние Левенштейна, если оно ≤ limit, иначе limit + 1 (полоса Укконена)."""
+    if HAS_RAPIDFUZZ:
+        return _rf_levenshtein.distance(a, b, score_cutoff=limit)
+    la, lb = len(a), len(b)
+    if abs(la - lb) > limit: return limit + 1
+    if la > lb: a, b, la, lb = b, a, lb, la
+    over = limit + 1
+    prev = [j if j <= limit else over for j in range(lb + 1)]
+    for i in range(1, la + 1):
+        lo, hi = max(1, i - limit), min(lb, i + limit)
+        cur = [over] * (lb + 1)
+        if i <= limit: cur[0] = i
+        ca, best = a[i - 1], cur[0]
+        for j in range(lo, hi + 1):
+            v = prev[j - 1] + (ca != b[j - 1])
+            if prev[j] + 1 < v: v = prev[j] + 1
+            if cur[j - 1] + 1 < v: v = cur[j - 1] + 1
+            cur[j] = v
+            if v < best: best = v
+        if best > limit: return over
+        prev = cur
+    return min(prev[lb], over)
+
+
+_DOB_ORDINALS = {}
+
+def _dob_ordinal(dob):
+    if dob not in _DOB_ORDINALS:
+        try: _DOB_ORDINALS[dob] = datetime.strptime(dob, "%Y-%m-%d").toordinal()
+        except (TypeError, ValueError): _DOB_ORDINALS[dob] = None
+    return _DOB_ORDINALS[dob]
+
+
+class FuzzyIndex:
+    """Индекс АктуальныйПеречень для нечёткого поиска.
+
+    Кандидаты для клиента с датой рождения — записи с датой в пределах
+    допуска (словарь по дню) и записи перечня без даты; без даты или без
+    учёта даты — записи, содержащие хотя бы одну из q·d+1 самых редких
+    триграмм ключа (фильтр по q-граммам: при d правках хотя бы одна уцелеет).
+    Перед Левенштейном — фильтр по числу общих триграмм: каждая правка
+    портит не больше q триграмм запроса.
+    """
+
+    Q = 3
+
+    def __init__(self, actual):
+        self.entries = []              # (ключи, (ФИО, ДР) из перечня, последняя дата)
+        self._gram_sets = []
+        self._by_day = {}
+        self._grams  = {}
+        self._short  = []              # ключи короче q — триграмм нет
+        for (norm, dob), last in actual.items():
+            i = len(self.entries)
+            keys = fuzzy_keys(norm)
+            self.entries.append((keys, (norm, dob), last))
+            day = _dob_ordinal(dob)
+            self._by_day.setdefault(day, []).append(i)
+            grams = self._grams_of(keys[0]) | self._grams_of(keys[1])
+            self._gram_sets.append(grams)
+            if not grams: self._short.append(i)
+            for g in grams: self._grams.setdefault(g, []).append(i)
+
+    def _grams_of(self, key):
+        return {key[j:j + self.Q] for j in range(len(key) - self.Q + 1)}
+
+    def _name_candidates(self, grams, max_distance):
+        need = self.Q * max_distance + 1
+        cand = set(self._short)
+        for variant in grams:
+            if len(variant) < need:    # слишком короткий ключ — фильтр не работает
+                return range(len(self.entries))
+            for g in sorted(variant, key=lambda g: len(self._grams.get(g, ())))[:need]:
+                cand.update(self._grams.get(g, ()))
+        return cand
+
+    def match(self, name, dob, max_distance=FUZZY_MAX_DISTANCE,
+              dob_tolerance=FUZZY_DOB_TOLERANCE_DAYS):
+        """Лучшее совпадение (запись, расстояние, сходство 0..1) или None."""
+        keys = fuzzy_keys(name)
+        if not keys[0]: return None
+        grams = (self._grams_of(keys[0]), self._grams_of(keys[1]))
+        floor = [len(g) - self.Q * max_distance for g in grams]
+        day = _dob_ordinal(dob) if dob_tolerance is not None else None
+        if day is not None:
+            cand = list(self._by_day.get(None, ()))
+            for d in range(day - dob_tolerance, day + dob_tolerance + 1):
+                cand.extend(self._by_day.get(d, ()))
+        else:
+            cand = self._name_candidates(grams, max_distance)
+
+        best = None
+        for i in cand:
+            other, shared = self.entries[i][0], self._gram_sets[i]
+            for k in (0, 1):
+                if floor[k] > 0 and len(grams[k] & shared) < floor[k]: continue
+                dist = _levenshtein(keys[k], other[k], max_distance)
+                if dist <= max_distance and (best is None or dist < best[1]):
+                    best = (i, dist, len(other[k]))
+            if best is not None and best[1] == 0: break
+        if best is None: return None
+        i, dist, other_len = best
+        score = 1 - dist / max(len(keys[0]), other_len)
+        return self.entries[i], dist, score
+
+
+def fuzzy_screen(rows, tags, cnt, actual, xml_date, max_distance=FUZZY_MAX_DISTANCE,
+                 dob_tolerance=FUZZY_DOB_TOLERANCE_DAYS, cancel=None):
+    """Дополнить результат reconcile_xml нечёткими совпадениями и столбцом «Сходство».
+
+    Проверяются только строки «Нет в перечне»; найденные получают статус
+    «Похожее совпадение» и тег found. Точные совпадения — 100%.
+    """
+    index = FuzzyIndex(actual)
+    xml_str = xml_date.strftime("%Y-%m-%d")
+    out_rows, out_tags = [], []
+    cnt = dict(cnt, **{"Похожее совпадение": 0})
+    for i, ((fio, birth, status, ld, change), tag) in enumerate(zip(rows, tags)):
+        if cancel is not None and i % 1000 == 0: cancel.check()
+        if status != "Нет в перечне":
+            out_rows.append((fio, birth, status, ld, change, "100%")); out_tags.append(tag)
+            continue
+        hit = index.match(str(fio), birth, max_distance, dob_tolerance)
+        if hit is None:
+            out_rows.append((fio, birth, status, ld, change, "")); out_tags.append(tag)
+            continue
+        (_, (_, list_dob), last), _, score = hit
+        last_str = last.strftime("%Y-%m-%d")
+        out_rows.append((fio, birth, "Похожее совпадение", last_str,
+                         "ДА" if last_str == xml_str else "НЕТ", f"{score:.0%}"))
+        out_tags.append("found")
+        cnt["Похожее совпадение"] += 1; cnt["Нет в перечне"] -= 1
+    return out_rows, out_tags, cnt
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ЛОГИКА — разбор перечня (XML)
+# ════════════════════════════════════════════════════════════════════════════
+
+def _subject_entry(subj, dob_cache):
+    """Ключ (ФИО, дата рождения) и последняя дата из истории для одного <Субъект>."""
+    fl = subj.find("ФЛ")
+    if fl is None: return None
+    fio = fl.findtext("ФИО")
+    if not fio: return None
+    dob_raw = fl.findtext("ДатаРождения") or ""
+    if dob_raw not in dob_cache:
+        dob_cache[dob_raw] = format_date(dob_raw)
+    dob_xml = dob_cache[dob_raw]
+    hist = subj.find("История"); dates = []
+    if hist is not None:
+        for d in hist.findall("ДатаВключения") + hist.findall("ДатаИзменения"):
+            if d.text:
+                p = parse_xml_date(d.text)
+                if p: dates.append(p)
+    if not dates: return None
+    return (normalize(fio), dob_xml), max(dates)
+
+
+def parse_perechen_xml(xml_path):
+    """Потоковый разбор перечня: excluded = {ФИО}, actual = {(ФИО, ДР): последняя дата}.
+
+    Читаем iterparse'ом по одному <Субъект>: обработанные элементы сразу
+    удаляются из дерева, поэтому память не растёт с размером файла.
+    Учитываются только первые блоки ПоследниеИсключенные / АктуальныйПеречень
+    верхнего уровня — как у прежнего ET.parse + find(). Даты рождения
+    повторяются, поэтому format_date считается один раз на строку.
+    """
+    excluded, actual, dob_cache = set(), {}, {}
+    stack, block, seen = [], None, set()
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            stack.append(elem)
+            if len(stack) == 2 and elem.tag not in seen:
+                seen.add(elem.tag)
+                if elem.tag in ("ПоследниеИсключенные", "АктуальныйПеречень"):
+                    block = elem.tag
+            continue
+
+        stack.pop()
+        depth = len(stack)
+        if depth == 1:
+            block = None
+            stack[0].remove(elem)
+            continue
+        if block == "ПоследниеИсключенные":
+            if elem.tag == "ФИО" and elem.text:
+                excluded.add(normalize(elem.text))
+        elif block == "АктуальныйПеречень" and depth == 2 and elem.tag == "Субъект":
+            entry = _subject_entry(elem, dob_cache)
+            if entry:
+                key, last = entry
+                if key not in actual or actual[key] < last:
+                    actual[key] = last
+        if depth == 2:
+            stack[1].remove(elem)
+    return excluded, actual
+
+# Меняется при любом изменении логики parse_perechen_xml — старые записи кэша
+# перестают совпадать по ключу и просто вытесняются.
+PERECHEN_PARSER_VERSION = 1
+PERECHEN_CACHE_MAX      = 30
+
+
+class PerechenCache:
+    """Кэш разобранных перечней на диске: ключ — SHA-256 содержимого XML + версия парсера.
+
+    Запись — pickle (excluded, actual), сжатый zlib. Повторная проверка того же
+    DD.MM.YYYY.xml загружает готовые структуры вместо разбора файла.
+    """
+
+    def __init__(self, directory, max_entries=PERECHEN_CACHE_MAX):
+        self.directory   = directory
+        self.max_entries = max_entries
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_hash(path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _entry_path(self, digest):
+        return os.path.join(self.directory, f"{digest}_v{PERECHEN_PARSER_VERSION}.pkz")
+
+    def load(self, xml_path):
+        """(excluded, actual, из_кэша) — из кэша или разбором файла с сохранением."""
+        entry = self._entry_path(self.file_hash(xml_path))
+        try:
+            with open(entry, "rb") as f:
+                excluded, actual = pickle.loads(zlib.decompress(f.read()))
+            os.utime(entry)   # свежие записи вытесняются последними
+            with self._lock: self.hits += 1
+            return excluded, actual, True
+        except FileNotFoundError:
+            pass
+        except Exception:
+            self._remove(entry)   # битая запись — считаем промахом
+
+        excluded, actual = parse_perechen_xml(xml_path)
+        with self._lock: self.misses += 1
+        try:
+            self._store(entry, (excluded, actual))
+        except OSError:
+            pass   # кэш — не критичен для проверки
+        return excluded, actual, False
+
+    def _store(self, entry, value):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1))
+        os.replace(tmp, entry)
+        self._evict()
+
+    def _entries(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.endswith(".pkz")]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        for entry in entries[:max(0, len(entries) - self.max_entries)]:
+            self._remove(entry)
+
+    @staticmethod
+    def _remove(entry):
+        try: os.remove(entry)
+        except OSError: pass
+
+    def invalidate(self, xml_path=None):
+        """Удалить запись для файла или (без аргумента) весь кэш."""
+        if xml_path:
+            self._remove(self._entry_path(self.file_hash(xml_path)))
+        else:
+            for entry in self._entries(): self._remove(entry)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries())}
+
+
+perechen_cache = PerechenCache(os.path.join(CACHE_DIR, "perechen"))
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ДЕЛЬТА-СВЕРКА С ПЕРЕЧНЕМ
+# ════════════════════════════════════════════════════════════════════════════
+#  Между соседними DD.MM.YYYY.xml меняются единицы субъектов. После проверки
+#  её строки сохраняются в SQLite-файл состояния с индексом по normalize(ФИО).
+#  Если файл клиентов с тех пор не менялся, по индексу читаются только
+#  клиенты, которых новый перечень может задеть: чьё ФИО есть в нём или среди
+#  исключённых, и кто в прошлый раз был найден. У остальных статус «Нет в
+#  перечне» и остаётся таким. Переписываются только изменившиеся строки.
+#  Результат — тот же, что у reconcile_xml по всему списку.
+
+SCREENING_STATE_VERSION = 2
+
+_SCREENING_SCHEMA = """
+CREATE TABLE meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE rows (
+    i      INTEGER PRIMARY KEY,
+    norm   TEXT NOT NULL,
+    fio,
+    birth  TEXT,
+    status TEXT NOT NULL,
+    last   TEXT NOT NULL,
+    change TEXT NOT NULL,
+    tag    TEXT NOT NULL
+);
+CREATE INDEX rows_norm  ON rows(norm);
+CREATE INDEX rows_found ON rows(status) WHERE status <> 'Нет в перечне';
+"""
+
+_SCREENING_CANDIDATES = """
+SELECT i, norm, fio, birth, status, last, change, tag FROM rows
+ WHERE norm IN (SELECT norm FROM temp.probe)
+UNION
+SELECT i, norm, fio, birth, status, last, change, tag FROM rows
+ WHERE status <> 'Нет в перечне'
+"""
+
+
+def _xml_row(fio, birth, norm, excluded, actual, xml_date, xml_str):
+    """Одна строка reconcile_xml: (строка, тег)."""
+    if norm in excluded:
+        return (fio, birth, "Исключен", xml_str, "ДА"), "red"
+    last = actual.get((norm, birth))
+    if last is None:
+        return (fio, birth, "Нет в перечне", "", ""), ""
+    if last == xml_date:
+        return (fio, birth, "В перечне", xml_str, "ДА"), "red"
+    return (fio, birth, "В перечне", last.strftime("%Y-%m-%d"), "НЕТ"), ""
+
+
+def reconcile_xml_delta(candidates, cnt, excluded, actual, xml_date):
+    """Пересверка строк прошлой проверки, которые мог задеть новый перечень.
+
+    candidates — [(номер, normalize(ФИО), строка, тег)] из ScreeningStateStore.candidates,
+    cnt — счётчики прошлой проверки. Возвращает изменившиеся строки
+    [(номер, строка, тег)] и новые счётчики.
+    """
+    cnt     = dict(cnt)
+    xml_str = xml_date.strftime("%Y-%m-%d")
+    changed = []
+    for i, norm, row, tag in candidates:
+        new_row, new_tag = _xml_row(row[0], row[1], norm, excluded, actual, xml_date, xml_str)
+        if new_row != row or new_tag != tag:
+            changed.append((i, new_row, new_tag))
+            cnt[row[2]] -= 1; cnt[new_row[2]] += 1
+    return changed, cnt
+
+
+class ScreeningStateStore:
+    """Состояние последней проверки по файлу клиентов — для reconcile_xml_delta.
+
+    Один SQLite-файл на файл клиентов; годится, пока у файла те же размер и
+    mtime, что при проверке. open → candidates → rows → update, затем close;
+    полная проверка пишет файл заново через save.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def signature(base_path):
+        st = os.stat(base_path)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _entry_path(self, base_path):
+        key = hashlib.sha1(os.path.abspath(base_path).lower().encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{key}_v{SCREENING_STATE_VERSION}.sqlite3")
+
+    def open(self, base_path, signature):
+        """(соединение, счётчики) или None — нет записи, файл клиентов изменился, запись битая."""
+        entry = self._entry_path(base_path)
+        if not os.path.exists(entry):
+            return None
+        conn = None
+        try:
+            conn = sqlite3.connect(entry, timeout=30)
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            if json.loads(meta["base"]) == signature:
+                return conn, json.loads(meta["cnt"])
+        except (sqlite3.Error, KeyError, ValueError):
+            pass
+        if conn is not None:
+            conn.close()
+        return None
+
+    @staticmethod
+    def candidates(conn, names):
+        """Строки, чей normalize(ФИО) в names, и все найденные в прошлый раз."""
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS probe (norm TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.probe")
+        conn.executemany("INSERT OR IGNORE INTO temp.probe VALUES (?)", ((n,) for n in names))
+        return [(i, norm, (fio, birth, status, last, change), tag)
+                for i, norm, fio, birth, status, last, change, tag in conn.execute(_SCREENING_CANDIDATES)]
+
+    @staticmethod
+    def rows(conn):
+        """Все строки и теги прошлой проверки по порядку."""
+        rows = conn.execute("SELECT fio, birth, status, last, change FROM rows ORDER BY i").fetchall()
+        tags = [tag for (tag,) in conn.execute("SELECT tag FROM rows ORDER BY i")]
+        return rows, tags
+
+    @staticmethod
+    def update(conn, changed, cnt):
+        """Переписать только изменившиеся строки и счётчики."""
+        try:
+            with conn:
+                conn.executemany("UPDATE rows SET status = ?, last = ?, change = ?, tag = ? WHERE i = ?",
+                                 ((row[2], row[3], row[4], tag, i) for i, row, tag in changed))
+                conn.execute("UPDATE meta SET value = ? WHERE key = 'cnt'",
+                             (json.dumps(cnt, ensure_ascii=False),))
+        except sqlite3.Error:
+            pass   # транзакция откатилась: прежнее состояние тоже годится для следующей дельты
+
+    def save(self, base_path, signature, rows, tags, norms, cnt):
+        """Записать состояние полной проверки заново (временный файл + os.replace)."""
+        entry = self._entry_path(base_path)
+        tmp   = f"{entry}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            conn = sqlite3.connect(tmp)
+            try:
+                conn.executescript(_SCREENING_SCHEMA)
+                with conn:
+                    conn.executemany("INSERT INTO meta VALUES (?, ?)", (
+                        ("base", json.dumps(signature)), ("cnt", json.dumps(cnt, ensure_ascii=False))))
+                    conn.executemany("INSERT INTO rows VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     ((i, n) + tuple(r) + (t,)
+                                      for i, (n, r, t) in enumerate(zip(norms, rows, tags))))
+            finally:
+                conn.close()
+            os.replace(tmp, entry)
+        except (OSError, sqlite3.Error):
+            # без состояния следующая проверка просто будет полной
+            try: os.remove(tmp)
+            except OSError: pass
+
+    def invalidate(self, base_path):
+        try: os.remove(self._entry_path(base_path))
+        except OSError: pass
+
+
+screening_state = ScreeningStateStore(os.path.join(CACHE_DIR, "screening"))
+
+# ════════════════════════════════════════════════════════════════════════════
+#  РЕЕСТРЫ ЦБ — ТЁПЛЫЕ ИНДЕКСЫ
+# ════════════════════════════════════════════════════════════════════════════
+#  Реестр = скачивание (registry_cache) + разбор в словарь для сверки.
+#  RegistryRefresher держит разобранные словари в памяти и после старта
+#  окна обновляет их в фоне по расписанию, так что «Проверить» сразу
+#  сверяет с готовым индексом, а не ждёт cbr.ru и разбора xlsx.
+
+CBR_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://www.cbr.ru/banking_sector/credit/FullCoList/",
+}
+
+REGISTRY_REFRESH_MIN = 30
+
+
+def _refresh_interval():
+    """Период фонового обновления реестров, с: SFM_REGISTRY_REFRESH_MIN минут
+    (0 — выключено); не число — значение по умолчанию, а не ошибка при импорте."""
+    try: return max(int(float(os.getenv("SFM_REGISTRY_REFRESH_MIN", REGISTRY_REFRESH_MIN)) * 60), 0)
+    except (ValueError, OverflowError): return REGISTRY_REFRESH_MIN * 60
+
+
+REGISTRY_REFRESH_INTERVAL = _refresh_interval()
+
+
+def fetch_bank_registry(cancel=None):
+    url = get_banks_cbr_url()
+    try:
+        return registry_cache.fetch("cbr_banks.xlsx", url, CBR_HEADERS, timeout=40, cancel=cancel)
+    except Exception as e:
+        raise CheckError(f"Не удалось скачать реестр банков с ЦБ:\n{e}\n\nURL: {url}") from e
+
+
+def parse_bank_registry(cbr_path):
+    """ОГРН → (Наименование, Статус лицензии)."""
+    try:
+        # Файл ЦБ содержит строки-заголовки вверху — читаем без header
+        # Столбец D (индекс 3) = ОГРН, E (4) = Наименование, H (7) = Статус лицензии
+        cbr_df = read_excel_columns(cbr_path, [3, 4, 7], header=None, dtype=str)
+    except Exception as e:
+        raise CheckError(f"Ошибка чтения файла ЦБ:\n{e}") from e
+
+    # Ищем строку-заголовок (где в столбце D есть "огрн" или "рег"),
+    # данные начинаются со следующей строки после заголовка
+    header_row = find_header_row(cbr_df.iloc[:, 0])
+    data_df = cbr_df.iloc[header_row + 1:]
+    return build_bank_registry(data_df.iloc[:, 0], data_df.iloc[:, 1], data_df.iloc[:, 2])
+
+
+def fetch_mfo_registry(cancel=None):
+    try:
+        return registry_cache.fetch("list_MFO.xlsx", MFO_CBR_URL, timeout=30, cancel=cancel)
+    except Exception as e:
+        raise CheckError(str(e)) from e
+
+
+def parse_mfo_registry(cbr_path):
+    """(ИНН → наименование действующих, ИНН → наименование исключённых)."""
+    # Действующие: F (5) = ИНН, H (7) = Наименование; Исключенные: G (6), I (8)
+    active_sheets = ["Действующие", "Действующие МФК", "Действующие МКК"]
+    try:
+        sheets = read_excel_sheets(cbr_path, {**{sh: [5, 7] for sh in active_sheets},
+                                              "Исключенные": [6, 8]}, dtype=str)
+    except Exception as e:
+        raise CheckError(f"Ошибка чтения файла ЦБ:\n{e}") from e
+    active_dict = build_inn_map([(sheets[sh].iloc[:, 0], sheets[sh].iloc[:, 1])
+                                 for sh in active_sheets])
+    excl_df   = sheets["Исключенные"]
+    excl_dict = build_inn_map([(excl_df.iloc[:, 0], excl_df.iloc[:, 1])])
+    return active_dict, excl_dict
+
+
+REGISTRIES = {
+    "banks": (fetch_bank_registry, parse_bank_registry),
+    "mfo":   (fetch_mfo_registry, parse_mfo_registry),
+}
+
+
+class RegistryRefresher:
+    """Разобранные реестры ЦБ в памяти + фоновое обновление.
+
+    get(name) — (индекс, источник, ввод-вывод): тёплый индекс, если он моложе
+    max_age и загружен сегодня (URL реестра банков зависит от даты); иначе
+    загрузка. Ввод-вывод — {"bytes": прочитано с диска, "net": скачано}.
+    Файл, не изменившийся на сервере, заново не разбирается. Загрузка одного
+    реестра идёт одна: проверка, пришедшая во время фонового обновления,
+    ждёт его, а не качает параллельно.
+    """
+
+    def __init__(self, registries=REGISTRIES, interval=REGISTRY_REFRESH_INTERVAL,
+                 max_age=REGISTRY_TTL):
+        self.registries = registries
+        self.interval   = interval
+        self.max_age    = max(max_age, interval + 5 * 60)   # индекс живёт до следующего обновления
+        self._entries   = {}
+        self._errors    = {}
+        self._loading   = set()
+        self._locks     = {name: threading.Lock() for name in registries}
+        self._stop      = CancelToken()
+        self._thread    = None
+
+    def _fresh(self, entry):
+        return (entry is not None and entry["source"] != "stale"
+                and entry["day"] == datetime.now().date()
+                and time.time() - entry["validated_at"] < self.max_age)
+
+    def get(self, name, cancel=None):
+        lock = self._locks[name]
+        while not lock.acquire(timeout=0.2):
+            if cancel is not None: cancel.check()
+        try:
+            entry = self._entries.get(name)
+            if self._fresh(entry): return entry["index"], "cache", {"bytes": 0, "net": 0}
+            entry = self._load(name, cancel)
+            return entry["index"], entry["source"], entry["io"]
+        finally:
+            lock.release()
+
+    def _load(self, name, cancel):
+        fetch, parse = self.registries[name]
+        self._loading.add(name)
+        try:
+            path, source = fetch(cancel)
+            st    = os.stat(path)
+            entry = self._entries.get(name)
+            parse_it = entry is None or entry["path"] != path or entry["mtime"] != st.st_mtime_ns
+            if parse_it:
+                t0 = time.perf_counter()
+                entry = {"path": path, "mtime": st.st_mtime_ns, "index": parse(path),
+                         "parse_sec": time.perf_counter() - t0}
+            entry = dict(entry, source=source, validated_at=time.time(), day=datetime.now().date(),
+                         io={"bytes": st.st_size if parse_it else 0,
+                             "net": st.st_size if source == "download" else 0})
+            self._entries[name] = entry
+            self._errors.pop(name, None)
+            return entry
+        except Exception as e:
+            self._errors[name] = str(e)
+            raise
+        finally:
+            self._loading.discard(name)
+
+    def refresh(self, cancel=None):
+        """Обновить все реестры (ошибки запоминаются в freshness(), не бросаются)."""
+        for name in self.registries:
+            lock = self._locks[name]
+            with lock:
+                try: self._load(name, cancel)
+                except Exception: pass
+
+    def freshness(self):
+        """{реестр: возраст, источник, свежий ли, идёт ли загрузка, последняя ошибка}."""
+        now, out = time.time(), {}
+        for name in self.registries:
+            entry = self._entries.get(name)
+            out[name] = {"age_sec": round(now - entry["validated_at"]) if entry else None,
+                         "source": entry["source"] if entry else None,
+                         "fresh": self._fresh(entry), "loading": name in self._loading,
+                         "error": self._errors.get(name)}
+        return out
+
+    # ── Фоновый поток ───────────────────────────────────────────────────────
+
+    def start(self, delay=5):
+        """Первое обновление через delay с, дальше — раз в interval. Повторный вызов ничего не делает."""
+        if self.interval <= 0 or self._thread is not None: return
+        def loop():
+            wait_for = delay
+            while not self._stop.wait(wait_for):
+                try: self.refresh(self._stop)
+                except CheckCancelled: return
+                wait_for = self.interval
+        self._thread = threading.Thread(target=loop, name="sfm-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.cancel()
+
+    def invalidate(self):
+        """Забыть разобранные индексы: следующий get() загрузит реестр заново."""
+        for name, lock in self._locks.items():
+            with lock: self._entries.pop(name, None)
+
+
+registry_refresher = RegistryRefresher()
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ПРОВЕРКИ ЦЕЛИКОМ
+# ════════════════════════════════════════════════════════════════════════════
+#  run_*_check — вся проверка от загрузки до строк результата. Ошибки —
+#  CheckError с текстом для пользователя; ход выполнения — через
+#  progress(доля 0..1, этап, подробности), если он передан. cancel —
+#  CancelToken: проверяется на каждом отчёте о ходе, при ожидании
+#  параллельных этапов и при скачивании реестра (CheckCancelled).
+
+BANKS_COLUMNS = ("ОГРН", "Наименование", "Статус лицензии")
+MFO_COLUMNS   = ("Наименование", "ИНН", "Статус")
+XML_COLUMNS   = ("ФИО", "Дата рождения", "Статус", "Последняя дата", "Изменение")
+
+# Счётчики проверки банков — по тегу статуса лицензии
+BANK_TAG_TEXT = {"active": "Действует", "revoked": "Отозвана", "cancelled": "Аннулирована",
+                 "liquidated": "Ликвидация", "restricted": "Ограничения", "notfound": "Не найден"}
+
+
+class CheckResult:
+    """Результат проверки: строки таблицы, теги подсветки, счётчики и замеры.
+
+    hits — сколько записей требует внимания (совпадения с перечнем, банки
+    без действующей лицензии, МФО не из списка действующих).
+    source — откуда взят реестр ЦБ (см. RegistryCache.SOURCE_TEXT),
+    cached — перечень взят из кэша разбора, list_date — дата перечня,
+    rescreened — сколько клиентов пересчитано дельта-сверкой (None — полная).
+    stats — объёмы по этапам timings: {этап: {"rows": строк, "bytes": байт
+    файла, "net": скачано}} (см. CheckTrace).
+    """
+
+    def __init__(self, check, columns, rows, tags, counts, hits, timings,
+                 source=None, cached=False, list_date=None, rescreened=None, stats=None):
+        self.check      = check
+        self.columns    = columns
+        self.rows       = rows
+        self.tags       = tags
+        self.counts     = counts
+        self.hits       = hits
+        self.timings    = timings
+        self.source     = source
+        self.cached     = cached
+        self.list_date  = list_date
+        self.rescreened = rescreened
+        self.stats      = stats or {}
+        self.finished   = datetime.now()
+
+
+def _file_bytes(path):
+    try: return os.path.getsize(path)
+    except OSError: return None
+
+
+def _progress(progress, value, status, sub=""):
+    if progress is not None: progress(value, status, sub)
+
+
+def _cancellable(progress, cancel):
+    """progress, который заодно точка отмены: каждый отчёт о ходе проверяет cancel."""
+    if cancel is None: return progress
+    def report(value, status, sub=""):
+        cancel.check()
+        if progress is not None: progress(value, status, sub)
+    return report
+
+
+def run_banks_check(local_path=MFO_LOCAL_PATH, progress=None, cancel=None):
+    progress = _cancellable(progress, cancel)
+
+    # ── 1. Реестр ЦБ — из памяти, если его уже загрузил registry_refresher ──
+    def load_registry():
+        return registry_refresher.get("banks", cancel)
+
+    # ── 2. Читаем локальный файл (лист "Банки", столбец A) ────────────────
+    def load_local():
+        try:
+            return snapshot_cache.read(local_path, [0], sheet_name="Банки", header=None, dtype=str)
+        except Exception as e:
+            raise CheckError(f"Не удалось открыть лист 'Банки' из файла:\n{local_path}\n\n{e}") from e
+
+    # Оба этапа упираются в ввод-вывод (cbr.ru и диск K:) — выполняем параллельно
+    _progress(progress, 0.1, "Скачивание реестра и чтение локального файла...",
+              f"Дата: {datetime.now().strftime('%d.%m.%Y')}, лист 'Банки'")
+    results, timings = run_stages({"Реестр ЦБ": load_registry, "Локальный файл": load_local},
+                                  cancel=cancel)
+    (cbr_dict, source, registry_io), local_df = results["Реестр ЦБ"], results["Локальный файл"]
+    t_join = time.perf_counter()
+
+    # ── 3. Сверка ──────────────────────────────────────────────────────────
+    _progress(progress, 0.8, "Сверка данных...",
+              f"Реестр ЦБ: {len(cbr_dict)} банков ({RegistryCache.SOURCE_TEXT[source]})")
+    rows, tags = reconcile_banks(cbr_dict, local_df.iloc[:, 0])   # столбец A
+    timings["Сверка"] = time.perf_counter() - t_join
+
+    counts = {}
+    for t in tags: counts[BANK_TAG_TEXT[t]] = counts.get(BANK_TAG_TEXT[t], 0) + 1
+    stats = {"Реестр ЦБ":      {"rows": len(cbr_dict), **registry_io},
+             "Локальный файл": {"rows": len(local_df), "bytes": _file_bytes(local_path)},
+             "Сверка":         {"rows": len(rows)}}
+    return CheckResult("banks", BANKS_COLUMNS, rows, tags, counts,
+                       hits=len(tags) - counts.get("Действует", 0), timings=timings, source=source,
+                       stats=stats)
+
+
+def run_mfo_check(local_path=MFO_LOCAL_PATH, progress=None, cancel=None):
+    progress = _cancellable(progress, cancel)
+    # ── Реестр ЦБ: тёплый индекс или скачивание + разбор листов ───────────
+    def load_registry():
+        return registry_refresher.get("mfo", cancel)
+
+    # ── Локальный файл на K: ───────────────────────────────────────────────
+    def load_local():
+        try:
+            return snapshot_cache.read(local_path, [0], dtype=str)
+        except Exception as e:
+            raise CheckError(str(e)) from e
+
+    _progress(progress, 0.1, "Скачивание реестра и чтение локального файла...",
+              "cbr.ru → list_MFO.xlsx")
+    results, timings = run_stages({"Реестр ЦБ": load_registry, "Локальный файл": load_local},
+                                  cancel=cancel)
+    ((active_dict, excl_dict), source, registry_io), local_df = results["Реестр ЦБ"], results["Локальный файл"]
+    t_join = time.perf_counter()
+
+    _progress(progress, 0.85, "Сверка...", f"Реестр: {RegistryCache.SOURCE_TEXT[source]}")
+    rows, tags = reconcile_mfo(active_dict, excl_dict, local_df.iloc[:, 0])
+    timings["Сверка"] = time.perf_counter() - t_join
+
+    counts = {}
+    for r in rows: counts[r[2]] = counts.get(r[2], 0) + 1
+    stats = {"Реестр ЦБ":      {"rows": len(active_dict) + len(excl_dict), **registry_io},
+             "Локальный файл": {"rows": len(local_df), "bytes": _file_bytes(local_path)},
+             "Сверка":         {"rows": len(rows)}}
+    return CheckResult("mfo", MFO_COLUMNS, rows, tags, counts,
+                       hits=len(rows) - counts.get("Действующий", 0), timings=timings, source=source,
+                       stats=stats)
+
+
+def xml_date_from_path(xml_path):
+    """Дата перечня из имени файла DD.MM.YYYY.xml."""
+    try:
+        d, m, y = os.path.basename(xml_path).replace(".xml", "").split(".")
+        return datetime(int(y), int(m), int(d)).date()
+    except ValueError:
+        raise CheckError("Имя файла: DD.MM.YYYY.xml") from None
+
+
+def run_xml_check(xml_path, base_path=BASE_EXCEL_PATH, fuzzy=False, progress=None, delta=True,
+                  cancel=None):
+    """delta — сверять по изменениям относительно прошлой проверки того же
+    файла клиентов (если он не менялся); иначе — полная сверка."""
+    progress = _cancellable(progress, cancel)
+    xml_date = xml_date_from_path(xml_path)
+    timings, stats = {}, {}
+    try:
+        signature = screening_state.signature(base_path)
+    except OSError:
+        signature = None   # ошибку покажет чтение Excel ниже
+    t0 = time.perf_counter()
+    opened = screening_state.open(base_path, signature) if delta and signature else None
+    t_open = time.perf_counter() - t0
+
+    if opened is None:
+        _progress(progress, 0.2, "Чтение Excel...", "")
+        t0 = time.perf_counter()
+        try:
+            df = snapshot_cache.read(base_path, [2, 3], names=["ФИО", "ДатаРождения"])
+            df = df.dropna(subset=["ФИО"])
+        except Exception as e:
+            raise CheckError(str(e)) from e
+        timings["Клиенты"] = time.perf_counter() - t0
+        stats["Клиенты"]   = {"rows": len(df), "bytes": _file_bytes(base_path)}
+
+    try:
+        _progress(progress, 0.4, "Чтение перечня...", os.path.basename(xml_path))
+        t0 = time.perf_counter()
+        try:
+            excluded, actual, cached = perechen_cache.load(xml_path)
+        except Exception as e:
+            raise CheckError(f"Ошибка чтения XML:\n{e}") from e
+        timings["Перечень"] = time.perf_counter() - t0
+        stats["Перечень"]   = {"rows": len(actual) + len(excluded),
+                               "bytes": 0 if cached else _file_bytes(xml_path)}
+
+        if opened is not None:
+            conn, old_cnt = opened
+            _progress(progress, 0.6, "Чтение прошлой проверки...", "")
+            t0 = time.perf_counter()
+            candidates = screening_state.candidates(conn, excluded | {n for n, _ in actual})
+            rows, tags = screening_state.rows(conn)
+            timings["Состояние: чтение"] = t_open + time.perf_counter() - t0
+            stats["Состояние: чтение"]   = {"rows": len(rows),
+                                            "bytes": _file_bytes(screening_state._entry_path(base_path))}
+
+            _progress(progress, 0.7, "Сравнение с прошлой проверкой...",
+                      f"{len(candidates)} из {len(rows)} записей")
+            t0 = time.perf_counter()
+            changed, cnt = reconcile_xml_delta(candidates, old_cnt, excluded, actual, xml_date)
+            for i, row, tag in changed:
+                rows[i], tags[i] = row, tag
+            rescreened = len(candidates)
+            timings["Сверка (изменения)"] = time.perf_counter() - t0
+            stats["Сверка (изменения)"]   = {"rows": rescreened}
+            if changed:
+                t0 = time.perf_counter()
+                screening_state.update(conn, changed, cnt)
+                timings["Состояние: запись"] = time.perf_counter() - t0
+                stats["Состояние: запись"]   = {"rows": len(changed)}
+        else:
+            _progress(progress, 0.7, "Сравнение...", f"{len(df)} записей")
+            t0 = time.perf_counter()
+            rows, tags, cnt = reconcile_xml(df["ФИО"], df["ДатаРождения"], excluded, actual, xml_date)
+            rescreened = None
+            timings["Сверка"] = time.perf_counter() - t0
+            stats["Сверка"]   = {"rows": len(rows)}
+            if signature:
+                t0 = time.perf_counter()
+                screening_state.save(base_path, signature, rows, tags,
+                                     normalize_series(df["ФИО"]).tolist(), cnt)
+                timings["Состояние: запись"] = time.perf_counter() - t0
+                stats["Состояние: запись"]   = {"rows": len(rows)}
+    finally:
+        if opened is not None:
+            opened[0].close()
+
+    columns = XML_COLUMNS
+    if fuzzy:
+        _progress(progress, 0.85, "Нечёткий поиск...",
+                  f"До {FUZZY_MAX_DISTANCE} опечаток в ФИО, допуск по дате: "
+                  f"{FUZZY_DOB_TOLERANCE_DAYS if FUZZY_DOB_TOLERANCE_DAYS is not None else '—'} дн.")
+        t0 = time.perf_counter()
+        rows, tags, cnt = fuzzy_screen(rows, tags, cnt, actual, xml_date, cancel=cancel)
+        timings["Нечёткий поиск"] = time.perf_counter() - t0
+        stats["Нечёткий поиск"]   = {"rows": len(rows)}
+        columns = XML_COLUMNS + ("Сходство",)
+
+    return CheckResult("xml", columns, rows, tags, cnt,
+                       hits=cnt["В перечне"] + cnt.get("Похожее совпадение", 0),
+                       timings=timings, cached=cached, list_date=xml_date, rescreened=rescreened,
+                       stats=stats)
+
+
+
+def run_compare_lists(new_path, old_path, progress=None, cancel=None):
+    """Новый список проверки против старого: столбцы B (ФИО) и C (ДР), строка 1 — заголовок.
+
+    Списки каждую неделю новые — читаются напрямую, без snapshot_cache.
+    """
+    progress = _cancellable(progress, cancel)
+    def reader(path):
+        def read():
+            try:
+                df = read_excel_columns(path, [1, 2])
+            except Exception as e:
+                raise CheckError(f"Не удалось прочитать файл:\n{path}\n\n{e}") from e
+            return df.dropna(subset=[df.columns[0]])
+        return read
+
+    _progress(progress, 0.3, "Чтение файлов...", f"{os.path.basename(new_path)} · {os.path.basename(old_path)}")
+    results, timings = run_stages({"Новый список": reader(new_path), "Старый список": reader(old_path)},
+                                  cancel=cancel)
+    new_df, old_df = results["Новый список"], results["Старый список"]
+
+    _progress(progress, 0.7, "Поиск изменений...", f"{len(new_df)} и {len(old_df)} записей")
+    t0 = time.perf_counter()
+    rows, tags, cnt = diff_lists(new_df.iloc[:, 0], new_df.iloc[:, 1], old_df.iloc[:, 0], old_df.iloc[:, 1])
+    timings["Сравнение"] = time.perf_counter() - t0
+    stats = {"Новый список":  {"rows": len(new_df), "bytes": _file_bytes(new_path)},
+             "Старый список": {"rows": len(old_df), "bytes": _file_bytes(old_path)},
+             "Сравнение":     {"rows": len(rows)}}
+    return CheckResult("compare", XML_COLUMNS, rows, tags, cnt, hits=len(rows), timings=timings,
+                       stats=stats)
+
+
+LOANS_COLUMNS = ("ID MPL", "ФИО", "Дата рождения", "Дата сделки")
+LOANS_CHUNK   = 5000     # строк отчёта между обновлениями прогресса
+
+
+def _loan_id(value):
+    """ID MPL из ячейки отчёта: числовое 123 / 123.0 → "123"."""
+    if value is None: return ""
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    return str(value).strip()
+
+
+def run_loans_check(new_path, report_path, progress=None, cancel=None):
+    """Выданные кредиты клиентам из нового списка.
+
+    Список (A — ID MPL, B — ФИО, C — ДР; данные с 3-й строки) сводится в
+    словарь по ID. «Отчет по финансовым сделкам» (A — ID MPL, H — дата сделки;
+    данные с 4-й строки) читается потоком openpyxl read_only: в памяти только
+    текущая строка и найденные совпадения, сколько бы строк ни было в отчёте.
+    Оба файла разовые — snapshot_cache для них не используется.
+    """
+    progress = _cancellable(progress, cancel)
+    timings = {}
+    _progress(progress, 0.05, "Чтение списка...", os.path.basename(new_path))
+    t0 = time.perf_counter()
+    try:
+        new_df = read_excel_columns(new_path, [0, 1, 2], dtype=str).iloc[1:]
+    except Exception as e:
+        raise CheckError(f"Не удалось прочитать список:\n{new_path}\n\n{e}") from e
+    clients = {}
+    for id_mpl, fio, birth in new_df.itertuples(index=False):
+        if isinstance(id_mpl, str) and id_mpl.strip():
+            clients[id_mpl.strip()] = (str(fio).strip(), birth)
+    timings["Список"] = time.perf_counter() - t0
+
+    if not HAS_OPENPYXL:
+        raise CheckError("Для чтения отчёта нужен openpyxl (pip install openpyxl)")
+    _progress(progress, 0.2, "Поиск выданных кредитов...", os.path.basename(report_path))
+    t0 = time.perf_counter()
+    try:
+        wb = openpyxl.load_workbook(report_path, read_only=True, data_only=True)
+    except Exception as e:
+        raise CheckError(f"Не удалось открыть отчёт:\n{report_path}\n\n{e}") from e
+    rows, seen, dates = [], 0, {}
+
+    def date_ru(v):   # даты повторяются — pd.to_datetime по разу на значение
+        if v not in dates: dates[v] = format_date_ru(v)
+        return dates[v]
+
+    try:
+        ws    = wb.worksheets[0]
+        total = ws.max_row - 3 if ws.max_row and ws.max_row > 3 else None   # размер листа известен не всегда
+        for seen, row in enumerate(ws.iter_rows(min_row=4, max_col=8, values_only=True), 1):
+            if seen % LOANS_CHUNK == 0:
+                done = min(seen / total, 1) if total else seen / (seen + 20 * LOANS_CHUNK)
+                _progress(progress, 0.2 + 0.75 * done, "Поиск выданных кредитов...",
+                          f"Строк отчёта: {seen}" + (f" из ~{total}" if total else "") +
+                          f", совпадений: {len(rows)}")
+            if not row: continue
+            client = clients.get(_loan_id(row[0]))
+            raw    = row[7] if len(row) > 7 else None
+            if client is None or raw is None or raw == "": continue
+            fio, birth = client
+            rows.append((_loan_id(row[0]), fio, date_ru(birth), date_ru(raw)))
+    except Exception as e:
+        raise CheckError(f"Ошибка чтения отчёта:\n{e}") from e
+    finally:
+        wb.close()
+    timings["Отчёт"] = time.perf_counter() - t0
+
+    stats = {"Список": {"rows": len(clients), "bytes": _file_bytes(new_path)},
+             "Отчёт":  {"rows": seen, "bytes": _file_bytes(report_path)}}
+    return CheckResult("loans", LOANS_COLUMNS, rows, [""] * len(rows), {"Совпадений": len(rows),
+                       "Строк отчёта": seen}, hits=len(rows), timings=timings, stats=stats)
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ДИАГНОСТИКА ПРОВЕРОК
+# ════════════════════════════════════════════════════════════════════════════
+#  Каждая проверка (и экспорт) пишет строку в METRICS_DIR/checks.jsonl: этапы
+#  ядра из CheckResult.timings/stats (время, строки, байты файла и сети) плюс
+#  этапы окна (отрисовка таблицы). По желанию — cProfile потока проверки и
+#  tracemalloc; профиль сохраняется рядом (.prof, открывается snakeviz/pstats).
+
+DIAG_METRIC      = "checks"
+DIAG_PROFILE_DIR = os.path.join(METRICS_DIR, "profiles")
+DIAG_PROFILE_TOP = 25      # сколько функций / строк кода оставлять в записи
+PROFILE_MODES    = ("cpu", "mem")
+
+
+class CheckTrace:
+    """Замер одной проверки для панели диагностики и checks.jsonl.
+
+        with CheckTrace("banks") as trace:
+            trace.add_result(run_banks_check(...))
+
+    Запись делается при выходе из with; deferred=True — позже, вызовом
+    finish() или из окна finish_async(), когда результат дорисован или
+    отброшен (ошибка внутри with пишется сразу). profile — набор из PROFILE_MODES; по умолчанию CheckTrace.profile
+    (переменная SFM_PROFILE=cpu,mem или переключатели панели). cProfile видит
+    только поток, в котором открыт with: этапы run_stages в пуле попадают в
+    запись своим временем, но не в профиль.
+    """
+
+    profile = frozenset(m for m in os.getenv("SFM_PROFILE", "").split(",") if m in PROFILE_MODES)
+    _writer = None   # поток «sfm-metrics» для finish_async
+
+    def __init__(self, check, deferred=False, profile=None):
+        self.check    = check
+        self.deferred = deferred
+        self.modes    = self.profile if profile is None else frozenset(profile)
+        self.stages   = []
+        self.summary  = {}
+        self.extra    = {}
+        self.record   = None
+        self._profiler = None
+        self._own_tracemalloc = False
+
+    def stage(self, name, sec, rows=None, bytes=None, net=None):
+        st = {"stage": name, "ms": round(sec * 1000, 1)}
+        for key, v in (("rows", rows), ("bytes", bytes), ("net", net)):
+            if v is not None: st[key] = v
+        self.stages.append(st)
+
+    def add_result(self, result):
+        for name, sec in result.timings.items(): self.stage(name, sec, **result.stats.get(name, {}))
+        self.summary = {"rows": len(result.rows), "hits": result.hits, "source": result.source}
+        if result.rescreened is not None: self.summary["rescreened"] = result.rescreened
+        return result
+
+    # ── профилирование ──────────────────────────────────────────────────────
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        if "mem" in self.modes:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(); self._own_tracemalloc = True
+        if "cpu" in self.modes:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            try: self._profiler.enable()
+            except ValueError:      # уже профилирует другая проверка (Python 3.12+)
+                self._profiler = None
+        return self
+
+    def __exit__(self, et, e, tb):
+        self._wall = time.perf_counter() - self._t0
+        self._stop_profiling()
+        if e is not None: self.finish(error=e)
+        elif not self.deferred: self.finish()
+        return False
+
+    def _stop_profiling(self):
+        if self._profiler is not None: self._profiler.disable()
+        if "mem" in self.modes:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                _, peak  = tracemalloc.get_traced_memory()
+                snapshot = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                    tracemalloc.Filter(False, tracemalloc.__file__)))
+                top = snapshot.statistics("lineno")[:DIAG_PROFILE_TOP]
+                self.extra["memory"] = {
+                    "peak_mb": round(peak / 2**20, 1),
+                    "top": [[str(st.traceback[0]), round(st.size / 1024), st.count] for st in top]}
+                if self._own_tracemalloc: tracemalloc.stop()
+        if self._profiler is not None:
+            self.extra["profile"] = self._profile_summary(self._profiler)
+            self._profiler = None
+
+    def _profile_summary(self, profiler):
+        import pstats
+        stats = pstats.Stats(profiler)
+        path  = os.path.join(DIAG_PROFILE_DIR, f"{self.check}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+        try:
+            os.makedirs(DIAG_PROFILE_DIR, exist_ok=True)
+            stats.dump_stats(path)
+        except OSError:
+            path = None
+        top = sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True)[:DIAG_PROFILE_TOP]
+        return {"file": path,
+                "top": [[f"{os.path.basename(fn)}:{line}({func})", nc, round(tt, 3), round(ct, 3)]
+                        for (fn, line, func), (_, nc, tt, ct, _) in top]}
+
+    # ── запись ──────────────────────────────────────────────────────────────
+
+    def finish(self, error=None):
+        """Записать в checks.jsonl (один раз); возвращает запись."""
+        if self.record is not None: return self.record
+        state = ("done" if error is None else
+                 "cancelled" if isinstance(error, CheckCancelled) else "failed")
+        # wall_ms — время внутри with; этапы run_stages идут параллельно, их сумма больше
+        self.record = {"event": "check", "check": self.check, "state": state,
+                       "wall_ms": round(getattr(self, "_wall", 0) * 1000, 1),
+                       **self.summary, "stages": self.stages, **self.extra}
+        if state == "failed": self.record["error"] = f"{type(error).__name__}: {error}"
+        append_metric(DIAG_METRIC, self.record)
+        return self.record
+
+    def finish_async(self, error=None):
+        """finish() в фоновом потоке — окно не ждёт записи на диск.
+
+        Отброшенный результат (проверку отменили, окно закрыли) — error=CheckCancelled().
+        """
+        if CheckTrace._writer is None:
+            CheckTrace._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sfm-metrics")
+        return CheckTrace._writer.submit(self.finish, error)
+
+
+def read_check_traces(limit=None, check=None):
+    """Записи checks.jsonl — последние limit (после фильтра по проверке)."""
+    records = [r for r in read_metrics(DIAG_METRIC) if r.get("event") == "check"
+               and (check is None or r.get("check") == check)]
+    return records[-limit:] if limit else records
+
+
+def stage_medians(records):
+    """{проверка: {этап: медиана мс}} — для сравнения прогонов во времени."""
+    by_stage = {}
+    for r in records:
+        if r.get("state") != "done": continue
+        for st in r["stages"]:
+            by_stage.setdefault(r["check"], {}).setdefault(st["stage"], []).append(st["ms"])
+    return {check: {name: sorted(v)[len(v) // 2] for name, v in stages.items()}
+            for check, stages in by_stage.items()}
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ИСТОРИЯ ПРОВЕРОК (SQLite)
+# ════════════════════════════════════════════════════════════════════════════
+#  Каждая проверка пишется в DATA_DIR/history.sqlite3: заголовок прогона
+#  (runs) и его строки (results) с индексами по ОГРН, ИНН, normalize(ФИО) и
+#  дате прогона. «История статусов ОГРН X» или «все, кто был В перечне» —
+#  запрос по индексу, без повторного чтения Excel.
+
+HISTORY_PATH      = os.path.join(DATA_DIR, "history.sqlite3")
+HISTORY_KEEP_DAYS = 400       # прогоны старше — удаляются при записи нового
+
+# Какой столбец строки результата — ОГРН / ИНН / ФИО(наименование) / дата рождения / статус
+HISTORY_FIELDS = {
+    "banks": {"ogrn": 0, "name": 1, "status": 2},
+    "mfo":   {"name": 0, "inn": 1, "status": 2},
+    "xml":   {"name": 0, "dob": 1, "status": 2},
+}
+
+_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id        INTEGER PRIMARY KEY,
+    check_id  TEXT NOT NULL,
+    run_at    TEXT NOT NULL,
+    list_date TEXT,
+    source    TEXT,
+    total     INTEGER NOT NULL,
+    hits      INTEGER NOT NULL,
+    counts    TEXT NOT NULL,
+    columns   TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id    INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    ogrn      TEXT,
+    inn       TEXT,
+    name      TEXT,
+    name_norm TEXT,
+    dob       TEXT,
+    status    TEXT,
+    tag       TEXT,
+    row       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_run_at       ON runs(run_at);
+CREATE INDEX IF NOT EXISTS runs_check        ON runs(check_id, run_at);
+CREATE INDEX IF NOT EXISTS results_run       ON results(run_id);
+CREATE INDEX IF NOT EXISTS results_ogrn      ON results(ogrn)      WHERE ogrn IS NOT NULL;
+CREATE INDEX IF NOT EXISTS results_inn       ON results(inn)       WHERE inn IS NOT NULL;
+CREATE INDEX IF NOT EXISTS results_name_norm ON results(name_norm);
+CREATE INDEX IF NOT EXISTS results_status    ON results(status, name_norm);
+"""
+
+
+def _history_value(v):
+    s = str(v).strip()
+    return None if s in ("", "nan", "None", "NaT") else s
+
+
+class HistoryStore:
+    """Журнал прогонов проверок в SQLite.
+
+    record(result) — записать CheckResult одной транзакцией (executemany);
+    record_async — то же в фоновом потоке «sfm-history», по очереди, чтобы
+    окно не ждало диска. Соединение открывается на каждую операцию: так его
+    можно звать из любого потока, а WAL даёт читать во время записи.
+    """
+
+    def __init__(self, path=HISTORY_PATH, keep_days=HISTORY_KEEP_DAYS):
+        self.path      = path
+        self.keep_days = keep_days
+        self._ready    = False
+        self._lock     = threading.Lock()
+        self._executor = None
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_HISTORY_SCHEMA)
+            self._ready = True
+        return conn
+
+    # ── Запись ───────────────────────────────────────────────────────────────
+
+    def record(self, result):
+        """Записать прогон; вернуть его id."""
+        fields = HISTORY_FIELDS.get(result.check, {})
+        get    = {f: fields.get(f) for f in ("ogrn", "inn", "name", "dob", "status")}
+
+        def rows():
+            for r, tag in zip(result.rows, result.tags):
+                out = [_history_value(r[ci]) if ci is not None and ci < len(r) else None
+                       for ci in get.values()]
+                name = out[2]
+                yield (run_id, out[0], out[1], name, normalize(name) if name else None,
+                       out[3], out[4], tag, json.dumps([str(v) for v in r], ensure_ascii=False))
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    cur = conn.execute(
+                        "INSERT INTO runs (check_id, run_at, list_date, source, total, hits, counts, columns)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (result.check, result.finished.isoformat(timespec="seconds"),
+                         result.list_date.isoformat() if result.list_date else None, result.source,
+                         len(result.rows), result.hits,
+                         json.dumps(result.counts, ensure_ascii=False),
+                         json.dumps(list(result.columns), ensure_ascii=False)))
+                    run_id = cur.lastrowid
+                    conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+                    if self.keep_days:
+                        self._prune(conn)
+            finally:
+                conn.close()
+        return run_id
+
+    def _prune(self, conn):
+        cutoff = datetime.fromtimestamp(time.time() - self.keep_days * 86400).isoformat(timespec="seconds")
+        conn.execute("DELETE FROM runs WHERE run_at < ?", (cutoff,))   # строки — каскадом
+
+    def record_async(self, result, on_error=None):
+        """record в фоне; ошибки (диск, блокировка) — в on_error, проверку они не ломают."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sfm-history")
+
+        def task():
+            try:
+                return self.record(result)
+            except Exception as e:
+                if on_error: on_error(e)
+
+        return self._executor.submit(task)
+
+    # ── Запросы ─────────────────────────────────────────────────────────────
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            return [dict(r) for r in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def runs(self, check=None, limit=50):
+        """Последние прогоны (новые первыми)."""
+        where, params = ("WHERE check_id = ?", (check,)) if check else ("", ())
+        out = self._query(f"SELECT * FROM runs {where} ORDER BY run_at DESC, id DESC LIMIT ?",
+                          params + (limit,))
+        for r in out:
+            r["counts"], r["columns"] = json.loads(r["counts"]), json.loads(r["columns"])
+        return out
+
+    def status_history(self, ogrn=None, inn=None, name=None):
+        """Статус записи во всех прогонах, по ОГРН, ИНН или ФИО/наименованию (по normalize)."""
+        if ogrn:   cond, key = "r.ogrn = ?", str(ogrn).strip().replace(" ", "")
+        elif inn:  cond, key = "r.inn = ?", str(inn).strip()
+        elif name: cond, key = "r.name_norm = ?", normalize(name)
+        else: raise ValueError("нужен ogrn, inn или name")
+        return self._query(
+            "SELECT ru.run_at, ru.check_id, ru.list_date, r.name, r.dob, r.status, r.tag"
+            f" FROM results r JOIN runs ru ON ru.id = r.run_id WHERE {cond}"
+            " ORDER BY ru.run_at, ru.id", (key,))
+
+    def ever_with_status(self, status="В перечне", check=None):
+        """Все записи, хоть раз получавшие статус: первый и последний прогон, сколько раз."""
+        cond, params = "r.status = ?", [status]
+        if check: cond += " AND ru.check_id = ?"; params.append(check)
+        return self._query(
+            "SELECT r.name_norm, MAX(r.name) AS name, r.dob, MIN(ru.run_at) AS first_seen,"
+            " MAX(ru.run_at) AS last_seen, COUNT(*) AS times"
+            f" FROM results r JOIN runs ru ON ru.id = r.run_id WHERE {cond}"
+            " GROUP BY r.name_norm, r.dob ORDER BY last_seen DESC", params)
+
+
+history_store = HistoryStore()
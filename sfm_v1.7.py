@@ -1,72 +1,44 @@
+import time
+_T0 = time.perf_counter()   # отсчёт холодного старта — до всех импортов
+
 import os
-import pandas as pd
-import xml.etree.ElementTree as ET
+import json
+import locale
+import queue
+import re
+import sys
 from datetime import datetime
-import customtkinter as ctk
-from tkinter import filedialog, messagebox
-import tkinter.ttk as ttk
-import requests
 import threading
+import heapq
 from collections import Counter
+from operator import itemgetter
 from urllib.parse import quote
 
-# Попытка импорта openpyxl
-try:
-    from openpyxl import Workbook
-    from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
-    HAS_OPENPYXL = True
-except ImportError:
-    HAS_OPENPYXL = False
-
-# ════════════════════════════════════════════════════════════════════════════
-#  ПУТИ И URL
-# ════════════════════════════════════════════════════════════════════════════
-
-BASE_EXCEL_PATH = r"K:\COMPLIANCE\AML\Террористы в Сравни!.xlsx"
-MFO_LOCAL_PATH  = r"K:\COMPLIANCE\AML\Мониторинг\Проверки МФО\МФО на обслуживании.xlsx"
-MFO_CBR_URL     = "https://www.cbr.ru/vfs/finmarkets/files/supervision/list_MFO.xlsx"
-
-# Динамическая ссылка банков — дата подставляется при запросе
-def get_banks_cbr_url():
-    today = datetime.now().strftime("%m/%d/%Y")  # MM/DD/YYYY
-    date_enc = today.replace("/", "%2F")
-    return (
-        f"https://www.cbr.ru/Queries/UniDbQuery/DownloadExcel/98547"
-        f"?FromDate={date_enc}&ToDate={date_enc}"
-        f"&posted=False&backUrl=%2Fbanking_sector%2Fcredit%2FFullCoList%2F"
-    )
+# Логика проверок — без GUI, общая с пакетным режимом (sfm_cli.py).
+# pandas, requests, openpyxl внутри sfm_core грузятся лениво — при первой
+# проверке или фоновой догрузкой после показа меню.
+from sfm_core import (
+    FUZZY_MAX_DISTANCE, BANKS_COLUMNS, MFO_COLUMNS, XML_COLUMNS, HAS_OPENPYXL,
+    normalize, CheckError, CheckCancelled, format_timings,
+    run_banks_check, run_mfo_check, run_xml_check, run_compare_lists, run_loans_check,
+    JobScheduler, RegistryCache, registry_refresher, SearchIndex,
+    CheckTrace, PROFILE_MODES, read_check_traces, stage_medians,
+    LazyModule, StartupTimer, append_metric, preload_modules, history_store,
+)
+
+startup = StartupTimer(_T0)
+startup.mark("sfm_core")
 
-# ════════════════════════════════════════════════════════════════════════════
-#  УТИЛИТЫ
-# ════════════════════════════════════════════════════════════════════════════
-
-def normalize(text):
-    return " ".join(str(text).upper().replace("Ё", "Е").split())
-
-def format_date(value):
-    try: return pd.to_datetime(value).strftime("%Y-%m-%d")
-    except: return ""
-
-def format_date_ru(value):
-    try: return pd.to_datetime(value).strftime("%d.%m.%Y")
-    except: return ""
+import customtkinter as ctk
+from tkinter import filedialog, messagebox
+import tkinter.ttk as ttk
+import tkinter.font as tkfont
+startup.mark("customtkinter + tkinter")
 
-def parse_xml_date(date_str):
-    try: return datetime.strptime(date_str, "%Y-%m-%d").date()
-    except: return None
+pd = LazyModule("pandas")
 
-def clean_ogrn(value):
-    """ОГРН может начинаться с нуля — сохраняем как строку."""
-    if pd.isna(value):
-        return ""
-    s = str(value).strip()
-    # Убираем .0 если число было прочитано как float
-    if s.endswith(".0"):
-        s = s[:-2]
-    # Убираем пробелы
-    s = s.replace(" ", "")
-    return s
+# Фоновая догрузка pandas/requests/openpyxl после показа главного меню
+PRELOAD_ON_START = True
 
 # ════════════════════════════════════════════════════════════════════════════
 #  GUI — ТЕМА
@@ -98,25 +70,105 @@ root.configure(fg_color=CLR_BG)
 current_frame = None
 def clear_frame():
     global current_frame
+    jobs.cancel()      # проверки старого окна больше некому показывать
     if current_frame:
         current_frame.destroy()
 
 # ── Treeview стиль ──────────────────────────────────────────────────────────
+TREE_FONT    = ("Bahnschrift", 13)
+HEADING_FONT = ("Bahnschrift", 13, "bold")
+
 style = ttk.Style()
 style.theme_use("clam")
 style.configure("Treeview",
                 background=CLR_SURFACE, foreground=CLR_TEXT,
                 fieldbackground=CLR_SURFACE, bordercolor=CLR_BORDER,
-                borderwidth=0, font=("Bahnschrift", 13), rowheight=32)
+                borderwidth=0, font=TREE_FONT, rowheight=32)
 style.configure("Treeview.Heading",
                 background=CLR_SURFACE2, foreground=CLR_MUTED,
                 bordercolor=CLR_BORDER, borderwidth=0,
-                font=("Bahnschrift", 13, "bold"), relief="flat")
+                font=HEADING_FONT, relief="flat")
 style.map("Treeview",
           background=[("selected", CLR_ACCENT)],
           foreground=[("selected", "#ffffff")])
 style.map("Treeview.Heading",
           background=[("active", CLR_BORDER)])
+startup.mark("окно и тема")
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ШИНА СОБЫТИЙ: рабочие потоки → окно
+# ════════════════════════════════════════════════════════════════════════════
+
+class UIBus:
+    """Очередь событий от рабочих потоков к окну — Tk не потокобезопасен.
+
+    Потоки только кладут события (put не блокируется) и окна не касаются.
+    Окно разбирает очередь по таймеру раз в TICK_MS: прогресс одного overlay
+    за тик схлопывается до последнего значения, вызовы (готовые и частичные
+    результаты, ошибки, тосты) выполняются по порядку, но не дольше BUDGET
+    за тик — остаток ждёт следующего, окно не замирает.
+    """
+
+    TICK_MS = 50
+    BUDGET  = 0.030   # с на вызовы за тик
+
+    def __init__(self, widget):
+        self.widget = widget
+        self._q = queue.SimpleQueue()
+        widget.after(self.TICK_MS, self._drain)
+
+    # ── Из рабочих потоков ───────────────────────────────────────────────────
+
+    def progress(self, overlay, value, status=None, sub=None):
+        self._q.put(("progress", overlay, (value, status, sub), 0))
+
+    def reporter(self, overlay):
+        """progress(value, status, sub) для run_*_check — через шину."""
+        return lambda value, status=None, sub=None: self.progress(overlay, value, status, sub)
+
+    def post(self, fn, *args, delay=0):
+        """fn(*args) в потоке окна (ещё через delay мс после разбора)."""
+        self._q.put(("call", fn, args, delay))
+
+    def fail(self, overlay, message, title="Ошибка"):
+        self.post(overlay.hide)
+        self.post(messagebox.showerror, title, message)
+
+    # ── В потоке окна ────────────────────────────────────────────────────────
+
+    def _drain(self):
+        deadline = time.perf_counter() + self.BUDGET
+        pending  = {}   # overlay → (value, status, sub) — последнее за тик
+        try:
+            while time.perf_counter() < deadline:
+                try: kind, target, args, delay = self._q.get_nowait()
+                except queue.Empty: break
+                if kind == "progress":
+                    value, status, sub = args
+                    if target in pending:
+                        _, prev_status, prev_sub = pending.pop(target)
+                        status = status or prev_status
+                        sub    = prev_sub if sub is None else sub
+                    pending[target] = (value, status, sub)
+                    continue
+                self._flush(pending)   # прогресс, пришедший раньше вызова, — до него
+                if delay: self.widget.after(delay, target, *args)
+                else:     self._call(target, *args)
+            self._flush(pending)
+        finally:
+            self.widget.after(self.TICK_MS, self._drain)
+
+    def _flush(self, pending):
+        for overlay, args in pending.items(): self._call(overlay.set_progress, *args)
+        pending.clear()
+
+    def _call(self, fn, *args):
+        try: fn(*args)
+        except Exception: self.widget.report_callback_exception(*sys.exc_info())
+
+
+ui_bus = UIBus(root)
+jobs   = JobScheduler()     # проверки в фоне: пул, без дублей, с отменой
 
 # ════════════════════════════════════════════════════════════════════════════
 #  АНИМАЦИИ
@@ -151,6 +203,19 @@ class LoadingOverlay:
         self.pct_lbl = ctk.CTkLabel(self.card, text="0%",
                                     font=("Bahnschrift", 11), text_color=CLR_MUTED)
         self.pct_lbl.pack(pady=(2, 24))
+        self.cancel_btn = ctk.CTkButton(self.card, text="Отменить", width=140, height=30,
+                                        fg_color=CLR_SURFACE2, hover_color=CLR_BORDER, text_color=CLR_TEXT,
+                                        corner_radius=8, font=("Bahnschrift", 12), command=self._cancel)
+        self._on_cancel = None
+
+    def set_cancel(self, on_cancel):
+        """Показать «Отменить»: on_cancel() и overlay скрывается сразу, не дожидаясь потока."""
+        self._on_cancel = on_cancel
+        self.cancel_btn.pack(pady=(0, 20))
+
+    def _cancel(self):
+        if self._on_cancel: self._on_cancel()
+        self.hide()
 
     def show(self, status="Загрузка...", sub=""):
         self.overlay.place(relx=0, rely=0, relwidth=1, relheight=1)
@@ -163,7 +228,9 @@ class LoadingOverlay:
         self._animate()
 
     def hide(self):
-        self._running = False
+        self._running   = False
+        self._on_cancel = None
+        self.cancel_btn.pack_forget()
         self.overlay.place_forget()
 
     def set_progress(self, value, status=None, sub=None):
@@ -205,13 +272,227 @@ class ToastNotification:
             self._visible = False
 
 
-def animate_rows(tree, rows, tags_list, delay=18):
-    def _insert(idx):
-        if idx >= len(rows): return
-        tag = tags_list[idx] if tags_list else ""
-        tree.insert("", "end", values=rows[idx], tags=(tag,) if tag else ())
-        tree.after(delay, lambda: _insert(idx + 1))
-    _insert(0)
+# Анимация появления строк: только в видимом окне таблицы и не дольше бюджета
+ANIMATE_ROWS        = True
+ANIMATION_BUDGET_MS = 400
+
+def animate_rows(tree, rows, delay=18):
+    """Показать строки модели в VirtualTreeview.
+
+    Каскад «по одной строке» идёт лишь по видимому окну и укладывается в
+    ANIMATION_BUDGET_MS, поэтому время не зависит от размера результата.
+    """
+    tree.set_rows(rows)
+    n = tree.visible_count()
+    if not ANIMATE_ROWS or n <= 1: return
+    step = max(1, min(delay, ANIMATION_BUDGET_MS // n))
+
+    def _reveal(k):
+        if tree.rows is not rows: return   # данные уже заменили
+        tree.reveal(k if k < n else None)
+        if k < n: tree.after(step, lambda: _reveal(k + 1))
+    _reveal(1)
+
+# ════════════════════════════════════════════════════════════════════════════
+#  МОДЕЛЬ РЕЗУЛЬТАТОВ
+# ════════════════════════════════════════════════════════════════════════════
+
+class ResultRows(list):
+    """all_rows: строки результата {"values", "tag"} + сводки, которые ведутся
+    по мере добавления строк (append/extend), а не пересчётом всей таблицы.
+
+    longest(ci)   — самые длинные значения столбца: ширину меряем только по ним;
+    status_counts — число строк по статусу (столбец STATUS_COLUMN) для дашборда.
+    Перестановка строк (сортировка) содержимое не меняет, сводки остаются верны.
+    """
+
+    WIDTH_CANDIDATES = 12    # сколько самых длинных строк столбца держать для замера
+    STATUS_COLUMN    = 2     # «Статус лицензии» / «Статус» во всех проверках
+
+    def __init__(self, rows=()):
+        super().__init__()
+        self._longest      = []   # по столбцу: куча (длина, текст) из WIDTH_CANDIDATES штук
+        self.status_counts = Counter()
+        self.extend(rows)
+
+    def append(self, rd):
+        super().append(rd)
+        values = rd["values"]
+        while len(self._longest) < len(values): self._longest.append([])
+        for heap, v in zip(self._longest, values):
+            s = str(v)
+            if len(heap) < self.WIDTH_CANDIDATES:
+                heapq.heappush(heap, (len(s), s))
+            elif len(s) > heap[0][0]:
+                heapq.heapreplace(heap, (len(s), s))
+        self.status_counts[str(values[self.STATUS_COLUMN]) if len(values) > self.STATUS_COLUMN else "—"] += 1
+
+    def extend(self, rows):
+        for rd in rows: self.append(rd)
+
+    def clear(self):
+        super().clear()
+        self._longest = []
+        self.status_counts.clear()
+
+    def longest(self, ci):
+        return [s for _, s in self._longest[ci]] if ci < len(self._longest) else []
+
+# ════════════════════════════════════════════════════════════════════════════
+#  ТАБЛИЦА РЕЗУЛЬТАТОВ (виртуальная)
+# ════════════════════════════════════════════════════════════════════════════
+
+class VirtualTreeview(ttk.Treeview):
+    """Treeview, в котором элементами являются только видимые строки.
+
+    rows — модель представления: список словарей {"values": ..., "tag": ...}
+    (all_rows или его отфильтрованная часть). При прокрутке те же элементы
+    заполняются следующей порцией строк, поэтому вставка, прокрутка и
+    фильтрация не зависят от числа строк. Полоса прокрутки подключается как
+    обычно: command=tree.yview и tree.configure(yscrollcommand=...).
+    """
+
+    def __init__(self, master=None, **kw):
+        self._yscroll = kw.pop("yscrollcommand", None)
+        super().__init__(master, **kw)
+        self.rows      = []
+        self.model     = None   # полный набор (all_rows), если rows — его отфильтрованная часть
+        self.sort_keys = []     # [(индекс столбца, по убыванию)] — см. sort_column
+        self._sort_memo = {}    # столбец → ранги значений (см. _column_ranks)
+        self._shift_click = False
+        self._offset   = 0
+        self._items    = []     # iid видимых элементов
+        self._shown    = []     # какие строки модели в них сейчас
+        self._reveal   = None   # ограничение окна на время анимации
+        self._selected = None   # выделенная строка модели
+        self._header_h = None
+        self._row_h    = int(ttk.Style().lookup("Treeview", "rowheight") or 32)
+
+        self.bind("<Configure>",        lambda e: self._render())
+        self.bind("<Button-1>",         self._on_click)
+        self.bind("<<TreeviewSelect>>", self._on_select)
+        self.bind("<MouseWheel>",       self._on_wheel)
+        self.bind("<Button-4>",         lambda e: self._scroll_by(-3))
+        self.bind("<Button-5>",         lambda e: self._scroll_by(3))
+        self.bind("<Up>",               lambda e: self._on_arrow(-1))
+        self.bind("<Down>",             lambda e: self._on_arrow(1))
+        self.bind("<Prior>",            lambda e: self._scroll_by(-self.visible_count()))
+        self.bind("<Next>",             lambda e: self._scroll_by(self.visible_count()))
+
+    # ── модель ─────────────────────────────────────────────────────────────
+    def set_rows(self, rows, keep_position=False):
+        """Новая модель представления. Обновляются только видимые элементы."""
+        if rows is not self.rows:
+            self._selected = None
+        self.rows   = rows
+        self._reveal = None
+        if not keep_position: self._offset = 0
+        self._render()
+
+    def refresh(self):
+        """Перерисовать окно после изменения rows на месте (сортировка и т.п.)."""
+        self._shown = [None] * len(self._shown)
+        self._render()
+
+    def reveal(self, count):
+        self._reveal = count
+        self._render()
+
+    def visible_count(self):
+        h = self.winfo_height()
+        if h <= 1:   # ещё не отрисован — берём высоту в строках из параметров
+            return int(self.cget("height") or 10)
+        if self._header_h is None and self._items:
+            bbox = self.bbox(self._items[0])
+            if bbox: self._header_h = bbox[1]
+        return max(1, (h - (self._header_h or self._row_h)) // self._row_h)
+
+    # ── прокрутка ──────────────────────────────────────────────────────────
+    def configure(self, cnf=None, **kw):
+        if "yscrollcommand" in kw:
+            self._yscroll = kw.pop("yscrollcommand")
+            self._update_scrollbar()
+            if cnf is None and not kw: return
+        return super().configure(cnf, **kw)
+    config = configure
+
+    def yview(self, *args):
+        n, total = self.visible_count(), len(self.rows)
+        if not args:
+            return self._fractions(n, total)
+        if args[0] == "moveto":
+            self._offset = int(float(args[1]) * total)
+        elif args[0] == "scroll":
+            step = int(float(args[1]))
+            self._offset += step * (n if str(args[2]).startswith("page") else 1)
+        self._render()
+
+    def _scroll_by(self, delta):
+        self._offset += delta
+        self._render()
+        return "break"
+
+    def _on_wheel(self, event):
+        return self._scroll_by(-3 * int(event.delta / 120) if event.delta else 0)
+
+    def _on_arrow(self, delta):
+        """Стрелки у края окна листают модель, а не упираются в последний элемент."""
+        focus = self.focus()
+        if focus not in self._items: return None
+        pos = self._items.index(focus) + delta
+        if 0 <= pos < len(self._items): return None   # обычное поведение Treeview
+        idx = self._offset + pos
+        if not 0 <= idx < len(self.rows): return "break"
+        self._selected = self.rows[idx]
+        self._scroll_by(delta)
+        return "break"
+
+    def _on_click(self, event):
+        # Shift+клик по заголовку — сортировка по ещё одному столбцу (см. sort_column)
+        self._shift_click = bool(event.state & 0x0001)
+
+    def _on_select(self, _event=None):
+        sel = self.selection()
+        if sel and sel[0] in self._items:
+            self._selected = self._shown[self._items.index(sel[0])]
+
+    def _fractions(self, n, total):
+        if not total: return 0.0, 1.0
+        return self._offset / total, min(1.0, (self._offset + n) / total)
+
+    def _update_scrollbar(self):
+        if self._yscroll:
+            self._yscroll(*self._fractions(self.visible_count(), len(self.rows)))
+
+    # ── отрисовка окна ─────────────────────────────────────────────────────
+    def _render(self):
+        n, total = self.visible_count(), len(self.rows)
+        self._offset = max(0, min(self._offset, total - n))
+        window = self.rows[self._offset:self._offset + n]
+        if self._reveal is not None:
+            window = window[:self._reveal]
+
+        while len(self._items) > len(window):
+            self.delete(self._items.pop()); self._shown.pop()
+        focus_iid = None
+        for i, rd in enumerate(window):
+            tags = (rd["tag"],) if rd["tag"] else ()
+            if i < len(self._items):
+                if self._shown[i] is not rd:
+                    self.item(self._items[i], values=rd["values"], tags=tags)
+                    self._shown[i] = rd
+            else:
+                self._items.append(self.insert("", "end", values=rd["values"], tags=tags))
+                self._shown.append(rd)
+            if rd is self._selected:
+                focus_iid = self._items[i]
+
+        if focus_iid:
+            if self.selection() != (focus_iid,): self.selection_set(focus_iid)
+            self.focus(focus_iid)
+        elif self.selection():
+            self.selection_remove(*self.selection())
+        self._update_scrollbar()
 
 # ════════════════════════════════════════════════════════════════════════════
 #  📋  КОПИРОВАТЬ СТРОКУ
@@ -238,7 +519,7 @@ def attach_context_menu(tree, toast):
         toast.show("Строка скопирована", icon="📋")
 
     def copy_all():
-        rows = ["\t".join(str(v) for v in tree.item(k, "values")) for k in tree.get_children()]
+        rows = ["\t".join(str(v) for v in rd["values"]) for rd in tree.rows]
         root.clipboard_clear(); root.clipboard_append("\n".join(rows))
         toast.show(f"Скопировано {len(rows)} строк", icon="📋")
 
@@ -260,83 +541,135 @@ def attach_context_menu(tree, toast):
 # ════════════════════════════════════════════════════════════════════════════
 
 def export_to_excel(tree, sheet_name="Результаты", toast=None):
-    rows = [tree.item(k, "values") for k in tree.get_children()]
-    if not rows:
+    model = list(tree.rows)          # снимок: фильтр может смениться, пока идёт запись
+    if not model:
         messagebox.showwarning("Экспорт", "Таблица пустая."); return
 
-    columns  = [tree.heading(c)["text"] for c in tree["columns"]]
+    columns  = list(tree["columns"])   # текст заголовка может содержать ▲/▼
+    widths   = export_widths(tree, columns)
     save_path = filedialog.asksaveasfilename(
         defaultextension=".xlsx", filetypes=[("Excel файл", "*.xlsx")],
         title="Сохранить результаты",
         initialfile=f"СФМ_{sheet_name}_{datetime.now().strftime('%d.%m.%Y')}.xlsx")
     if not save_path: return
 
-    if HAS_OPENPYXL:
-        _export_styled(rows, columns, save_path, sheet_name, tree)
-    else:
-        pd.DataFrame(rows, columns=columns).to_excel(save_path, index=False, sheet_name=sheet_name)
-
-    if toast: toast.show(f"Экспортировано {len(rows)} строк", icon="📤")
-    else: messagebox.showinfo("Экспорт", f"Сохранено: {save_path}")
-
-
-def _export_styled(rows, columns, path, sheet_name, tree):
-    wb = Workbook(); ws = wb.active; ws.title = sheet_name[:31]
-    HDR_FILL = PatternFill("solid", fgColor="E2EAF3")
-    RED_FILL = PatternFill("solid", fgColor="F0D8D8")
-    GRN_FILL = PatternFill("solid", fgColor="D0EEDD")
-    YLW_FILL = PatternFill("solid", fgColor="F0EAD0")
-    ALT_FILL = PatternFill("solid", fgColor="EEF2F7")
-    DEF_FILL = PatternFill("solid", fgColor="F8FAFC")
-    HDR_FONT = Font(name="Bahnschrift", bold=True, color="6A8090", size=11)
-    DEF_FONT = Font(name="Bahnschrift", color="2A3A46", size=11)
-    RED_FONT = Font(name="Bahnschrift", color="A03030", size=11)
-    GRN_FONT = Font(name="Bahnschrift", color="2A7A48", size=11)
-    YLW_FONT = Font(name="Bahnschrift", color="806020", size=11)
-    border   = Border(bottom=Side(style="thin", color="C4D4E4"))
-
-    for ci, col in enumerate(columns, 1):
-        c = ws.cell(row=1, column=ci, value=col)
-        c.fill = HDR_FILL; c.font = HDR_FONT
-        c.alignment = Alignment(horizontal="left", vertical="center")
-        c.border = border
-    ws.row_dimensions[1].height = 22
-
-    PRP_FILL = PatternFill("solid", fgColor="E8E0F0")
-    PRP_FONT = Font(name="Bahnschrift", color="604090", size=11)
-
-    all_children = list(tree.get_children())
-    for ri, rv in enumerate(rows, 2):
-        tag    = tree.item(all_children[ri - 2], "tags")
-        is_red = "red" in tag or "excluded" in tag or "revoked" in tag
-        is_grn = "active" in tag
-        is_ylw = "restricted" in tag or "cancelled" in tag
-        is_prp = "liquidated" in tag
-        for ci, val in enumerate(rv, 1):
-            c = ws.cell(row=ri, column=ci, value=str(val))
-            c.fill = (RED_FILL if is_red else GRN_FILL if is_grn else
-                      PRP_FILL if is_prp else YLW_FILL if is_ylw else
-                      (ALT_FILL if ri%2==0 else DEF_FILL))
-            c.font = (RED_FONT if is_red else GRN_FONT if is_grn else
-                      PRP_FONT if is_prp else YLW_FONT if is_ylw else DEF_FONT)
-            c.alignment = Alignment(horizontal="left", vertical="center")
-            c.border = border
-        ws.row_dimensions[ri].height = 20
-
-    for ci, col in enumerate(columns, 1):
-        mw = max([len(str(r[ci-1])) for r in rows] + [len(col)]) + 4
-        ws.column_dimensions[get_column_letter(ci)].width = min(mw, 60)
+    def worker():
+        try:
+            with CheckTrace("export") as trace:
+                t0 = time.perf_counter()
+                if HAS_OPENPYXL:
+                    _export_styled(model, columns, save_path, sheet_name, widths)
+                else:
+                    pd.DataFrame([rd["values"] for rd in model], columns=columns).to_excel(
+                        save_path, index=False, sheet_name=sheet_name)
+                trace.stage("Запись xlsx", time.perf_counter() - t0, rows=len(model),
+                            bytes=os.path.getsize(save_path))
+                trace.summary = {"rows": len(model)}
+        except Exception as e:
+            ui_bus.post(messagebox.showerror, "Экспорт", str(e)); return
+        if toast: ui_bus.post(lambda: toast.show(f"Экспортировано {len(model)} строк", icon="📤"))
+        else: ui_bus.post(messagebox.showinfo, "Экспорт", f"Сохранено: {save_path}")
+
+    threading.Thread(target=worker, daemon=True).start()
+
+
+# Стили экспорта: имя → (заливка, цвет шрифта). Тег строки → стиль; строки
+# без подсветки чередуются export_alt / export_def.
+EXPORT_STYLES = {
+    "export_hdr": ("E2EAF3", "6A8090"),
+    "export_red": ("F0D8D8", "A03030"),
+    "export_grn": ("D0EEDD", "2A7A48"),
+    "export_ylw": ("F0EAD0", "806020"),
+    "export_prp": ("E8E0F0", "604090"),
+    "export_alt": ("EEF2F7", "2A3A46"),
+    "export_def": ("F8FAFC", "2A3A46"),
+}
+EXPORT_TAG_STYLE = {
+    "red": "export_red", "excluded": "export_red", "revoked": "export_red",
+    "active": "export_grn",
+    "liquidated": "export_prp",
+    "restricted": "export_ylw", "cancelled": "export_ylw", "found": "export_ylw",
+}
+
+
+def export_widths(tv, columns):
+    """Ширины столбцов экспорта (в символах) по самым длинным значениям модели —
+    их уже ведёт ResultRows. None — модель без сводок, ширины посчитает экспорт."""
+    model = tv.model if tv.model is not None else tv.rows
+    if not isinstance(model, ResultRows): return None
+    return [max([len(col)] + [len(s) for s in model.longest(ci)]) for ci, col in enumerate(columns)]
+
+
+def _export_styled(model, columns, path, sheet_name, widths=None):
+    """Потоковая запись (openpyxl write_only) с общими именованными стилями.
+
+    Ширины столбцов нужны до первой строки (<cols> стоит перед <sheetData>):
+    их передаёт окно (export_widths), иначе — отдельный проход по модели только
+    с длинами значений. Строки пишутся одним проходом, по одной: ни копии
+    модели, ни книги в памяти не строится.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import NamedStyle, PatternFill, Font, Alignment, Border, Side
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name[:31])
+    border = Border(bottom=Side(style="thin", color="C4D4E4"))
+    align  = Alignment(horizontal="left", vertical="center")
+    for name, (fill, color) in EXPORT_STYLES.items():
+        wb.add_named_style(NamedStyle(
+            name=name, fill=PatternFill("solid", fgColor=fill), border=border, alignment=align,
+            font=Font(name="Bahnschrift", bold=name == "export_hdr", color=color, size=11)))
+
+    if widths is None:
+        widths = [len(col) for col in columns]
+        for rd in model:
+            for ci, v in enumerate(rd["values"][:len(widths)]):
+                n = len(str(v))
+                if n > widths[ci]: widths[ci] = n
+
+    for ci, w in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(ci)].width = min(w + 4, 60)
+    ws.sheet_format.defaultRowHeight = 20
+    ws.sheet_format.customHeight     = True
+    ws.row_dimensions[1].height      = 22
     ws.freeze_panes = "A2"
+
+    def styled(values, style):
+        out = []
+        for v in values:
+            c = WriteOnlyCell(ws, value=v); c.style = style; out.append(c)
+        return out
+
+    ws.append(styled(columns, "export_hdr"))
+    for ri, rd in enumerate(model, 2):
+        style = EXPORT_TAG_STYLE.get(rd["tag"]) or ("export_alt" if ri % 2 == 0 else "export_def")
+        ws.append(styled([str(v) for v in rd["values"]], style))
     wb.save(path)
 
 # ════════════════════════════════════════════════════════════════════════════
 #  🔍  РАСШИРЕННЫЙ ПОИСК
 # ════════════════════════════════════════════════════════════════════════════
 
+# Пауза после последнего нажатия клавиши перед фильтрацией, мс
+SEARCH_DEBOUNCE_MS = 150
+
 class AdvancedSearch:
+    """Поиск по ФИО/наименованию и фильтр по статусу над all_rows.
+
+    Индекс (SearchIndex из sfm_core) строится один раз на набор результатов
+    (update_statuses), триграммы — в фоне.
+    """
+
     def __init__(self, parent, tree, all_rows_ref):
         self.tree         = tree
         self.all_rows_ref = all_rows_ref
+        tree.model        = all_rows_ref
+
+        self._rows     = []     # снимок all_rows, к которому относится индекс
+        self._index    = SearchIndex([])
+        self._after_id = None
 
         self.frame = ctk.CTkFrame(parent, fg_color=CLR_SURFACE2,
                                   corner_radius=10, border_width=1, border_color=CLR_BORDER)
@@ -344,7 +677,7 @@ class AdvancedSearch:
         row1.pack(fill="x", padx=10, pady=(8, 4))
 
         self.search_var = ctk.StringVar()
-        self.search_var.trace_add("write", lambda *_: self.apply())
+        self.search_var.trace_add("write", lambda *_: self._schedule())
         ctk.CTkEntry(row1, textvariable=self.search_var, width=260,
                      fg_color=CLR_SURFACE, border_color=CLR_BORDER, text_color=CLR_TEXT,
                      placeholder_text="🔍 Поиск...", corner_radius=8,
@@ -374,29 +707,46 @@ class AdvancedSearch:
         self.frame.pack(**kwargs)
 
     def update_statuses(self):
-        statuses = set()
-        for r in self.all_rows_ref:
-            if len(r["values"]) >= 3:
-                statuses.add(str(r["values"][2]))
+        """Вызывается после загрузки результатов: статусы для фильтра и новый индекс."""
+        reset_sort(self.tree)
+        self._rows  = list(self.all_rows_ref)
+        self._index = SearchIndex([rd["values"][0] if rd["values"] else "" for rd in self._rows],
+                                  [str(rd["values"][2]) if len(rd["values"]) >= 3 else None
+                                   for rd in self._rows])
+        # Прежний индекс, если его триграммы ещё строятся, просто никому не нужен
+        threading.Thread(target=self._index.build_grams, daemon=True).start()
+        statuses = {st for st in self._index.statuses if st is not None}
         self.status_cb.configure(values=["Все статусы"] + sorted(statuses))
 
+    def _schedule(self):
+        if self._after_id: self.frame.after_cancel(self._after_id)
+        self._after_id = self.frame.after(SEARCH_DEBOUNCE_MS, self.apply)
+
     def apply(self):
+        self._after_id = None
         query  = normalize(self.search_var.get())
         status = self.status_var.get()
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        show = 0
-        for rd in self.all_rows_ref:
-            vals   = rd["values"]
-            tag    = rd["tag"]
-            fio_ok = (not query) or (query in normalize(str(vals[0])))
-            st_ok  = (status == "Все статусы") or (len(vals) >= 3 and str(vals[2]) == status)
-            if fio_ok and st_ok:
-                self.tree.insert("", "end", values=vals, tags=(tag,) if tag else ())
-                show += 1
-        total = len(self.all_rows_ref)
-        self.count_lbl.configure(
-            text=f"Показано: {show} из {total}" if (query or status != "Все статусы") else f"Всего: {total}")
+        model  = self.all_rows_ref
+        if len(self._rows) != len(model):
+            self.update_statuses()   # модель сменилась без update_statuses
+
+        if not query and status == "Все статусы":
+            self._index.filter("")
+            self.tree.set_rows(model)
+            self.count_lbl.configure(text=f"Всего: {len(model)}")
+            return
+
+        hits = self._index.filter(query, None if status == "Все статусы" else status)
+        # Порядок — как в модели (она могла быть отсортирована после индексации)
+        if len(hits) == len(model):
+            shown = list(model)
+        elif not hits:
+            shown = []
+        else:
+            wanted = {id(self._rows[i]) for i in hits}
+            shown  = [rd for rd in model if id(rd) in wanted]
+        self.tree.set_rows(shown)
+        self.count_lbl.configure(text=f"Показано: {len(shown)} из {len(model)}")
 
     def reset(self):
         self.search_var.set("")
@@ -414,6 +764,8 @@ COLOR_MAP = {
     "Исключен":         "#f85149",   # красный (опасный статус)
     "Добавлен":         "#f85149",   # красный
     "Удален":           "#d29922",   # жёлтый
+    "Изменен":          "#a371f7",   # фиолетовый (та же ФИО, другая дата рождения)
+    "Похожее совпадение": "#d29922", # жёлтый (нечёткий поиск)
     # ── МФО ─────────────────────────────────────────
     "Действующий":      "#3fb950",   # зелёный
     "Исключён":         "#f85149",   # красный (исключён из реестра = опасно)
@@ -439,11 +791,43 @@ def get_status_color(status: str) -> str:
     if "ЛИКВИДАЦ" in s or "ЛИКВИДИР" in s: return "#8070b0"  # фиолетовый
     if "ЗАПРЕЩ" in s or "ОГРАНИЧЕН" in s: return "#b08030"  # жёлтый приглушённый
     if "ИСКЛЮЧ" in s:                return "#c05a5a"  # красный приглушённый
+    if "ПОХОЖ" in s:                 return "#b08030"  # жёлтый приглушённый
     if "В ПЕРЕЧНЕ" in s:             return "#c05a5a"  # красный приглушённый
     if "НЕТ В ПЕРЕЧНЕ" in s:         return "#4aaa6a"  # зелёный
     if "НЕ НАЙДЕН" in s:             return "#8090a0"  # серый
     return "#6a8090"  # серый по умолчанию
 
+DASHBOARD_TOP_STATUSES = 8      # остальные статусы — одной строкой «Прочие»
+
+
+def dashboard_items(counts, top=DASHBOARD_TOP_STATUSES):
+    """[(статус, число)] по убыванию; хвост сворачивается в «Прочие (N)»."""
+    items = [(k, v) for k, v in counts.most_common() if v > 0]
+    if len(items) <= top + 1: return items
+    rest = items[top:]
+    return items[:top] + [(f"Прочие ({len(rest)})", sum(v for _, v in rest))]
+
+
+def redraw_on_resize(canvas, layout, delay=60):
+    """layout(width) — только когда ширина холста действительно изменилась,
+    и не чаще раза в delay мс: перетаскивание края окна даёт десятки <Configure>."""
+    state = {"width": None, "job": None}
+
+    def run():
+        state["job"] = None
+        w = canvas.winfo_width()
+        if w > 1 and w != state["width"]:
+            state["width"] = w; layout(w)
+
+    def on_configure(event):
+        if event.width == state["width"]: return
+        if state["job"]: canvas.after_cancel(state["job"])
+        state["job"] = canvas.after(delay, run)
+
+    canvas.bind("<Configure>", on_configure)
+    canvas.after(100, run)
+
+
 def open_dashboard(all_rows, title="Статистика проверки"):
     if not all_rows:
         messagebox.showinfo("Дашборд", "Нет данных — сначала выполните проверку."); return
@@ -463,9 +847,11 @@ def open_dashboard(all_rows, title="Статистика проверки"):
     sf = ctk.CTkScrollableFrame(dw, fg_color=CLR_BG)
     sf.pack(fill="both", expand=True, padx=16, pady=12)
 
-    statuses = [str(r["values"][2]) if len(r["values"]) >= 3 else "—" for r in all_rows]
-    counts   = Counter(statuses)
-    total    = len(all_rows)
+    # Сводка уже посчитана по ходу загрузки (ResultRows) — тут только копия
+    if not isinstance(all_rows, ResultRows): all_rows = ResultRows(all_rows)
+    counts = Counter(all_rows.status_counts)
+    total  = len(all_rows)
+    items  = dashboard_items(counts)
 
     # KPI
     kpi_frame = ctk.CTkFrame(sf, fg_color="transparent")
@@ -485,68 +871,60 @@ def open_dashboard(all_rows, title="Статистика проверки"):
 
     import tkinter as tk
 
-    # Bar chart
+    # Bar chart: элементы рисуются один раз, при смене ширины — только coords
     bar_card = ctk.CTkFrame(sf, fg_color=CLR_SURFACE, corner_radius=12,
                             border_width=1, border_color=CLR_BORDER)
     bar_card.pack(fill="x", pady=(0, 16))
     ctk.CTkLabel(bar_card, text="Распределение по статусам",
                  font=("Bahnschrift", 13, "bold"), text_color=CLR_TEXT).pack(anchor="w", padx=18, pady=(14, 8))
-    bar_canvas = tk.Canvas(bar_card, bg=CLR_SURFACE, bd=0, highlightthickness=0, height=200)
+    bar_h, gap, label_w = 28, 14, 220
+    bar_canvas = tk.Canvas(bar_card, bg=CLR_SURFACE, bd=0, highlightthickness=0,
+                           height=10 + len(items) * (bar_h + gap))
     bar_canvas.pack(fill="x", padx=18, pady=(0, 16))
 
-    def draw_bars(event=None):
-        bar_canvas.delete("all")
-        items = [(k, v) for k, v in counts.items() if v > 0]
-        if not items: return
-        w = bar_canvas.winfo_width() or 800
-        max_v, bar_h, gap, label_w = max(v for _,v in items), 28, 14, 220
-        for i, (status, count) in enumerate(items):
-            y     = 10 + i * (bar_h + gap)
-            bw    = int((w - label_w - 80) * count / max_v)
-            color = get_status_color(status)
-            bar_canvas.create_text(label_w - 8, y + bar_h//2, text=status,
-                                   anchor="e", fill=CLR_MUTED, font=("Bahnschrift", 11))
-            bar_canvas.create_rectangle(label_w, y, label_w + (w - label_w - 80), y + bar_h,
-                                        fill=CLR_SURFACE2, outline="")
-            if bw > 0:
-                bar_canvas.create_rectangle(label_w, y, label_w + bw, y + bar_h, fill=color, outline="")
-            bar_canvas.create_text(label_w + bw + 8, y + bar_h//2, text=str(count),
-                                   anchor="w", fill=CLR_TEXT, font=("Bahnschrift", 11, "bold"))
-        bar_canvas.configure(height=10 + len(items) * (bar_h + gap))
-
-    bar_canvas.bind("<Configure>", draw_bars)
-    dw.after(100, draw_bars)
-
-    # Pie chart
+    max_v, bars = max(v for _, v in items), []
+    for i, (status, count) in enumerate(items):
+        y = 10 + i * (bar_h + gap)
+        bar_canvas.create_text(label_w - 8, y + bar_h//2, text=status,
+                               anchor="e", fill=CLR_MUTED, font=("Bahnschrift", 11))
+        bars.append((y, count,
+                     bar_canvas.create_rectangle(0, 0, 0, 0, fill=CLR_SURFACE2, outline=""),
+                     bar_canvas.create_rectangle(0, 0, 0, 0, fill=get_status_color(status), outline=""),
+                     bar_canvas.create_text(0, 0, text=str(count), anchor="w",
+                                            fill=CLR_TEXT, font=("Bahnschrift", 11, "bold"))))
+
+    def layout_bars(w):
+        span = max(w - label_w - 80, 0)
+        for y, count, track, bar, value in bars:
+            bw = int(span * count / max_v)
+            bar_canvas.coords(track, label_w, y, label_w + span, y + bar_h)
+            bar_canvas.coords(bar, label_w, y, label_w + bw, y + bar_h)
+            bar_canvas.coords(value, label_w + bw + 8, y + bar_h//2)
+
+    redraw_on_resize(bar_canvas, layout_bars)
+
+    # Pie chart: от размера окна не зависит — рисуется один раз
     pie_card = ctk.CTkFrame(sf, fg_color=CLR_SURFACE, corner_radius=12,
                             border_width=1, border_color=CLR_BORDER)
     pie_card.pack(fill="x", pady=(0, 16))
     ctk.CTkLabel(pie_card, text="Доля по статусам",
                  font=("Bahnschrift", 13, "bold"), text_color=CLR_TEXT).pack(anchor="w", padx=18, pady=(14, 8))
-    pie_canvas = tk.Canvas(pie_card, bg=CLR_SURFACE, bd=0, highlightthickness=0, height=230)
+    cx, cy, r, start = 130, 110, 90, 0
+    lx, ly = cx + r + 30, max(8, cy - len(items) * 12)
+    pie_canvas = tk.Canvas(pie_card, bg=CLR_SURFACE, bd=0, highlightthickness=0,
+                           height=max(230, ly + len(items) * 24))
     pie_canvas.pack(fill="x", padx=18, pady=(0, 16))
 
-    def draw_pie(event=None):
-        pie_canvas.delete("all")
-        items = [(k, v) for k, v in counts.items() if v > 0]
-        if not items: return
-        cx, cy, r, start = 130, 110, 90, 0
-        for status, count in items:
-            extent = 360 * count / total
-            color  = get_status_color(status)
-            pie_canvas.create_arc(cx-r, cy-r, cx+r, cy+r, start=start, extent=extent,
-                                  fill=color, outline=CLR_BG, width=2)
-            start += extent
-        lx, ly = cx + r + 30, cy - len(items) * 14
-        for status, count in items:
-            color = get_status_color(status)
-            pie_canvas.create_rectangle(lx, ly, lx+14, ly+14, fill=color, outline="")
-            pie_canvas.create_text(lx+20, ly+7, text=f"{status}  {count}  ({count/total*100:.1f}%)",
-                                   anchor="w", fill=CLR_TEXT, font=("Bahnschrift", 11))
-            ly += 24
-
-    pie_canvas.bind("<Configure>", draw_pie)
-    dw.after(150, draw_pie)
+    for status, count in items:
+        extent = 360 * count / total
+        pie_canvas.create_arc(cx-r, cy-r, cx+r, cy+r, start=start, extent=min(extent, 359.99),
+                              fill=get_status_color(status), outline=CLR_BG, width=2)
+        start += extent
+    for status, count in items:
+        pie_canvas.create_rectangle(lx, ly, lx+14, ly+14, fill=get_status_color(status), outline="")
+        pie_canvas.create_text(lx+20, ly+7, text=f"{status}  {count}  ({count/total*100:.1f}%)",
+                               anchor="w", fill=CLR_TEXT, font=("Bahnschrift", 11))
+        ly += 24
 
     # Время
     info_card = ctk.CTkFrame(sf, fg_color=CLR_SURFACE, corner_radius=12,
@@ -560,11 +938,130 @@ def open_dashboard(all_rows, title="Статистика проверки"):
 #  СОРТИРОВКА
 # ════════════════════════════════════════════════════════════════════════════
 
-def sort_column(tv, col, reverse):
-    data = [(tv.set(k, col), k) for k in tv.get_children("")]
-    data.sort(reverse=reverse)
-    for i, (_, k) in enumerate(data): tv.move(k, "", i)
-    tv.heading(col, command=lambda: sort_column(tv, col, not reverse))
+# Ключи сортировки: даты и числа (ОГРН/ИНН, проценты) сравниваются как
+# значения, текст — по правилам русского алфавита, пустые — в конце.
+_SORT_DATE_ISO = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+_SORT_DATE_RU  = re.compile(r"^(\d{2})\.(\d{2})\.(\d{4})$")
+_SORT_NUMBER   = re.compile(r"^-?\d+(?:[.,]\d+)?%?$")
+
+
+def _init_collation():
+    """locale.strxfrm с русской сортировкой, если такая локаль есть в системе."""
+    for name in ("ru_RU.UTF-8", "ru_RU.utf8", "Russian_Russia.1251", "ru-RU", ""):
+        try: locale.setlocale(locale.LC_COLLATE, name)
+        except locale.Error: continue
+        if locale.strxfrm("ё") < locale.strxfrm("ж") < locale.strxfrm("я"):
+            return locale.strxfrm
+    # Без локали: по кодам символов, но Ё — вместе с Е, регистр не важен
+    return lambda s: s.replace("ё", "е") + "\x00" + s
+
+_collate = _init_collation()
+
+
+def sort_key(value):
+    """Типизированный ключ: (0, дата) < (1, число) < (2, текст) < (3,) — пусто."""
+    s = str(value).strip()
+    if not s or s in ("nan", "None", "NaT"): return (3,)
+    if s[0].isdigit() or s[0] == "-":      # ФИО и наименования — сразу к тексту
+        m = _SORT_DATE_ISO.match(s)
+        if m: return (0, (int(m[1]), int(m[2]), int(m[3])))
+        m = _SORT_DATE_RU.match(s)
+        if m: return (0, (int(m[3]), int(m[2]), int(m[1])))
+        if s.isdigit(): return (1, int(s))
+        if _SORT_NUMBER.match(s): return (1, float(s.rstrip("%").replace(",", ".")))
+    return (2, _collate(s.casefold()))
+
+
+_values_of = itemgetter("values")
+
+
+def _column_values(rows, ci):
+    try:
+        return [v[ci] for v in map(_values_of, rows)]
+    except IndexError:   # строки короче столбцов (например, без «Сходство»)
+        return [v[ci] if ci < len(v) else "" for v in map(_values_of, rows)]
+
+
+def _column_ranks(tv, ci, rows):
+    """Значение столбца → место в типизированном порядке и число пустых.
+
+    Ранги считаются по всей модели (подходят и отфильтрованному представлению)
+    и кэшируются до новых результатов; sort_key — один раз на различное значение.
+    """
+    ranks = tv._sort_memo.get(ci)
+    if ranks is None:
+        source = tv.model if tv.model is not None else rows
+        keys   = {v: sort_key(v) for v in set(_column_values(source, ci)) | set(_column_values(rows, ci))}
+        order  = sorted(keys, key=keys.__getitem__)
+        ranks  = tv._sort_memo[ci] = ({v: i for i, v in enumerate(order)},
+                                      sum(1 for k in keys.values() if k == (3,)))
+    return ranks
+
+
+def _sort_rows(tv, rows):
+    """Устойчиво упорядочить rows по tv.sort_keys одной перестановкой."""
+    columns = []
+    for ci, rev in tv.sort_keys:
+        vals = _column_values(rows, ci)
+        rank, empty = _column_ranks(tv, ci, rows)
+        try:
+            r = list(map(rank.__getitem__, vals))
+        except KeyError:                 # модель пополнилась после расчёта рангов
+            del tv._sort_memo[ci]
+            rank, empty = _column_ranks(tv, ci, rows)
+            r = list(map(rank.__getitem__, vals))
+        top = len(rank) - empty          # пустые (ранги от top) — всегда в конце
+        if rev: r = [top - 1 - x if x < top else x for x in r]
+        columns.append(r)
+    key = columns[0] if len(columns) == 1 else list(zip(*columns))
+    order = sorted(range(len(rows)), key=key.__getitem__)
+    rows[:] = [rows[i] for i in order]
+
+
+def sort_column(tv, col):
+    """Клик по заголовку — сортировка по столбцу (повторный клик меняет направление),
+    Shift+клик — добавить столбец к сортировке. Сортируется модель (tv.model) и
+    текущее представление, затем одно обновление таблицы."""
+    ci = list(tv["columns"]).index(col)
+    keys = dict(tv.sort_keys)
+    if tv._shift_click:
+        keys[ci] = not keys[ci] if ci in keys else False
+    else:
+        keys = {ci: not keys[ci] if list(keys) == [ci] else False}
+    tv._shift_click = False
+    tv.sort_keys = list(keys.items())
+
+    if tv.model is not None and tv.model is not tv.rows:
+        _sort_rows(tv, tv.model)
+    _sort_rows(tv, tv.rows)
+    tv.refresh()
+    _update_sort_headings(tv)
+
+
+def _update_sort_headings(tv):
+    cols  = list(tv["columns"])
+    multi = len(tv.sort_keys) > 1
+    marks = {ci: ("▼" if rev else "▲") + (str(n) if multi else "")
+             for n, (ci, rev) in enumerate(tv.sort_keys, 1)}
+    for ci, col in enumerate(cols):
+        tv.heading(col, text=f"{col} {marks[ci]}" if ci in marks else col)
+
+
+def set_columns(tv, columns):
+    """Столбцы таблицы — как у результата: в одном окне бывают проверки с «Сходством» и без."""
+    if tuple(tv["columns"]) == tuple(columns): return
+    widths = {col: tv.column(col, "width") for col in tv["columns"]}
+    tv.configure(columns=columns)
+    for col in columns:
+        tv.heading(col, text=col, command=lambda c=col: sort_column(tv, c))
+        tv.column(col, anchor="w", width=widths.get(col, COLUMN_MIN_WIDTH))
+
+
+def reset_sort(tv):
+    """Новые результаты: сбросить сортировку и кэш ключей."""
+    tv.sort_keys = []
+    tv._sort_memo.clear()
+    _update_sort_headings(tv)
 
 # ════════════════════════════════════════════════════════════════════════════
 #  ИСТОРИЯ ИЗМЕНЕНИЙ
@@ -600,12 +1097,146 @@ Python 3.11–3.14, pip
 """)
     text.configure(state="disabled")
 
+# ════════════════════════════════════════════════════════════════════════════
+#  🩺  ДИАГНОСТИКА
+# ════════════════════════════════════════════════════════════════════════════
+
+DIAG_PANEL_LAST = 50       # сколько последних записей checks.jsonl показывать
+DIAG_REFRESH_MS = 2000     # как часто обновлять строку реестров и заданий
+
+CHECK_TITLES    = {"banks": "Банки", "mfo": "МФО", "xml": "Перечень", "compare": "Сравнение",
+                   "loans": "Кредиты", "export": "Экспорт"}
+REGISTRY_TITLES = {"banks": "Реестр банков", "mfo": "Реестр МФО"}
+PROFILE_TITLES  = {"cpu": "cProfile", "mem": "tracemalloc"}
+
+
+def format_bytes(n):
+    if n is None: return "—"
+    for unit in ("Б", "КБ", "МБ"):
+        if n < 1024: return f"{n:.0f} {unit}" if unit == "Б" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} ГБ"
+
+
+def diag_status_text():
+    """Свежесть реестров ЦБ и активные задания — одна строка на пункт."""
+    lines = []
+    for name, f in registry_refresher.freshness().items():
+        if f["loading"]:
+            state = "загружается…"
+        elif f["age_sec"] is None:
+            state = "ещё не загружен"
+        else:
+            state = f"{f['age_sec'] // 60} мин назад, {RegistryCache.SOURCE_TEXT[f['source']]}"
+            if not f["fresh"]: state += " (устарел)"
+        if f["error"]: state += f" — ошибка: {f['error'].splitlines()[0]}"
+        lines.append(f"{REGISTRY_TITLES[name]}: {state}")
+    active = [j for j in jobs.jobs() if j["state"] in ("queued", "running")]
+    lines.append("Задания: " + (", ".join(f"{j['label']} ({j['state']})" for j in active) or "нет"))
+    return "\n".join(lines)
+
+
+def trace_details(rec, medians):
+    """Разбор записи: этапы (с медианой прошлых прогонов), профиль, память."""
+    lines = [f"{CHECK_TITLES.get(rec['check'], rec['check'])} · {rec['ts'].replace('T', ' ')} · "
+             f"{rec['state']} · {rec['wall_ms']:.0f} мс"]
+    if rec.get("error"): lines.append(f"Ошибка: {rec['error']}")
+    lines += ["", f"{'Этап':<22}{'мс':>10}{'медиана':>10}{'строк':>10}{'файл':>11}{'сеть':>11}"]
+    med = medians.get(rec["check"], {})
+    for st in rec["stages"]:
+        m = med.get(st["stage"])
+        lines.append(f"{st['stage']:<22}{st['ms']:>10.0f}{'—' if m is None else f'{m:.0f}':>10}"
+                     f"{st.get('rows', '—')!s:>10}{format_bytes(st.get('bytes')):>11}"
+                     f"{format_bytes(st.get('net')):>11}")
+    prof = rec.get("profile")
+    if prof:
+        lines += ["", "cProfile, по суммарному времени" + (f" ({prof['file']})" if prof["file"] else "") + ":"]
+        lines += [f"  {ct:8.3f} с {nc:>9}  {func}" for func, nc, _, ct in prof["top"]]
+    mem = rec.get("memory")
+    if mem:
+        lines += ["", f"tracemalloc: пик {mem['peak_mb']} МБ, крупнейшие строки:"]
+        lines += [f"  {kb:>8} КБ {cnt:>8}  {where}" for where, kb, cnt in mem["top"]]
+    return "\n".join(lines)
+
+
+def open_diagnostics_window():
+    w = ctk.CTkToplevel(root)
+    w.title("Диагностика")
+    w.geometry("1000x680")
+    w.configure(fg_color=CLR_BG)
+    ctk.CTkLabel(w, text="🩺  Диагностика проверок",
+                 font=("Bahnschrift", 16, "bold"), text_color=CLR_TEXT).pack(padx=20, pady=(16, 4), anchor="w")
+    status = ctk.CTkLabel(w, text="", font=("Bahnschrift", 11), text_color=CLR_MUTED, justify="left")
+    status.pack(padx=20, anchor="w")
+
+    bar = ctk.CTkFrame(w, fg_color=CLR_BG)
+    bar.pack(fill="x", padx=20, pady=8)
+    ctk.CTkLabel(bar, text="Профилировать следующие проверки:", font=("Bahnschrift", 12),
+                 text_color=CLR_TEXT).pack(side="left")
+    switches = {}
+    def set_profile():
+        CheckTrace.profile = frozenset(m for m, var in switches.items() if var.get())
+    for mode in PROFILE_MODES:
+        switches[mode] = ctk.BooleanVar(value=mode in CheckTrace.profile)
+        ctk.CTkCheckBox(bar, text=PROFILE_TITLES[mode], variable=switches[mode], command=set_profile,
+                        font=("Bahnschrift", 12), text_color=CLR_TEXT).pack(side="left", padx=(12, 0))
+
+    columns = ("Время", "Проверка", "Итог", "мс", "Строк", "Реестр ЦБ")
+    table = ttk.Treeview(w, columns=columns, show="headings", height=8)
+    for col, width in zip(columns, (150, 110, 90, 90, 90, 220)):
+        table.heading(col, text=col); table.column(col, width=width, anchor="w")
+    table.pack(fill="x", padx=20)
+    details = ctk.CTkTextbox(w, wrap="none", font=("Consolas", 12), fg_color=CLR_SURFACE,
+                             text_color=CLR_TEXT, border_color=CLR_BORDER, border_width=1, corner_radius=10)
+    details.pack(expand=True, fill="both", padx=20, pady=8)
+
+    records, medians = [], {}
+
+    def load():
+        records[:] = read_check_traces(DIAG_PANEL_LAST)[::-1]
+        medians.clear(); medians.update(stage_medians(records))
+        table.delete(*table.get_children())
+        for i, r in enumerate(records):
+            table.insert("", "end", iid=str(i), values=(
+                r["ts"].replace("T", " "), CHECK_TITLES.get(r["check"], r["check"]), r["state"],
+                f"{r['wall_ms']:.0f}", r.get("rows", ""),
+                RegistryCache.SOURCE_TEXT.get(r.get("source"), "")))
+        if records: table.selection_set("0")
+        else: show()
+
+    def show(_event=None):
+        sel = table.selection()
+        details.configure(state="normal"); details.delete("0.0", "end")
+        details.insert("0.0", trace_details(records[int(sel[0])], medians) if sel else
+                       "Записей пока нет — выполните проверку.")
+        details.configure(state="disabled")
+
+    def save_jsonl():
+        path = filedialog.asksaveasfilename(
+            parent=w, defaultextension=".jsonl", filetypes=[("JSON Lines", "*.jsonl")],
+            initialfile=f"СФМ_диагностика_{datetime.now().strftime('%d.%m.%Y')}.jsonl")
+        if not path: return
+        with open(path, "w", encoding="utf-8") as f:
+            for r in read_check_traces(): f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+    def live():   # реестры и задания меняются сами по себе — перечитываем по таймеру
+        if not w.winfo_exists(): return
+        status.configure(text=diag_status_text())
+        w.after(DIAG_REFRESH_MS, live)
+
+    table.bind("<<TreeviewSelect>>", show)
+    for text, command in (("🔄  Обновить", load), ("💾  Сохранить JSONL", save_jsonl)):
+        ctk.CTkButton(bar, text=text, command=command, width=150, fg_color=CLR_ACCENT,
+                      hover_color=CLR_ACCENT2, corner_radius=8,
+                      font=("Bahnschrift", 12)).pack(side="right", padx=(8, 0))
+    load(); live()
+
 # ════════════════════════════════════════════════════════════════════════════
 #  ГЛАВНОЕ МЕНЮ
 # ════════════════════════════════════════════════════════════════════════════
 
 def main_menu():
-    root.geometry("560x560")
+    root.geometry("560x620")
     clear_frame()
     frame = ctk.CTkFrame(root, fg_color=CLR_BG)
     frame.pack(expand=True, fill="both")
@@ -642,6 +1273,8 @@ def main_menu():
                   command=open_banks_check_window, **btn_style).pack(pady=5)
     ctk.CTkButton(nav, text="📜   История изменений",
                   command=open_history_window, **btn_style).pack(pady=5)
+    ctk.CTkButton(nav, text="🩺   Диагностика",
+                  command=open_diagnostics_window, **btn_style).pack(pady=5)
     ctk.CTkButton(nav, text="🚀   Будущее СФМ",
                   command=lambda: messagebox.showinfo("Информация", "В стадии разработки"),
                   **btn_style).pack(pady=5)
@@ -671,11 +1304,11 @@ def open_banks_check_window():
                  font=("Bahnschrift", 15, "bold"), text_color=CLR_TEXT).pack(side="left", padx=20, pady=12)
 
     # Колонки: ОГРН (из локального файла) | Наименование (ЦБ) | Статус лицензии (ЦБ)
-    columns = ("ОГРН", "Наименование", "Статус лицензии")
-    tree = ttk.Treeview(frame, columns=columns, show="headings", height=20)
-    tree.heading("ОГРН",              text="ОГРН",              command=lambda: sort_column(tree, "ОГРН",              False))
-    tree.heading("Наименование",      text="Наименование",      command=lambda: sort_column(tree, "Наименование",      False))
-    tree.heading("Статус лицензии",   text="Статус лицензии",   command=lambda: sort_column(tree, "Статус лицензии",   False))
+    columns = BANKS_COLUMNS
+    tree = VirtualTreeview(frame, columns=columns, show="headings", height=20)
+    tree.heading("ОГРН",              text="ОГРН",              command=lambda: sort_column(tree, "ОГРН"))
+    tree.heading("Наименование",      text="Наименование",      command=lambda: sort_column(tree, "Наименование"))
+    tree.heading("Статус лицензии",   text="Статус лицензии",   command=lambda: sort_column(tree, "Статус лицензии"))
     tree.column("ОГРН",             anchor="w", width=180)
     tree.column("Наименование",     anchor="w", width=420)
     tree.column("Статус лицензии",  anchor="w", width=320)
@@ -692,7 +1325,7 @@ def open_banks_check_window():
                                 button_color=CLR_ACCENT, button_hover_color=CLR_ACCENT2)
     tree.configure(yscrollcommand=scroll_y.set)
 
-    all_rows   = []
+    all_rows   = ResultRows()
     adv_search = AdvancedSearch(frame, tree, all_rows)
     adv_search.pack(fill="x", padx=12, pady=4)
 
@@ -727,126 +1360,70 @@ def open_banks_check_window():
 #  🏛️  ЛОГИКА — check_banks
 # ════════════════════════════════════════════════════════════════════════════
 
-def _get_bank_tag(status: str) -> str:
-    """Определяем тег по тексту статуса лицензии."""
-    s = status.upper()
-    if "ДЕЙСТВУЕТ" in s or "ДЕЙСТВУЮЩ" in s:
-        return "active"
-    if "ОТОЗВАНА" in s or "ОТОЗВАН" in s:
-        return "revoked"
-    if "АННУЛИРОВАН" in s:
-        return "cancelled"
-    if "ЛИКВИДАЦ" in s or "ЛИКВИДИР" in s:
-        return "liquidated"
-    if "ЗАПРЕЩ" in s or "ОГРАНИЧЕН" in s or "ПРИНУДИТЕЛЬН" in s:
-        return "restricted"
-    return "notfound"
 
+def start_job(key, overlay, worker, label=None, replace=False):
+    """worker(cancel) — в пуле заданий; на overlay появляется «Отменить».
 
-def check_banks(tree, overlay, toast, all_rows, adv_search):
-    tree.delete(*tree.get_children())
-    all_rows.clear()
-    overlay.show("Подключение к ЦБ РФ...", "Скачивание реестра банков")
+    Пока задание с ключом key идёт, повторный запуск возвращает его же;
+    replace=True — сначала отменить его (пользователь выбрал другие файлы).
+    Ошибка проверки (CheckError) или сбой кода — окно с текстом; отмена — тихо,
+    в том числе сбой уже отменённого задания.
+    """
+    def done(job):
+        if job.state == "failed" and not job.cancel.cancelled:
+            e = job.error
+            ui_bus.fail(overlay, str(e) if isinstance(e, CheckError) else f"{type(e).__name__}: {e}")
+    if replace: jobs.cancel(key)
+    job = jobs.submit(key, worker, label=label, on_done=done)
+    overlay.set_cancel(lambda: jobs.cancel(key))
+    return job
 
-    def worker():
-        # ── 1. Скачиваем реестр ЦБ ─────────────────────────────────────────
-        url = get_banks_cbr_url()
-        overlay.set_progress(0.1, "Скачивание реестра...",
-                             f"Дата: {datetime.now().strftime('%d.%m.%Y')}")
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                              "AppleWebKit/537.36 (KHTML, like Gecko) "
-                              "Chrome/120.0.0.0 Safari/537.36",
-                "Referer": "https://www.cbr.ru/banking_sector/credit/FullCoList/",
-            }
-            resp = requests.get(url, headers=headers, timeout=40)
-            resp.raise_for_status()
-            cbr_path = os.path.join(os.getenv("TEMP"), "cbr_banks.xlsx")
-            with open(cbr_path, "wb") as f:
-                f.write(resp.content)
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror(
-                "Ошибка", f"Не удалось скачать реестр банков с ЦБ:\n{e}\n\nURL: {url}"))
-            return
 
-        # ── 2. Читаем реестр ЦБ ────────────────────────────────────────────
-        overlay.set_progress(0.3, "Чтение реестра ЦБ...", "")
-        try:
-            # Файл ЦБ содержит строки-заголовки вверху — читаем без header
-            # Столбец D (индекс 3) = ОГРН, E (4) = Наименование, H (7) = Статус лицензии
-            cbr_df = pd.read_excel(cbr_path, header=None, dtype=str)
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror("Ошибка", f"Ошибка чтения файла ЦБ:\n{e}"))
-            return
+def save_history(result, toast):
+    """Прогон — в журнал проверок (history.sqlite3) в фоне; сбой записи проверку не отменяет."""
+    def failed(e):
+        ui_bus.post(lambda msg=str(e): toast.show(f"История не сохранена: {msg}", icon="⚠️", duration=6000))
+    history_store.record_async(result, on_error=failed)
 
-        # Ищем строку-заголовок (где в столбце D есть "огрн" или "рег")
-        header_row = 0
-        for i, row in cbr_df.iterrows():
-            cell = str(row.iloc[3]).lower()
-            if "огрн" in cell or "рег" in cell:
-                header_row = i
-                break
-
-        # Данные начинаются со следующей строки после заголовка
-        data_df = cbr_df.iloc[header_row + 1:].reset_index(drop=True)
-
-        # Строим словарь ОГРН → (Наименование, Статус)
-        cbr_dict = {}
-        for _, row in data_df.iterrows():
-            ogrn   = clean_ogrn(row.iloc[3])   # D
-            name   = str(row.iloc[4]).strip()   # E
-            status = str(row.iloc[7]).strip()   # H
-            if ogrn and ogrn not in ("nan", "None", ""):
-                cbr_dict[ogrn] = (name, status)
-
-        # ── 3. Читаем локальный файл (лист "Банки", столбец A) ────────────
-        overlay.set_progress(0.6, "Чтение локального файла...",
-                             f"Лист 'Банки', столбец A")
-        try:
-            local_df = pd.read_excel(MFO_LOCAL_PATH, sheet_name="Банки",
-                                     header=None, dtype=str)
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror(
-                "Ошибка",
-                f"Не удалось открыть лист 'Банки' из файла:\n{MFO_LOCAL_PATH}\n\n{e}"))
-            return
 
-        # ── 4. Сверка ──────────────────────────────────────────────────────
-        overlay.set_progress(0.8, "Сверка данных...", f"Реестр ЦБ: {len(cbr_dict)} банков")
-        rows, tags = [], []
+def fill_table(tree, all_rows, adv_search, result, trace, delay=18):
+    """Строки результата → модель и таблица; время — этап «Таблица» в trace."""
+    t0 = time.perf_counter()
+    set_columns(tree, result.columns)
+    all_rows.clear()
+    for r, t in zip(result.rows, result.tags): all_rows.append({"values": r, "tag": t})
+    adv_search.update_statuses()
+    animate_rows(tree, all_rows, delay=delay)
+    trace.stage("Таблица", time.perf_counter() - t0, rows=len(all_rows))
+    trace.finish_async()
 
-        for _, row in local_df.iterrows():
-            ogrn_local = clean_ogrn(row.iloc[0])   # столбец A
-            if not ogrn_local or ogrn_local in ("nan", "None"):
-                continue
 
-            if ogrn_local in cbr_dict:
-                name, status = cbr_dict[ogrn_local]
-                tag = _get_bank_tag(status)
-                rows.append((ogrn_local, name, status))
-                tags.append(tag)
-            else:
-                rows.append((ogrn_local, "— не найден в реестре ЦБ —", "Не найден"))
-                tags.append("notfound")
+def check_banks(tree, overlay, toast, all_rows, adv_search):
+    tree.set_rows([])
+    all_rows.clear()
+    overlay.show("Подключение к ЦБ РФ...", "Скачивание реестра банков")
 
-        overlay.set_progress(1.0, "Готово!", "")
+    def worker(cancel):
+        with CheckTrace("banks", deferred=True) as trace:
+            result = trace.add_result(run_banks_check(progress=ui_bus.reporter(overlay), cancel=cancel))
+        save_history(result, toast)
+        rows, source, timings = result.rows, result.source, result.timings
+        ui_bus.progress(overlay, 1.0, "Готово!", format_timings(timings))
 
         def finish():
+            if cancel.cancelled:          # окно закрыли или проверку отменили
+                trace.finish_async(CheckCancelled()); return
             overlay.hide()
-            for r, t in zip(rows, tags):
-                all_rows.append({"values": r, "tag": t})
-            adv_search.update_statuses()
-            animate_rows(tree, rows, tags, delay=20)
+            fill_table(tree, all_rows, adv_search, result, trace, delay=20)
             root.after(400, lambda: auto_resize(tree))
-            toast.show(f"Проверено {len(rows)} банков", icon="🏛️")
+            if source == "stale":
+                toast.show(f"Проверено {len(rows)} банков — ЦБ недоступен, реестр из кэша", icon="⚠️", duration=6000)
+            else:
+                toast.show(f"Проверено {len(rows)} банков · {format_timings(timings)}", icon="🏛️")
 
-        root.after(400, finish)
+        ui_bus.post(finish, delay=400)
 
-    threading.Thread(target=worker, daemon=True).start()
+    start_job("banks", overlay, worker, "Банки")
 
 # ════════════════════════════════════════════════════════════════════════════
 #  ТЕРРОРИСТЫ
@@ -865,10 +1442,10 @@ def open_terrorists_menu():
     ctk.CTkLabel(hdr, text="🔥  Проверка по перечню террористов",
                  font=("Bahnschrift", 15, "bold"), text_color=CLR_TEXT).pack(side="left", padx=20, pady=12)
 
-    columns = ("ФИО", "Дата рождения", "Статус", "Последняя дата", "Изменение")
-    tree = ttk.Treeview(frame, columns=columns, show="headings", height=20)
+    columns = XML_COLUMNS     # «Сходство» добавит fill_table, если проверка нечёткая
+    tree = VirtualTreeview(frame, columns=columns, show="headings", height=20)
     for col in columns:
-        tree.heading(col, text=col, command=lambda c=col: sort_column(tree, c, False))
+        tree.heading(col, text=col, command=lambda c=col: sort_column(tree, c))
         tree.column(col, anchor="w", width=200)
     tree.tag_configure("red",   background="#f0d8d8", foreground="#a03030")
     tree.tag_configure("found", background=CLR_HIGHLIGHT, foreground=CLR_ACCENT)
@@ -876,7 +1453,7 @@ def open_terrorists_menu():
     scroll_y = ctk.CTkScrollbar(frame, orientation="vertical", command=tree.yview,
                                 button_color=CLR_ACCENT, button_hover_color=CLR_ACCENT2)
     tree.configure(yscrollcommand=scroll_y.set)
-    all_rows = []
+    all_rows = ResultRows()
 
     sf = ctk.CTkFrame(frame, fg_color=CLR_SURFACE2, corner_radius=10, height=42)
     sf.pack(fill="x", padx=12, pady=(8,4)); sf.pack_propagate(False)
@@ -884,6 +1461,10 @@ def open_terrorists_menu():
     label_not   = ctk.CTkLabel(sf, text="Нет в перечне: 0", font=("Bahnschrift", 12), text_color=CLR_SUCCESS)
     label_excl  = ctk.CTkLabel(sf, text="Исключён: 0",     font=("Bahnschrift", 12), text_color=CLR_MUTED)
     label_in.pack(side="left", padx=18); label_not.pack(side="left", padx=18); label_excl.pack(side="left", padx=18)
+    fuzzy_var = ctk.BooleanVar(value=False)
+    ctk.CTkCheckBox(sf, text=f"≈ Нечёткий поиск (до {FUZZY_MAX_DISTANCE} опечаток)", variable=fuzzy_var,
+                    font=("Bahnschrift", 12), text_color=CLR_TEXT, fg_color=CLR_ACCENT,
+                    hover_color=CLR_ACCENT2, border_color=CLR_BORDER).pack(side="right", padx=18)
 
     adv_search = AdvancedSearch(frame, tree, all_rows)
     adv_search.pack(fill="x", padx=12, pady=4)
@@ -899,7 +1480,8 @@ def open_terrorists_menu():
 
     ctk.CTkButton(bf, text="📂  Проверить изменения",
                   command=lambda: check_xml(tree, label_in, label_not, label_excl,
-                                            overlay, toast, all_rows, adv_search),
+                                            overlay, toast, all_rows, adv_search,
+                                            fuzzy=fuzzy_var.get()),
                   fg_color=CLR_ACCENT, hover_color=CLR_ACCENT2, border_width=0,
                   corner_radius=8, width=185, font=("Bahnschrift", 13)).pack(side="left", padx=5)
     ctk.CTkButton(bf, text="🔎  Сверка перечней",
@@ -935,10 +1517,10 @@ def open_mfo_check_window():
     ctk.CTkLabel(hdr, text="🏦  Проверка МФО по реестру ЦБ РФ",
                  font=("Bahnschrift", 15, "bold"), text_color=CLR_TEXT).pack(side="left", padx=20, pady=12)
 
-    columns = ("Наименование", "ИНН", "Статус")
-    tree = ttk.Treeview(frame, columns=columns, show="headings", height=20)
+    columns = MFO_COLUMNS
+    tree = VirtualTreeview(frame, columns=columns, show="headings", height=20)
     for col in columns:
-        tree.heading(col, text=col, command=lambda c=col: sort_column(tree, c, False))
+        tree.heading(col, text=col, command=lambda c=col: sort_column(tree, c))
         tree.column(col, anchor="w", width=280)
     tree.tag_configure("excluded", background="#f0d8d8", foreground="#a03030")
     tree.tag_configure("active",   background="#d0eedd", foreground="#2a7a48")
@@ -946,7 +1528,7 @@ def open_mfo_check_window():
     scroll_y = ctk.CTkScrollbar(frame, orientation="vertical", command=tree.yview,
                                 button_color=CLR_ACCENT, button_hover_color=CLR_ACCENT2)
     tree.configure(yscrollcommand=scroll_y.set)
-    all_rows = []
+    all_rows = ResultRows()
     adv_search = AdvancedSearch(frame, tree, all_rows)
     adv_search.pack(fill="x", padx=12, pady=4)
 
@@ -977,157 +1559,77 @@ def open_mfo_check_window():
 # ════════════════════════════════════════════════════════════════════════════
 
 def check_mfo(tree, overlay, toast, all_rows, adv_search):
-    tree.delete(*tree.get_children()); all_rows.clear()
+    tree.set_rows([]); all_rows.clear()
     overlay.show("Подключение к ЦБ РФ...", "Скачивание реестра МФО")
 
-    def worker():
-        def clean(v):
-            if pd.isna(v): return ""
-            return str(v).strip().replace(".0", "").replace(" ", "")
-
-        try:
-            overlay.set_progress(0.1, "Скачивание реестра...", "cbr.ru → list_MFO.xlsx")
-            r = requests.get(MFO_CBR_URL, timeout=30)
-            cbr_path = os.path.join(os.getenv("TEMP"), "list_MFO.xlsx")
-            with open(cbr_path, "wb") as f: f.write(r.content)
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror("Ошибка", str(e))); return
-
-        overlay.set_progress(0.3, "Чтение локального файла...", "")
-        try:
-            local_df = pd.read_excel(MFO_LOCAL_PATH, dtype=str)
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror("Ошибка", str(e))); return
-
-        overlay.set_progress(0.5, "Обработка реестра ЦБ...", "Действующие")
-        cbr_file = pd.ExcelFile(cbr_path)
-        active_dict = {}
-        for sheet in ["Действующие", "Действующие МФК", "Действующие МКК"]:
-            df = pd.read_excel(cbr_file, sheet_name=sheet, dtype=str)
-            for row in df.values:
-                inn = clean(row[5])
-                if inn: active_dict[inn] = str(row[7]).strip()
-
-        overlay.set_progress(0.7, "Обработка реестра ЦБ...", "Исключённые")
-        excl_df   = pd.read_excel(cbr_file, sheet_name="Исключенные", dtype=str)
-        excl_dict = {}
-        for row in excl_df.values:
-            inn = clean(row[6])
-            if inn: excl_dict[inn] = str(row[8]).strip()
-
-        overlay.set_progress(0.85, "Сверка...", "")
-        rows, tags = [], []
-        for _, row in local_df.iterrows():
-            inn = clean(row.iloc[0])
-            if inn in excl_dict:
-                rows.append((excl_dict[inn], inn, "Исключён")); tags.append("excluded")
-            elif inn in active_dict:
-                rows.append((active_dict[inn], inn, "Действующий")); tags.append("active")
-            else:
-                rows.append(("", inn, "Не найден")); tags.append("")
-
-        overlay.set_progress(1.0, "Готово!", "")
+    def worker(cancel):
+        with CheckTrace("mfo", deferred=True) as trace:
+            result = trace.add_result(run_mfo_check(progress=ui_bus.reporter(overlay), cancel=cancel))
+        save_history(result, toast)
+        rows, source, timings = result.rows, result.source, result.timings
+        ui_bus.progress(overlay, 1.0, "Готово!", format_timings(timings))
 
         def finish():
+            if cancel.cancelled:
+                trace.finish_async(CheckCancelled()); return
             overlay.hide()
-            for r, t in zip(rows, tags): all_rows.append({"values": r, "tag": t})
-            adv_search.update_statuses()
-            animate_rows(tree, rows, tags)
+            fill_table(tree, all_rows, adv_search, result, trace)
             root.after(300, lambda: auto_resize(tree))
-            toast.show(f"Проверено {len(rows)} МФО", icon="🏦")
+            if source == "stale":
+                toast.show(f"Проверено {len(rows)} МФО — ЦБ недоступен, реестр из кэша", icon="⚠️", duration=6000)
+            else:
+                toast.show(f"Проверено {len(rows)} МФО · {format_timings(timings)}", icon="🏦")
 
-        root.after(400, finish)
+        ui_bus.post(finish, delay=400)
 
-    threading.Thread(target=worker, daemon=True).start()
+    start_job("mfo", overlay, worker, "МФО")
 
 # ════════════════════════════════════════════════════════════════════════════
 #  ЛОГИКА — check_xml / compare_lists / check_loans
 # ════════════════════════════════════════════════════════════════════════════
 
-def check_xml(tree, label_in, label_not, label_excl, overlay, toast, all_rows, adv_search):
+# Проверка перечня, сравнение списков и проверка кредитов делят таблицу и
+# overlay окна «Террористы» — у них один ключ задания: новый запуск отменяет прежний
+TERRORISTS_JOB = "terrorists"
+
+# Подпись этапа чтения перечня в окне
+PONAMAREV_QUOTE = "Бывало, что хотел вклад сделать, а потом появлялись нужды,\nприходилось закрывать. \nБывало, пытался разобраться, и экспериментировал, бывало ошибался. \nБывало полнил не стой карты, проблемы начались, \nнужно было отменять...\nСистема то у вас не очень простая.... Посмотрите мою историю, у меня были у вас вклады, которые весь срок находились у вас....\nПросто сейчас время такое непредсказуемое, вроде хочешь\nсделать хоть небольшой вклад, но что то идет не так.\n— Понамарев Юрий"
+
+def check_xml(tree, label_in, label_not, label_excl, overlay, toast, all_rows, adv_search, fuzzy=False):
     xml_path = filedialog.askopenfilename(title="Загрузите XML файл", filetypes=[("XML files", "*.xml")])
     if not xml_path: return
+    tree.set_rows([]); all_rows.clear()
     overlay.show("Обработка XML...", os.path.basename(xml_path))
 
-    def worker():
-        try:
-            fn = os.path.basename(xml_path).replace(".xml", "")
-            d, m, y = fn.split(".")
-            xml_date = datetime(int(y), int(m), int(d)).date()
-        except:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror("Ошибка", "Имя файла: DD.MM.YYYY.xml")); return
-
-        overlay.set_progress(0.2, "Чтение Excel...", "")
-        try:
-            raw = pd.read_excel(BASE_EXCEL_PATH)
-            df  = raw.iloc[:, [2, 3]].dropna(subset=[raw.columns[2]])
-            df.columns = ["ФИО", "ДатаРождения"]
-        except Exception as e:
-            root.after(0, overlay.hide)
-            root.after(0, lambda: messagebox.showerror("Ошибка", str(e))); return
-
-        overlay.set_progress(0.4, "Маленькая отсылка...", "Бывало, что хотел вклад сделать, а потом появлялись нужды,\nприходилось закрывать. \nБывало, пытался разобраться, и экспериментировал, бывало ошибался. \nБывало полнил не стой карты, проблемы начались, \nнужно было отменять...\nСистема то у вас не очень простая.... Посмотрите мою историю, у меня были у вас вклады, которые весь срок находились у вас....\nПросто сейчас время такое непредсказуемое, вроде хочешь\nсделать хоть небольшой вклад, но что то идет не так.\n— Понамарев Юрий")
-        tree_xml = ET.parse(xml_path).getroot()
-        excluded, actual = set(), {}
-        eb = tree_xml.find("ПоследниеИсключенные")
-        if eb:
-            for p in eb.iter("ФИО"):
-                if p.text: excluded.add(normalize(p.text))
-        ab = tree_xml.find("АктуальныйПеречень")
-        if ab:
-            for subj in ab.findall("Субъект"):
-                fl = subj.find("ФЛ")
-                if fl is None: continue
-                fio = fl.findtext("ФИО")
-                if not fio: continue
-                dob_xml = format_date(fl.findtext("ДатаРождения") or "")
-                hist = subj.find("История"); dates = []
-                if hist:
-                    for d in hist.findall("ДатаВключения") + hist.findall("ДатаИзменения"):
-                        if d.text:
-                            p = parse_xml_date(d.text)
-                            if p: dates.append(p)
-                if dates:
-                    key = (normalize(fio), dob_xml)
-                    if key not in actual or actual[key] < max(dates):
-                        actual[key] = max(dates)
-
-        overlay.set_progress(0.7, "Сравнение...", f"{len(df)} записей")
-        rows, tags = [], []
-        cnt = {"В перечне": 0, "Нет в перечне": 0, "Исключен": 0}
-        for _, row in df.iterrows():
-            fio = row["ФИО"]; birth = format_date(row["ДатаРождения"]); norm = normalize(fio)
-            if norm in excluded:
-                rows.append((fio, birth, "Исключен", xml_date.strftime("%Y-%m-%d"), "ДА"))
-                tags.append("red"); cnt["Исключен"] += 1
-            else:
-                key = (norm, birth)
-                if key in actual:
-                    ld = actual[key]; ct = ld == xml_date
-                    rows.append((fio, birth, "В перечне", ld.strftime("%Y-%m-%d"), "ДА" if ct else "НЕТ"))
-                    tags.append("red" if ct else ""); cnt["В перечне"] += 1
-                else:
-                    rows.append((fio, birth, "Нет в перечне", "", "")); tags.append(""); cnt["Нет в перечне"] += 1
+    def progress(value, status, sub=""):
+        if status == "Чтение перечня...":
+            status, sub = "Маленькая отсылка...", PONAMAREV_QUOTE
+        ui_bus.progress(overlay, value, status, sub)
 
-        overlay.set_progress(1.0, "Готово!", "")
+    def worker(cancel):
+        with CheckTrace("xml", deferred=True) as trace:
+            result = trace.add_result(run_xml_check(xml_path, fuzzy=fuzzy, progress=progress, cancel=cancel))
+        save_history(result, toast)
+        rows, cnt, cached, rescreened = result.rows, result.counts, result.cached, result.rescreened
+        ui_bus.progress(overlay, 1.0, "Готово!", "")
 
         def finish():
-            tree.delete(*tree.get_children()); all_rows.clear(); overlay.hide()
-            for r, t in zip(rows, tags): all_rows.append({"values": r, "tag": t})
-            adv_search.update_statuses()
-            animate_rows(tree, rows, tags, delay=12)
+            if cancel.cancelled:
+                trace.finish_async(CheckCancelled()); return
+            overlay.hide()
+            fill_table(tree, all_rows, adv_search, result, trace, delay=12)
             root.after(200, lambda: auto_resize(tree))
-            label_in.configure(text=f"В перечне: {cnt['В перечне']}")
+            label_in.configure(text=f"В перечне: {cnt['В перечне']}" +
+                               (f"  ≈ {cnt['Похожее совпадение']}" if fuzzy else ""))
             label_not.configure(text=f"Нет в перечне: {cnt['Нет в перечне']}")
             label_excl.configure(text=f"Исключен: {cnt['Исключен']}")
-            toast.show(f"Проверено {len(rows)} записей", icon="📂")
+            toast.show(f"Проверено {len(rows)} записей" + (" (перечень из кэша)" if cached else "") +
+                       (f" · по изменениям перечня: {rescreened}" if rescreened is not None else ""),
+                       icon="📂")
 
-        root.after(400, finish)
+        ui_bus.post(finish, delay=400)
 
-    threading.Thread(target=worker, daemon=True).start()
+    start_job(TERRORISTS_JOB, overlay, worker, f"Перечень {os.path.basename(xml_path)}", replace=True)
 
 
 def compare_lists(tree, overlay, toast, all_rows, adv_search):
@@ -1137,92 +1639,133 @@ def compare_lists(tree, overlay, toast, all_rows, adv_search):
     messagebox.showinfo("Внимание", "Загрузите старый список проверки")
     old_path = filedialog.askopenfilename(title="Старый список", filetypes=[("Excel", "*.xlsx")])
     if not old_path: return
+    tree.set_rows([]); all_rows.clear()
     overlay.show("Сравнение перечней...", "")
 
-    def worker():
-        overlay.set_progress(0.3, "Чтение файлов...", "")
-        new_df   = pd.read_excel(new_path).iloc[:, [1, 2]].dropna(subset=[pd.read_excel(new_path).columns[1]])
-        old_df   = pd.read_excel(old_path).iloc[:, [1, 2]].dropna(subset=[pd.read_excel(old_path).columns[1]])
-        new_dict = {normalize(r[0]): r[1] for r in new_df.values}
-        old_dict = {normalize(r[0]): r[1] for r in old_df.values}
-        overlay.set_progress(0.7, "Поиск изменений...", "")
-        rows, tags = [], []
-        for n, dr in new_dict.items():
-            if n not in old_dict: rows.append((n, dr, "Добавлен", "", "ДА")); tags.append("red")
-        for n, dr in old_dict.items():
-            if n not in new_dict: rows.append((n, dr, "Удален", "", "ДА")); tags.append("red")
-        overlay.set_progress(1.0, "Готово!", "")
+    def worker(cancel):
+        with CheckTrace("compare", deferred=True) as trace:
+            result = trace.add_result(run_compare_lists(new_path, old_path, progress=ui_bus.reporter(overlay),
+                                                        cancel=cancel))
+        rows, cnt = result.rows, result.counts
+        ui_bus.progress(overlay, 1.0, "Готово!", format_timings(result.timings))
 
         def finish():
-            tree.delete(*tree.get_children()); all_rows.clear(); overlay.hide()
-            for r, t in zip(rows, tags): all_rows.append({"values": r, "tag": t})
-            adv_search.update_statuses()
-            animate_rows(tree, rows, tags)
+            if cancel.cancelled:
+                trace.finish_async(CheckCancelled()); return
+            overlay.hide()
+            fill_table(tree, all_rows, adv_search, result, trace)
             root.after(200, lambda: auto_resize(tree))
-            toast.show(f"Изменений: {len(rows)}", icon="📊")
+            toast.show(f"Изменений: {len(rows)} · добавлено {cnt['Добавлен']}, удалено {cnt['Удален']}, "
+                       f"изменено {cnt['Изменен']}", icon="📊")
             ans = messagebox.askyesno("Проверка кредитов", "Проверить наличие выданных кредитов?")
-            if ans: check_loans(new_path)
+            if ans: check_loans(new_path, overlay)
 
-        root.after(400, finish)
+        ui_bus.post(finish, delay=400)
 
-    threading.Thread(target=worker, daemon=True).start()
+    start_job(TERRORISTS_JOB, overlay, worker, "Сравнение списков", replace=True)
 
 
-def check_loans(new_path):
+def check_loans(new_path, overlay):
     messagebox.showinfo("Загрузка", "Загрузите файл 'Отчет по финансовым сделкам'")
     report_path = filedialog.askopenfilename(title="Отчет по финансовым сделкам", filetypes=[("Excel", "*.xlsx")])
     if not report_path: return
-    try:
-        new_df = pd.read_excel(new_path, dtype=str).iloc[1:, [0, 1, 2]]
-        new_dict = {}
-        for _, row in new_df.iterrows():
-            id_mpl = str(row.iloc[0]).strip()
-            if id_mpl: new_dict[id_mpl] = (str(row.iloc[1]).strip(), row.iloc[2])
-        report_df = pd.read_excel(report_path).iloc[2:, :]
-        results = []
-        for _, row in report_df.iterrows():
-            id_mpl = str(row.iloc[0]).strip(); raw = row.iloc[7]
-            if id_mpl and pd.notna(raw) and id_mpl in new_dict:
-                fio, birth = new_dict[id_mpl]
-                results.append((id_mpl, fio, format_date_ru(birth), format_date_ru(raw)))
-        if not results:
-            messagebox.showinfo("Результат", "Совпадений не найдено"); return
-
-        w = ctk.CTkToplevel(root)
-        w.title("Выданные кредиты"); w.geometry("1050x620"); w.configure(fg_color=CLR_BG)
-        w.lift(); w.attributes("-topmost", True); w.after(100, lambda: w.attributes("-topmost", False))
-
-        hdr = ctk.CTkFrame(w, fg_color=CLR_SURFACE, corner_radius=0, height=52)
-        hdr.pack(fill="x"); hdr.pack_propagate(False)
-        ctk.CTkLabel(hdr, text="💳  Выданные кредиты — совпадения",
-                     font=("Bahnschrift", 15, "bold"), text_color=CLR_TEXT).pack(side="left", padx=20, pady=12)
-
-        columns = ("ID MPL", "ФИО", "Дата рождения", "Дата сделки")
-        tree2 = ttk.Treeview(w, columns=columns, show="headings")
-        for col in columns: tree2.heading(col, text=col); tree2.column(col, anchor="w", width=220)
-        scroll_y = ctk.CTkScrollbar(w, orientation="vertical", command=tree2.yview,
-                                    button_color=CLR_ACCENT, button_hover_color=CLR_ACCENT2)
-        tree2.configure(yscrollcommand=scroll_y.set)
-        toast2 = ToastNotification(w); attach_context_menu(tree2, toast2)
-        bf2 = ctk.CTkFrame(w, fg_color=CLR_BG); bf2.pack(pady=8)
-        ctk.CTkButton(bf2, text="📤  Экспорт Excel", width=180,
-                      command=lambda: export_to_excel(tree2, "Кредиты", toast2),
-                      fg_color=CLR_ACCENT, hover_color=CLR_ACCENT2,
-                      corner_radius=8, font=("Bahnschrift", 13)).pack()
-        animate_rows(tree2, results, [""] * len(results), delay=25)
-        tree2.pack(side="left", fill="both", expand=True, padx=(12, 0), pady=8)
-        scroll_y.pack(side="right", fill="y", pady=8, padx=(0, 4))
-    except Exception as e:
-        messagebox.showerror("Ошибка", str(e))
+    overlay.show("Проверка кредитов...", os.path.basename(report_path))
+
+    # Отчёт большой — сверка в фоне, окно результатов строится, когда она закончена
+    def worker(cancel):
+        with CheckTrace("loans", deferred=True) as trace:
+            result = trace.add_result(run_loans_check(new_path, report_path, progress=ui_bus.reporter(overlay),
+                                                      cancel=cancel))
+        ui_bus.progress(overlay, 1.0, "Готово!", format_timings(result.timings))
+
+        def finish():
+            if cancel.cancelled:
+                trace.finish_async(CheckCancelled()); return
+            overlay.hide()
+            if not result.rows:
+                trace.finish_async()
+                messagebox.showinfo("Результат", "Совпадений не найдено"); return
+            t0 = time.perf_counter()
+            show_loans(result)
+            trace.stage("Окно результатов", time.perf_counter() - t0, rows=len(result.rows))
+            trace.finish_async()
+
+        ui_bus.post(finish, delay=300)
+
+    start_job(TERRORISTS_JOB, overlay, worker, "Проверка кредитов", replace=True)
+
+
+def show_loans(result):
+    w = ctk.CTkToplevel(root)
+    w.title("Выданные кредиты"); w.geometry("1050x620"); w.configure(fg_color=CLR_BG)
+    w.lift(); w.attributes("-topmost", True); w.after(100, lambda: w.attributes("-topmost", False))
+
+    hdr = ctk.CTkFrame(w, fg_color=CLR_SURFACE, corner_radius=0, height=52)
+    hdr.pack(fill="x"); hdr.pack_propagate(False)
+    ctk.CTkLabel(hdr, text="💳  Выданные кредиты — совпадения",
+                 font=("Bahnschrift", 15, "bold"), text_color=CLR_TEXT).pack(side="left", padx=20, pady=12)
+
+    columns = result.columns
+    tree2 = VirtualTreeview(w, columns=columns, show="headings")
+    for col in columns: tree2.heading(col, text=col); tree2.column(col, anchor="w", width=220)
+    scroll_y = ctk.CTkScrollbar(w, orientation="vertical", command=tree2.yview,
+                                button_color=CLR_ACCENT, button_hover_color=CLR_ACCENT2)
+    tree2.configure(yscrollcommand=scroll_y.set)
+    toast2 = ToastNotification(w); attach_context_menu(tree2, toast2)
+    bf2 = ctk.CTkFrame(w, fg_color=CLR_BG); bf2.pack(pady=8)
+    ctk.CTkButton(bf2, text="📤  Экспорт Excel", width=180,
+                  command=lambda: export_to_excel(tree2, "Кредиты", toast2),
+                  fg_color=CLR_ACCENT, hover_color=CLR_ACCENT2,
+                  corner_radius=8, font=("Bahnschrift", 13)).pack()
+    animate_rows(tree2, ResultRows({"values": r, "tag": t} for r, t in zip(result.rows, result.tags)), delay=25)
+    tree2.pack(side="left", fill="both", expand=True, padx=(12, 0), pady=8)
+    scroll_y.pack(side="right", fill="y", pady=8, padx=(0, 4))
+    toast2.show(f"Совпадений: {len(result.rows)} · {format_timings(result.timings)}", icon="💳")
+
+
+COLUMN_MIN_WIDTH = 80
+COLUMN_MAX_WIDTH = 560
+COLUMN_PADDING   = 28      # отступы ячейки + место под ▲/▼ в заголовке
+
+_fonts = {}
+
+def text_width(text, font=TREE_FONT):
+    """Ширина строки в пикселях (Font.measure), с кэшем по шрифту и тексту."""
+    key = (font, text)
+    w = _fonts.get(key)
+    if w is None:
+        f = _fonts.get(font)
+        if f is None: f = _fonts[font] = tkfont.Font(root=root, font=font)
+        w = _fonts[key] = f.measure(text)
+    return w
 
 
 def auto_resize(tv):
-    for col in tv["columns"]:
-        mw = max([len(str(tv.set(k, col))) for k in tv.get_children()] + [len(col)])
-        tv.column(col, width=mw * 14)
+    """Ширины столбцов по самым длинным значениям модели — без обхода таблицы."""
+    model = tv.model if tv.model is not None else tv.rows
+    if not isinstance(model, ResultRows): model = ResultRows(model)
+    for ci, col in enumerate(tv["columns"]):
+        w = max([text_width(s) for s in model.longest(ci)] + [text_width(col, HEADING_FONT)])
+        tv.column(col, width=max(COLUMN_MIN_WIDTH, min(w + COLUMN_PADDING, COLUMN_MAX_WIDTH)))
 
 # ════════════════════════════════════════════════════════════════════════════
 #  ЗАПУСК
 # ════════════════════════════════════════════════════════════════════════════
 main_menu()
+startup.mark("главное меню")
+
+
+def _on_first_frame():
+    root.update_idletasks()
+    startup.mark("первый кадр")
+    startup.record()
+    if os.getenv("SFM_STARTUP_REPORT") and sys.stderr:
+        print(startup.report(), file=sys.stderr)
+    if PRELOAD_ON_START:
+        preload_modules(on_done=lambda t: append_metric("startup", {
+            "event": "preload", "modules_ms": {k: round(v * 1000, 1) for k, v in t.items()}}))
+    # Реестры ЦБ — в фоне, чтобы «Проверить» сверял с уже разобранными индексами
+    registry_refresher.start()
+
+root.after_idle(_on_first_frame)
 root.mainloop()
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""Дельта-сверка с перечнем: run_xml_check по сохранённому состоянию против полной сверки.
+
+Файл клиентов, перечни и все кэши — в tmp_path.
+"""
+import os
+
+import pytest
+from openpyxl import Workbook
+
+import sfm_core
+from conftest import CLIENTS, write_perechen
+from sfm_core import parse_perechen_xml, reconcile_xml, xml_date_from_path
+
+# Следующие перечни: Смирнов больше не исключён, Кузнецов исключён, Сидоров включён,
+# у Иванова новая дата изменения; затем Сидорова исключают, Петров уходит
+NEXT = [
+    ("19.10.2026.xml", ["Кузнецов Кузьма"], [
+        ("Иванов Иван Иванович", "1980-01-02", [("ДатаВключения", "2020-03-04"),
+                                                ("ДатаИзменения", "2026-10-19")]),
+        ("Петров Пётр", "1975-05-06", [("ДатаВключения", "2019-01-01"), ("ДатаИзменения", "2026-10-18")]),
+        ("Сидоров Сидор", "1990-07-08", [("ДатаВключения", "2026-10-19")]),
+    ]),
+    ("20.10.2026.xml", ["Сидоров Сидор"], [
+        ("Иванов Иван Иванович", "1980-01-02", [("ДатаВключения", "2020-03-04"),
+                                                ("ДатаИзменения", "2026-10-19")]),
+        ("Кузнецов Кузьма", "1966-06-06", [("ДатаВключения", "2026-10-20")]),
+    ]),
+]
+
+
+@pytest.fixture
+def caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(sfm_core, "snapshot_cache", sfm_core.SnapshotCache(str(tmp_path / "snapshots")))
+    monkeypatch.setattr(sfm_core, "perechen_cache", sfm_core.PerechenCache(str(tmp_path / "perechen")))
+    state = sfm_core.ScreeningStateStore(str(tmp_path / "screening"))
+    monkeypatch.setattr(sfm_core, "screening_state", state)
+    return state
+
+
+@pytest.fixture
+def clients_xlsx(tmp_path):
+    """ФИО и ДР — в столбцах C и D, как в файле клиентов."""
+    wb = Workbook(); ws = wb.active
+    ws.append(["№", "Филиал", "ФИО", "ДатаРождения"])
+    for i, (fio, dob) in enumerate(zip(CLIENTS["ФИО"], CLIENTS["ДатаРождения"]), 1):
+        ws.append([i, "Москва", fio, dob])
+    path = tmp_path / "clients.xlsx"
+    wb.save(path)
+    return str(path)
+
+
+def full_result(xml_path):
+    excluded, actual = parse_perechen_xml(xml_path)
+    return reconcile_xml(CLIENTS["ФИО"], CLIENTS["ДатаРождения"], excluded, actual,
+                         xml_date_from_path(xml_path))
+
+
+def test_delta_runs_equal_full_runs(caches, clients_xlsx, perechen, tmp_path):
+    first = sfm_core.run_xml_check(perechen, base_path=clients_xlsx)
+    assert first.rescreened is None and "Состояние: запись" in first.timings
+    assert (first.rows, first.tags, first.counts) == full_result(perechen)
+
+    for name, excluded, actual in NEXT:
+        xml_path = write_perechen(tmp_path / name, excluded, actual)
+        result = sfm_core.run_xml_check(xml_path, base_path=clients_xlsx)
+        assert "Клиенты" not in result.timings and "Состояние: чтение" in result.timings
+        assert (result.rows, result.tags, result.counts) == full_result(xml_path)
+        # Попов без ДР и Иванов 1981 г. р. не в перечне и его не задевают
+        assert 0 < result.rescreened < len(CLIENTS)
+        assert result.stats["Состояние: запись"]["rows"] < len(CLIENTS)
+
+
+def test_delta_without_changes_skips_save(caches, clients_xlsx, perechen, tmp_path):
+    sfm_core.run_xml_check(perechen, base_path=clients_xlsx)
+    entry = caches._entry_path(clients_xlsx)
+    before = os.stat(entry).st_mtime_ns
+    # в перечне за ту же дату добавились люди, но клиентов это не задевает
+    (tmp_path / "more").mkdir()
+    same = write_perechen(tmp_path / "more" / "18.10.2026.xml", ["Смирнов Семен", "Новиков Николай"], [
+        ("Иванов Иван Иванович", "1980-01-02", [("ДатаВключения", "2020-03-04")]),
+        ("Петров Пётр", "1975-05-06", [("ДатаВключения", "2019-01-01"), ("ДатаИзменения", "2026-10-18")]),
+        ("Кузнецов Кузьма", "1966-06-07", [("ДатаВключения", "2021-01-01")]),
+        ("Орлов Олег", "1950-01-01", [("ДатаВключения", "2026-10-18")]),
+    ])
+    result = sfm_core.run_xml_check(same, base_path=clients_xlsx)
+    assert "Состояние: запись" not in result.timings
+    assert os.stat(entry).st_mtime_ns == before
+    assert (result.rows, result.tags, result.counts) == full_result(same)
+
+
+def test_changed_clients_file_runs_full_check(caches, clients_xlsx, perechen):
+    sfm_core.run_xml_check(perechen, base_path=clients_xlsx)
+    st = os.stat(clients_xlsx)
+    os.utime(clients_xlsx, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    result = sfm_core.run_xml_check(perechen, base_path=clients_xlsx)
+    assert result.rescreened is None and "Клиенты" in result.timings
@@ -0,0 +1,82 @@
+"""read_excel_columns / read_excel_sheets против pd.read_excel — книги собираются в tmp_path."""
+from datetime import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+from sfm_core import read_excel_columns, read_excel_sheets
+
+
+@pytest.fixture
+def clients_xlsx(tmp_path):
+    """Лист как у файла клиентов: заголовок, смесь типов, пустые ячейки и хвост
+    из пустых, но оформленных строк; в столбце E данные ниже, чем в B–D."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["№", "ID", "ФИО", "Дата рождения", "Примечание"])
+    ws.append([1, "007", "Иванов Иван", datetime(1980, 1, 2), None])
+    ws.append([2, 1234, "Петров Пётр", "06.05.1975", "x"])
+    ws.append([3, None, None, None, None])
+    ws.append([4, 12.5, "Сидоров", None, "#N/A"])
+    for i in range(6, 9):
+        ws.append([None, None, None, None, f"прим. {i}"])
+    fill = PatternFill("solid", fgColor="FFFF00")
+    for r in range(9, 15):
+        for c in range(1, 6): ws.cell(r, c).fill = fill
+    path = tmp_path / "clients.xlsx"
+    wb.save(path)
+    return str(path)
+
+
+def _trimmed(df):
+    filled = df.notna().any(axis=1)
+    return df.loc[:filled[filled].index[-1]] if filled.any() else df.iloc[:0]
+
+
+@pytest.mark.parametrize("usecols", [[2, 3], [3, 1], [0, 1, 2]])
+@pytest.mark.parametrize("dtype", [None, str])
+def test_read_excel_columns_matches_pandas(clients_xlsx, usecols, dtype):
+    got = read_excel_columns(clients_xlsx, usecols, dtype=dtype)
+    expected = _trimmed(pd.read_excel(clients_xlsx, dtype=dtype).iloc[:, usecols])
+    # текст pandas 3 читает в StringDtype, а не object — сравниваем значения и «число или нет»
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_dtype=False)
+    assert ([pd.api.types.is_numeric_dtype(t) for t in got.dtypes] ==
+            [pd.api.types.is_numeric_dtype(t) for t in expected.dtypes])
+
+
+def test_read_excel_columns_trims_blank_tail(clients_xlsx):
+    # строки 6–8 заполнены только в E, 9–14 — только оформлены
+    assert len(read_excel_columns(clients_xlsx, [2, 3])) == 4
+    assert len(read_excel_columns(clients_xlsx, [4])) == 7
+
+
+def test_read_excel_columns_without_header(clients_xlsx):
+    got = read_excel_columns(clients_xlsx, [2], header=None, names=["ФИО"])
+    assert got["ФИО"].iloc[0] == "ФИО"
+    assert got["ФИО"].iloc[1] == "Иванов Иван"
+    assert len(got) == 5
+
+
+@pytest.fixture
+def duplicate_headers_xlsx(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["ФИО", "Дата", "ФИО", None, "ФИО.1", "Дата"])
+    ws.append(["А", "2000-01-01", "Б", 1, "В", "2001-01-01"])
+    path = tmp_path / "dups.xlsx"
+    wb.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("usecols", [[0, 1, 2, 3, 4, 5], [5, 2], [2]])
+def test_read_excel_columns_numbers_repeated_headers_like_pandas(duplicate_headers_xlsx, usecols):
+    got = read_excel_columns(duplicate_headers_xlsx, usecols)
+    assert list(got.columns) == list(pd.read_excel(duplicate_headers_xlsx).columns[usecols])
+
+
+def test_read_excel_sheets_missing_sheet_raises(clients_xlsx):
+    with pytest.raises(KeyError):
+        read_excel_sheets(clients_xlsx, {"Нет такого": [0]})
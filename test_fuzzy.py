@@ -0,0 +1,39 @@
+"""Нечёткий поиск: ключи ФИО и полоса Укконена в _levenshtein (без rapidfuzz)."""
+import pytest
+
+import sfm_core
+
+
+def full_levenshtein(a, b):
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+PAIRS = [("", ""), ("", "АБВ"), ("ИВАНОВ", "ИВАНОВ"), ("ИВАНОВ", "ИВАНОФ"), ("ИВАНОВ", "ИВНОВ"),
+         ("ПЕТРОВ ПЕТР", "ПЕТР ПЕТРОВ"), ("СЕМЕН", "СЕМЁН"), ("КОЗЛОВ", "КОЗЛОВСКИЙ"),
+         ("АБВГД", "ДГВБА"), ("ЩУКИН", "ШУКИН ИВАН")]
+
+
+@pytest.mark.parametrize("limit", [0, 1, 2, 3])
+@pytest.mark.parametrize("a,b", PAIRS)
+def test_levenshtein_band(monkeypatch, a, b, limit):
+    monkeypatch.setattr(sfm_core, "HAS_RAPIDFUZZ", False)   # проверяем свою полосу, не rapidfuzz
+    expected = min(full_levenshtein(a, b), limit + 1)
+    assert sfm_core._levenshtein(a, b, limit) == expected
+    assert sfm_core._levenshtein(b, a, limit) == expected
+
+
+@pytest.mark.parametrize("name,keys", [
+    ("Иванов Иван", ("ИВАНОВ ИВАН", "ИВАН ИВАНОВ")),
+    ("Ivanov  Ivan", ("ИВАНОВ ИВАН", "ИВАН ИВАНОВ")),            # транслит и пробелы
+    ("Иван Иванов", ("ИВАН ИВАНОВ", "ИВАН ИВАНОВ")),             # перестановка слов
+    ("Щукин Илья-Йосиф", ("ЩУКИН ИЛЯ ИОСИФ", "ИЛЯ ИОСИФ ЩУКИН")),  # Ь, Й, дефис
+    ("Shchukin Ilya", ("ЩУКИН ИЛЯ", "ИЛЯ ЩУКИН")),
+])
+def test_fuzzy_keys(name, keys):
+    assert sfm_core.fuzzy_keys(name) == keys
@@ -0,0 +1,69 @@
+"""JobScheduler: дедупликация по ключу, отмена и ошибки заданий."""
+import threading
+import time
+
+from sfm_core import CheckError, JobScheduler
+
+TIMEOUT = 5
+
+
+def wait_until(cond):
+    deadline = time.monotonic() + TIMEOUT
+    while not cond() and time.monotonic() < deadline: time.sleep(0.01)
+    return cond()
+
+
+def test_job_scheduler_dedupes_active_key():
+    jobs, release, calls = JobScheduler(), threading.Event(), []
+
+    def work(cancel):
+        calls.append(1); release.wait(TIMEOUT); return "ok"
+
+    done = threading.Event()
+    first = jobs.submit("banks", work, on_done=lambda j: done.set())
+    assert jobs.submit("banks", work) is first
+    assert jobs.get("banks") is first
+    release.set()
+    assert done.wait(TIMEOUT)
+    assert (first.state, first.result, calls) == ("done", "ok", [1])
+    assert jobs.get("banks") is None
+
+
+def test_job_scheduler_cancel_allows_resubmit():
+    jobs, started, ended = JobScheduler(), threading.Event(), threading.Event()
+
+    def work(cancel):
+        started.set()
+        while not cancel.wait(0.01): pass
+        cancel.check()
+
+    first = jobs.submit("xml", work, on_done=lambda j: ended.set())
+    assert started.wait(TIMEOUT)
+    assert jobs.cancel("xml") == 1
+    # отменённое, но ещё не завершившееся задание не мешает новому с тем же ключом
+    second = jobs.submit("xml", lambda cancel: 42)
+    assert second is not first
+    assert ended.wait(TIMEOUT)
+    assert first.state == "cancelled"
+    assert wait_until(lambda: not second.active)
+    assert (second.state, second.result) == ("done", 42)
+
+
+def test_job_scheduler_failure_and_queued_cancel():
+    jobs, release = JobScheduler(max_workers=1), threading.Event()
+    results = {}
+
+    def record(job): results[job.key] = job.state
+
+    def fail(cancel): raise CheckError("нет файла")
+
+    blocker = jobs.submit("a", lambda cancel: release.wait(TIMEOUT), on_done=record)
+    failing = jobs.submit("b", fail, on_done=record)
+    queued  = jobs.submit("c", lambda cancel: "не должно выполниться", on_done=record)
+    jobs.cancel("c")
+    release.set()
+    assert wait_until(lambda: len(results) == 3)
+    assert results == {"a": "done", "b": "failed", "c": "cancelled"}
+    assert isinstance(failing.error, CheckError) and queued.result is None
+    assert blocker.state == "done"
+    assert [j["key"] for j in jobs.jobs()][:3] == ["c", "b", "a"]
@@ -0,0 +1,24 @@
+"""diff_lists: новый список проверки против старого по ключу ФИО."""
+from datetime import datetime
+
+import pandas as pd
+
+from sfm_core import diff_lists
+
+
+def test_diff_lists():
+    new_fio = pd.Series(["Иванов  Иван", "Петров Петр", "Новый Н", "Сидоров С"])
+    new_dob = pd.Series(["1980-01-01", "1971-01-01", None, datetime(1960, 1, 1)])
+    old_fio = pd.Series(["ИВАНОВ ИВАН", "Петров Петр", "Старый С", "Сидоров С"])
+    old_dob = pd.Series(["1980-01-01", "1972-01-01", "1990-01-01", "1960-01-01"])
+    rows, tags, cnt = diff_lists(new_fio, new_dob, old_fio, old_dob)
+    assert rows == [("НОВЫЙ Н", None, "Добавлен", "", "ДА"),
+                    ("СТАРЫЙ С", "1990-01-01", "Удален", "", "ДА"),
+                    ("ПЕТРОВ ПЕТР", "1971-01-01", "Изменен", "было: 1972-01-01", "ДА")]
+    assert tags == ["red"] * 3
+    assert cnt == {"Добавлен": 1, "Удален": 1, "Изменен": 1}
+
+
+def test_diff_lists_same_lists():
+    fio, dob = pd.Series(["А Б", "В Г"]), pd.Series(["2000-01-01", "2000-01-02"])
+    assert diff_lists(fio, dob, fio[::-1], dob[::-1]) == ([], [], {"Добавлен": 0, "Удален": 0, "Изменен": 0})
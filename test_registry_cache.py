@@ -0,0 +1,69 @@
+"""RegistryCache: блокировки по имени реестра — без сети, сессия подменена."""
+import threading
+import time
+
+from sfm_core import CancelToken, CheckCancelled, RegistryCache
+
+TIMEOUT = 5
+
+
+class SlowResponse:
+    status_code, headers = 200, {}
+
+    def __init__(self, gate):
+        self.gate = gate
+
+    def raise_for_status(self): pass
+
+    def iter_content(self, size):
+        self.gate.wait(TIMEOUT)
+        yield b"PK\x03\x04 registry"
+
+    def close(self): pass
+
+
+class GatedSession:
+    """get() для url из gates ждёт своего события, пока тест его не откроет."""
+
+    def __init__(self, gates):
+        self.gates, self.started = gates, {url: threading.Event() for url in gates}
+
+    def get(self, url, **kw):
+        self.started[url].set()
+        return SlowResponse(self.gates[url])
+
+
+def fetch_in_thread(cache, name, url, cancel=None):
+    out = {}
+    def run():
+        try: out["result"] = cache.fetch(name, url, cancel=cancel)
+        except BaseException as e: out["error"] = e
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t, out
+
+
+def test_different_registries_download_in_parallel(tmp_path):
+    gates = {"banks": threading.Event(), "mfo": threading.Event()}
+    cache = RegistryCache(str(tmp_path), session=GatedSession(gates))
+    banks, _ = fetch_in_thread(cache, "banks.xlsx", "banks")
+    assert cache.session.started["banks"].wait(TIMEOUT)
+    # реестр банков ещё качается — МФО не ждёт его
+    mfo, out = fetch_in_thread(cache, "mfo.xlsx", "mfo")
+    assert cache.session.started["mfo"].wait(TIMEOUT)
+    gates["mfo"].set(); mfo.join(TIMEOUT)
+    assert out["result"][1] == "download"
+    gates["banks"].set(); banks.join(TIMEOUT)
+
+
+def test_waiting_for_same_registry_is_cancellable(tmp_path):
+    gates = {"banks": threading.Event()}
+    cache = RegistryCache(str(tmp_path), session=GatedSession(gates))
+    first, _ = fetch_in_thread(cache, "banks.xlsx", "banks")
+    assert cache.session.started["banks"].wait(TIMEOUT)
+    cancel = CancelToken()
+    second, out = fetch_in_thread(cache, "banks.xlsx", "banks", cancel)
+    time.sleep(0.1)
+    cancel.cancel(); second.join(TIMEOUT)
+    assert isinstance(out.get("error"), CheckCancelled)
+    gates["banks"].set(); first.join(TIMEOUT)
@@ -0,0 +1,56 @@
+"""Сверка с перечнем в sfm_core — без окна и без сети.
+
+    python -m pytest -q
+
+Перечень XML собирается в tmp_path (см. conftest.py). Эталон для сверки
+с перечнем — построчный цикл из check_xml до переноса логики в sfm_core.
+"""
+from datetime import date
+
+from conftest import CLIENTS
+from sfm_core import format_date, normalize, parse_perechen_xml, reconcile_xml
+
+XML_DATE = date(2026, 10, 18)
+
+
+def baseline_xml(fio, dob, excluded, actual, xml_date):
+    """Сверка клиентов с перечнем — как в check_xml до sfm_core, по строке."""
+    rows, tags = [], []
+    cnt = {"В перечне": 0, "Нет в перечне": 0, "Исключен": 0}
+    for f, d in zip(fio, dob):
+        birth, norm = format_date(d), normalize(f)
+        if norm in excluded:
+            rows.append((f, birth, "Исключен", xml_date.strftime("%Y-%m-%d"), "ДА"))
+            tags.append("red"); cnt["Исключен"] += 1
+        elif (norm, birth) in actual:
+            ld = actual[(norm, birth)]; ct = ld == xml_date
+            rows.append((f, birth, "В перечне", ld.strftime("%Y-%m-%d"), "ДА" if ct else "НЕТ"))
+            tags.append("red" if ct else ""); cnt["В перечне"] += 1
+        else:
+            rows.append((f, birth, "Нет в перечне", "", "")); tags.append(""); cnt["Нет в перечне"] += 1
+    return rows, tags, cnt
+
+
+# ════════════════════════════════════════════════════════════════════════════
+#  СВЕРКА С ПЕРЕЧНЕМ
+# ════════════════════════════════════════════════════════════════════════════
+
+def test_parse_perechen_xml(perechen):
+    excluded, actual = parse_perechen_xml(perechen)
+    assert excluded == {"СМИРНОВ СЕМЕН"}
+    assert actual == {("ИВАНОВ ИВАН ИВАНОВИЧ", "1980-01-02"): date(2020, 3, 4),
+                      ("ПЕТРОВ ПЕТР", "1975-05-06"): date(2026, 10, 18),
+                      ("КУЗНЕЦОВ КУЗЬМА", "1966-06-07"): date(2021, 1, 1)}
+
+
+def test_reconcile_xml_matches_baseline(perechen):
+    excluded, actual = parse_perechen_xml(perechen)
+    rows, tags, cnt = reconcile_xml(CLIENTS["ФИО"], CLIENTS["ДатаРождения"], excluded, actual, XML_DATE)
+    assert (rows, tags, cnt) == baseline_xml(CLIENTS["ФИО"], CLIENTS["ДатаРождения"],
+                                             excluded, actual, XML_DATE)
+    assert [r[2:] for r in rows[:4]] == [("В перечне", "2020-03-04", "НЕТ"),
+                                         ("В перечне", "2026-10-18", "ДА"),
+                                         ("Нет в перечне", "", ""),
+                                         ("Нет в перечне", "", "")]   # ДР не совпала
+    assert rows[4][2:] == ("Исключен", "2026-10-18", "ДА")            # Ё/Е и регистр — один ключ
+    assert cnt == {"В перечне": 2, "Нет в перечне": 4, "Исключен": 1}